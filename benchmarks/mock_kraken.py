@@ -0,0 +1,521 @@
+"""
+A local stand-in for the Kraken exchange, to run trade_producer (and the whole
+pipeline behind it) without network access.
+
+It serves, on a single port:
+
+- the v2 WebSocket API at ws://{host}:{port}/v2, with the `trade` channel:
+  status message on connect, one subscribe ack per symbol, trade updates and heartbeats
+- the REST endpoint http://{host}:{port}/0/public/Trades?pair=...&since=...
+  with Kraken's response shape, pages of up to 1000 trades, the `last` cursor in
+  nanoseconds and `EGeneral:Too many requests` errors above the request rate limit
+
+To test how clients recover, it can drop every WebSocket connection after
+`disconnect_every_sec`, and refuse new ones for `outage_sec` after that.
+
+Live trades are stamped with the current wall-clock time, so consumers downstream can
+measure end-to-end latencies, and the REST API serves them too once they happened,
+like the real exchange. The trades before the mock started are deterministic: a group
+of trades every `history_interval_ms`, several of them in the same millisecond like on
+the real exchange, so backfills return the same trades every time.
+
+It only needs the standard library. Run it with:
+
+    python benchmarks/mock_kraken.py --symbols BTC/USD ETH/USD --trades-per-sec 1000
+
+and point trade_producer at it with
+
+    KRAKEN_WS_URL=ws://localhost:8765/v2
+    KRAKEN_REST_URL='http://localhost:8765/0/public/Trades?pair={product_id}&since={since_ns}'
+"""
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import math
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# from RFC 6455, to compute the Sec-WebSocket-Accept header of the handshake
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# no. of trades that share each millisecond of the historical trades
+_TRADES_PER_GROUP = 3
+
+_PAGE_SIZE = 1000
+
+
+class MockKraken:
+    """
+    The state of the mock exchange: the symbols it trades, the pace of the live
+    trades, and the rate limit of the REST API.
+    """
+
+    def __init__(
+        self,
+        symbols: List[str],
+        trades_per_sec: float = 100.0,
+        heartbeat_sec: float = 1.0,
+        history_interval_ms: int = 1000,
+        rest_requests_per_sec: float = 10.0,
+        rest_burst: int = 5,
+        disconnect_every_sec: Optional[float] = None,
+        outage_sec: float = 0.0,
+    ) -> None:
+        """
+        Args:
+            symbols (List[str]): The symbols the exchange trades, e.g. ['BTC/USD'].
+            trades_per_sec (float): Live trades per second, across all the symbols.
+            heartbeat_sec (float): Seconds between two heartbeats on the WebSocket.
+            history_interval_ms (int): Milliseconds between two groups of historical trades.
+            rest_requests_per_sec (float): REST requests per second we serve before
+                answering `Too many requests`.
+            rest_burst (int): Max no. of REST requests served back to back.
+            disconnect_every_sec (Optional[float]): Drop each WebSocket connection after
+                this many seconds. None keeps them open.
+            outage_sec (float): After a dropped connection, refuse new WebSocket
+                connections for this many seconds.
+
+        Returns:
+            None
+        """
+        self.symbols = symbols
+        self.trades_per_sec = trades_per_sec
+        self.heartbeat_sec = heartbeat_sec
+        self.history_interval_ms = history_interval_ms
+        self.disconnect_every_sec = disconnect_every_sec
+        self.outage_sec = outage_sec
+        self._websocket_down_until = 0.0
+
+        self.rest_requests_per_sec = rest_requests_per_sec
+        self.rest_burst = rest_burst
+        self._rest_tokens = float(rest_burst)
+        self._rest_last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+        # counters, for the benchmark report
+        self.n_live_trades = 0
+        self.n_rest_requests = 0
+        self.n_rest_throttled = 0
+        self.n_dropped_connections = 0
+
+        self._next_trade_id = 0
+
+        # the synthetic history stops when the mock starts, then come the live trades,
+        # kept per symbol as (time_ns, price, qty) to serve them on the REST API
+        self.started_ns = time.time_ns()
+        self._live_history = {symbol: [] for symbol in symbols}
+        self._live_history_ns = {symbol: [] for symbol in symbols}
+
+        # the queues of the connected WebSocket clients, which get every live trade
+        self._clients: List[queue.Queue] = []
+
+    def run_market(self) -> None:
+        """
+        Generates the live trades at `trades_per_sec` and sends them to every connected
+        client, whether anyone listens or not. Runs in a background thread.
+        """
+        tick_sec = 0.01
+        start = time.monotonic()
+        n_generated = 0
+
+        while True:
+            n_due = int((time.monotonic() - start) * self.trades_per_sec) - n_generated
+            if n_due > 0:
+                trades = self.live_trades(n_due)
+                n_generated += n_due
+                with self._lock:
+                    for client in self._clients:
+                        client.put(trades)
+
+            time.sleep(tick_sec)
+
+    def connect(self) -> queue.Queue:
+        """
+        Returns the queue a new WebSocket client gets the live trades from.
+        """
+        client: queue.Queue = queue.Queue()
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    def disconnect(self, client: queue.Queue) -> None:
+        with self._lock:
+            self._clients.remove(client)
+
+    def drop_connection(self) -> None:
+        """
+        Records a dropped WebSocket connection, and starts the outage.
+        """
+        with self._lock:
+            self.n_dropped_connections += 1
+            self._websocket_down_until = time.monotonic() + self.outage_sec
+
+    def websocket_is_down(self) -> bool:
+        return time.monotonic() < self._websocket_down_until
+
+    def base_price(self, symbol: str) -> float:
+        # a different, stable price level for each symbol
+        return 100.0 + int(hashlib.md5(symbol.encode()).hexdigest()[:4], 16) % 1000
+
+    def price_at(self, symbol: str, ts_ms: float) -> float:
+        # a slow wave, so candles have some shape
+        return round(self.base_price(symbol) * (1 + 0.01 * math.sin(ts_ms / 60_000)), 2)
+
+    def live_trades(self, n_trades: int) -> List[dict]:
+        """
+        Returns `n_trades` new trades, in the format of the v2 `trade` channel,
+        spread across the symbols and stamped with the current time.
+        """
+        # half a millisecond in, with a different nanosecond for each trade, so the
+        # REST time in seconds and the ISO timestamp truncate to the same millisecond
+        now_ms = time.time_ns() // 1_000_000
+        timestamp = (
+            time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now_ms // 1000))
+            + f'.{now_ms % 1000:03d}500Z'
+        )
+
+        trades = []
+        with self._lock:
+            for i in range(n_trades):
+                symbol = random.choice(self.symbols)
+                trade_ns = now_ms * 1_000_000 + 500_000 + i
+                price = self.price_at(symbol, now_ms)
+                qty = round(random.uniform(0.001, 2.0), 8)
+
+                trades.append({
+                    'symbol': symbol,
+                    'side': random.choice(['buy', 'sell']),
+                    'price': price,
+                    'qty': qty,
+                    'ord_type': 'market',
+                    'trade_id': self._next_trade_id,
+                    'timestamp': timestamp,
+                })
+                self._live_history[symbol].append((trade_ns, price, qty))
+                self._live_history_ns[symbol].append(trade_ns)
+                self._next_trade_id += 1
+            self.n_live_trades += n_trades
+
+        return trades
+
+    def historical_page(self, symbol: str, since_ns: int) -> dict:
+        """
+        Returns the page of historical trades right after `since_ns`, in the shape of
+        the `result` of /0/public/Trades.
+        """
+        interval_ns = self.history_interval_ms * 1_000_000
+
+        # (time_ns, price, qty) of the trades of the page
+        rows = []
+
+        # the synthetic history, before the mock started
+        group = max(0, since_ns // interval_ns)
+        while len(rows) < _PAGE_SIZE:
+            # the trades of a group share one millisecond, half a millisecond in, so
+            # their time in seconds always truncates to the same millisecond
+            group_ns = group * interval_ns + 500_000
+            if group_ns >= self.started_ns:
+                break
+
+            for i in range(_TRADES_PER_GROUP):
+                trade_ns = group_ns + i * 1_000
+                if trade_ns > since_ns:
+                    rows.append((
+                        trade_ns,
+                        self.price_at(symbol, trade_ns // 1_000_000),
+                        round(0.01 * (1 + trade_ns // interval_ns % 7), 8),
+                    ))
+            group += 1
+
+        # then the live trades
+        with self._lock:
+            start = bisect.bisect_right(self._live_history_ns[symbol], since_ns)
+            rows.extend(self._live_history[symbol][start:start + _PAGE_SIZE])
+
+        rows = rows[:_PAGE_SIZE]
+        trades = [
+            [str(price), str(qty), trade_ns / 1e9, 'b', 'l', '', trade_ns // 1_000]
+            for trade_ns, price, qty in rows
+        ]
+
+        return {
+            symbol.replace('/', ''): trades,
+            'last': str(rows[-1][0] if rows else since_ns),
+        }
+
+    def acquire_rest_token(self) -> bool:
+        """
+        Token bucket of the REST API. Returns False if the request is over the limit.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._rest_tokens = min(
+                self.rest_burst,
+                self._rest_tokens + (now - self._rest_last_refill) * self.rest_requests_per_sec,
+            )
+            self._rest_last_refill = now
+
+            self.n_rest_requests += 1
+            if self._rest_tokens < 1:
+                self.n_rest_throttled += 1
+                return False
+
+            self._rest_tokens -= 1
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serves the REST endpoint, and upgrades /v2 requests to a WebSocket connection.
+    """
+
+    exchange: MockKraken
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == '/v2' and self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._serve_websocket()
+
+        if url.path == '/0/public/Trades':
+            return self._serve_trades(parse_qs(url.query))
+
+        self._send_json({'error': ['EGeneral:Unknown method']}, status=404)
+
+    def log_message(self, format, *args):
+        # one line per request is far too much at benchmark rates
+        pass
+
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_trades(self, query: dict) -> None:
+        if not self.exchange.acquire_rest_token():
+            # Kraken answers with HTTP 200 and an error in the body
+            return self._send_json({'error': ['EGeneral:Too many requests']})
+
+        pair = query.get('pair', [''])[0]
+        if pair not in self.exchange.symbols:
+            return self._send_json({'error': ['EQuery:Unknown asset pair']})
+
+        since_ns = int(query.get('since', ['0'])[0])
+        self._send_json({'error': [], 'result': self.exchange.historical_page(pair, since_ns)})
+
+    def _serve_websocket(self) -> None:
+        if self.exchange.websocket_is_down():
+            return self._send_json({'error': ['EService:Unavailable']}, status=503)
+
+        # the handshake of RFC 6455
+        accept = base64.b64encode(
+            hashlib.sha1((self.headers['Sec-WebSocket-Key'] + _WS_GUID).encode()).digest()
+        ).decode()
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            _WebsocketSession(self.exchange, self.rfile, self.wfile).run()
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            # the client went away
+            pass
+
+
+class _WebsocketSession:
+    """
+    One client of the v2 WebSocket API, with the minimal framing we need.
+    """
+
+    def __init__(self, exchange: MockKraken, rfile, wfile) -> None:
+        self.exchange = exchange
+        self.rfile = rfile
+        self.wfile = wfile
+
+    def run(self) -> None:
+        self.send({
+            'channel': 'status',
+            'type': 'update',
+            'data': [{'api_version': 'v2', 'system': 'online', 'version': 'mock'}],
+        })
+
+        # wait for the subscription to the trade channel
+        while True:
+            message = self.recv()
+            if message is None:
+                return
+            if message.get('method') == 'subscribe':
+                break
+
+        params = message.get('params', {})
+        symbols = [symbol for symbol in params.get('symbol', []) if symbol in self.exchange.symbols]
+        for symbol in params.get('symbol', []):
+            ack = {
+                'method': 'subscribe',
+                'result': {'channel': params.get('channel'), 'symbol': symbol, 'snapshot': False},
+                'success': symbol in self.exchange.symbols,
+                'time_in': _now_iso(),
+                'time_out': _now_iso(),
+            }
+            if symbol not in self.exchange.symbols:
+                ack['error'] = f'Currency pair not supported {symbol}'
+            self.send(ack)
+
+        self.stream_trades(symbols)
+
+    def stream_trades(self, symbols: List[str]) -> None:
+        """
+        Sends the trades of the symbols as they happen, and a heartbeat every
+        `heartbeat_sec`, until the client disconnects.
+        """
+        client = self.exchange.connect()
+        connected_at = last_heartbeat = time.monotonic()
+        disconnect_every_sec = self.exchange.disconnect_every_sec
+
+        try:
+            while True:
+                if disconnect_every_sec is not None and time.monotonic() - connected_at >= disconnect_every_sec:
+                    # close the socket without a close frame, like a network failure
+                    self.exchange.drop_connection()
+                    return
+
+                try:
+                    trades = client.get(timeout=self.exchange.heartbeat_sec)
+                    trades = [trade for trade in trades if trade['symbol'] in symbols]
+                    if trades:
+                        self.send({'channel': 'trade', 'type': 'update', 'data': trades})
+                except queue.Empty:
+                    pass
+
+                if time.monotonic() - last_heartbeat >= self.exchange.heartbeat_sec:
+                    self.send({'channel': 'heartbeat'})
+                    last_heartbeat = time.monotonic()
+        finally:
+            self.exchange.disconnect(client)
+
+    def send(self, message: dict) -> None:
+        payload = json.dumps(message).encode()
+
+        # a single unmasked text frame
+        header = bytes([0x81])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack('>H', len(payload))
+        else:
+            header += bytes([127]) + struct.pack('>Q', len(payload))
+
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+    def recv(self) -> Optional[dict]:
+        """
+        Reads one (masked) frame from the client. Returns None if it closed the connection.
+        """
+        while True:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                return None
+
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                (length,) = struct.unpack('>H', self.rfile.read(2))
+            elif length == 127:
+                (length,) = struct.unpack('>Q', self.rfile.read(8))
+
+            mask = self.rfile.read(4) if head[1] & 0x80 else b'\x00' * 4
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+
+            if opcode == 0x8:
+                return None
+            if opcode == 0x1:
+                return json.loads(payload)
+            # pings, pongs and binary frames are ignored
+
+
+def _now_iso() -> str:
+    return datetime.now(tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def start_mock_kraken(
+    exchange: MockKraken, host: str = 'localhost', port: int = 8765
+) -> ThreadingHTTPServer:
+    """
+    Starts the mock exchange in a background thread.
+
+    Args:
+        exchange (MockKraken): The state of the exchange.
+        host (str): The host to listen on.
+        port (int): The port to listen on, for both the WebSocket and the REST API.
+            0 picks a free port, see `server.server_address`.
+
+    Returns:
+        ThreadingHTTPServer: The server. Call `shutdown()` to stop it.
+    """
+    handler = type('Handler', (_Handler,), {'exchange': exchange})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=exchange.run_market, daemon=True).start()
+    logger.info(f'Mock Kraken listening on {host}:{server.server_address[1]}')
+
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--symbols', nargs='+', default=['BTC/USD'])
+    parser.add_argument('--trades-per-sec', type=float, default=100.0)
+    parser.add_argument('--heartbeat-sec', type=float, default=1.0)
+    parser.add_argument('--history-interval-ms', type=int, default=1000)
+    parser.add_argument('--rest-requests-per-sec', type=float, default=10.0)
+    parser.add_argument('--disconnect-every-sec', type=float, default=None)
+    parser.add_argument('--outage-sec', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+
+    server = start_mock_kraken(
+        MockKraken(
+            symbols=args.symbols,
+            trades_per_sec=args.trades_per_sec,
+            heartbeat_sec=args.heartbeat_sec,
+            history_interval_ms=args.history_interval_ms,
+            rest_requests_per_sec=args.rest_requests_per_sec,
+            disconnect_every_sec=args.disconnect_every_sec,
+            outage_sec=args.outage_sec,
+        ),
+        host=args.host,
+        port=args.port,
+    )
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,251 @@
+"""
+Scaling benchmark of trade_to_ohlc with 1 to N worker processes (NUM_WORKERS), on the
+same replayed trades:
+
+    trades file -> trade_producer (replay, as fast as possible) -> trades topic with P partitions
+    trades topic -> trade_to_ohlc with n workers -> candles topic, for each n
+
+The trades are loaded once, into a topic with `--partitions` partitions (keyed by
+product, like the live trades). Then for each no. of workers, trade_to_ohlc reads them
+all from the start (a fresh consumer group and candles topic every time) and we report:
+
+- the no. of candles, which must be the same for every no. of workers
+- candles/s and trades/s, from the first candle in the candles topic to the last one
+  (so the start-up of the workers and the first rebalance are not counted)
+- the speed-up over 1 worker
+
+The trades are either synthetic (`--n-trades` trades over `--n-products` products, a
+random walk each) or recorded ones (`--replay-path` and `--products`, parquet or JSONL,
+see trade_producer's replay mode). There should be at least as many products and
+partitions as workers, or some workers have nothing to do.
+
+It needs a Kafka broker, e.g. `make start-redpanda` in docker-compose/ (external port 19092).
+
+    python benchmarks/ohlc_scaling_benchmark.py --broker localhost:19092 --workers 1 2 4 8 --n-trades 2000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+
+from pipeline_benchmark import start_service
+
+# seconds between two counts of the candles
+_POLL_INTERVAL_SEC = 0.5
+
+
+def write_synthetic_trades(path: Path, n_trades: int, n_products: int, trades_per_sec: float) -> List[str]:
+    """
+    Writes `n_trades` trades of `n_products` products to a JSONL file, as we produce
+    them to Kafka, `trades_per_sec` trades per second in event time.
+
+    Returns:
+        List[str]: The products.
+    """
+    rng = np.random.default_rng(0)
+    products = [f'P{i:03d}/USD' for i in range(n_products)]
+
+    product_index = rng.integers(0, n_products, size=n_trades)
+    timestamp_ms = 1_700_000_000_000 + (np.arange(n_trades) * 1000 / trades_per_sec).astype(np.int64)
+    quantity = rng.exponential(0.1, size=n_trades)
+
+    # a random walk per product, starting at 100
+    log_returns = rng.normal(0, 1e-4, size=n_trades)
+    price = np.empty(n_trades)
+    for i in range(n_products):
+        is_product = product_index == i
+        price[is_product] = 100 * np.exp(np.cumsum(log_returns[is_product]))
+
+    with open(path, 'w') as f:
+        for p, q, ts, pi in zip(price.tolist(), quantity.tolist(), timestamp_ms.tolist(), product_index.tolist()):
+            f.write(json.dumps({'product_id': products[pi], 'price': p, 'quantity': q, 'timestamp_ms': ts}) + '\n')
+
+    return products
+
+
+def load_trades(broker: str, topic: str, replay_path: str, products: List[str], partitions: int, encoding: str) -> None:
+    """
+    Produces the trades of `replay_path` to a new topic with `partitions` partitions,
+    with trade_producer's replay mode, and waits until they are all in the topic.
+    """
+    producer = start_service('trade_producer', {
+        'KAFKA_BROKER_ADDRESS': broker,
+        'KAFKA_TOPIC': topic,
+        'KAFKA_TOPIC_ENCODING': encoding,
+        'KAFKA_TOPIC_PARTITIONS': str(partitions),
+        'PRODUCT_ID': json.dumps(products),
+        'LIVE_OR_HISTORICAL': 'replay',
+        'REPLAY_PATH': replay_path,
+        'REPLAY_SPEED': '0',
+    })
+    # a replay is a bounded job: it stops once every trade is delivered
+    if producer.wait() != 0:
+        raise RuntimeError('trade_producer failed to load the trades, see its logs above')
+
+
+def run_workers(
+    broker: str,
+    trades_topic: str,
+    n_trades: int,
+    num_workers: int,
+    partitions: int,
+    window_seconds: int,
+    encoding: str,
+    processing_mode: str,
+    idle_timeout_sec: float,
+) -> dict:
+    """
+    Runs trade_to_ohlc with `num_workers` workers on all the trades of `trades_topic`.
+
+    Returns:
+        dict: The results.
+    """
+    from confluent_kafka import Consumer
+
+    run_id = uuid.uuid4().hex[:8]
+    candles_topic = f'benchmark_candles_{run_id}'
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        service = start_service('trade_to_ohlc', {
+            'KAFKA_BROKER_ADDRESS': broker,
+            'KAFKA_INPUT_TOPIC': trades_topic,
+            'KAFKA_OUTPUT_TOPIC': candles_topic,
+            'KAFKA_CONSUMER_GROUP': f'benchmark_trade_to_ohlc_{run_id}',
+            'KAFKA_OUTPUT_TOPIC_ENCODING': encoding,
+            'KAFKA_TOPIC_PARTITIONS': str(partitions),
+            'OHLCV_WINDOW_SECONDS': str(window_seconds),
+            'PROCESSING_MODE': processing_mode,
+            'AUTO_OFFSET_RESET': 'earliest',
+            'NUM_WORKERS': str(num_workers),
+            'STATE_DIR': state_dir,
+        })
+
+        # we only count the candles, from the watermarks of the topic, so that reading
+        # them does not hold back the workers
+        consumer = Consumer({'bootstrap.servers': broker, 'group.id': f'benchmark_watermarks_{run_id}'})
+        try:
+            first_candle_at: Optional[float] = None
+            last_candle_at: Optional[float] = None
+            n_candles = 0
+            while last_candle_at is None or time.monotonic() - last_candle_at < idle_timeout_sec:
+                if service.poll() is not None:
+                    raise RuntimeError('trade_to_ohlc stopped, see its logs above')
+
+                time.sleep(_POLL_INTERVAL_SEC)
+                size = _topic_size(consumer, candles_topic)
+                if size > n_candles:
+                    now = time.monotonic()
+                    first_candle_at = first_candle_at or now
+                    last_candle_at = now
+                    n_candles = size
+        finally:
+            consumer.close()
+            service.terminate()
+            service.wait()
+
+    elapsed = max(last_candle_at - first_candle_at, _POLL_INTERVAL_SEC)
+    return {
+        'workers': num_workers,
+        'candles': n_candles,
+        'seconds': elapsed,
+        'candles_per_sec': n_candles / elapsed,
+        'trades_per_sec': n_trades / elapsed,
+    }
+
+
+def _topic_size(consumer, topic: str) -> int:
+    """
+    Returns the no. of messages in the topic, from the watermarks of its partitions,
+    or 0 if it does not exist yet.
+    """
+    from confluent_kafka import TopicPartition
+
+    metadata = consumer.list_topics(topic, timeout=10)
+    if metadata.topics[topic].error is not None:
+        return 0
+
+    n_messages = 0
+    for partition in metadata.topics[topic].partitions:
+        low, high = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+        n_messages += high - low
+    return n_messages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', default='localhost:19092')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 4])
+    parser.add_argument('--partitions', type=int, default=None,
+                        help='partitions of the trades topic, defaults to the max no. of workers')
+    parser.add_argument('--replay-path', default=None, help='recorded trades, instead of synthetic ones')
+    parser.add_argument('--products', nargs='+', default=None, help='the products of the recorded trades')
+    parser.add_argument('--n-trades', type=int, default=1_000_000)
+    parser.add_argument('--n-products', type=int, default=64)
+    parser.add_argument('--trades-per-sec', type=float, default=1000.0,
+                        help='event-time rate of the synthetic trades')
+    parser.add_argument('--window-seconds', type=int, default=1)
+    parser.add_argument('--encoding', default='struct', choices=['json', 'msgpack', 'struct'])
+    parser.add_argument('--processing-mode', default='streaming', choices=['streaming', 'batch'])
+    parser.add_argument('--idle-timeout', type=float, default=10.0,
+                        help='seconds without a new candle after which a run is done')
+    args = parser.parse_args()
+
+    workers = sorted(set(args.workers))
+    partitions = args.partitions or max(workers)
+    trades_topic = f'benchmark_trades_{uuid.uuid4().hex[:8]}'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.replay_path is None:
+            replay_path = str(Path(tmp_dir) / 'trades.jsonl')
+            products = write_synthetic_trades(
+                Path(replay_path), args.n_trades, args.n_products, args.trades_per_sec
+            )
+        else:
+            if not args.products:
+                parser.error('--products is needed with --replay-path')
+            replay_path = args.replay_path
+            products = args.products
+
+        logger.info(f'Loading the trades into {trades_topic}, with {partitions} partitions')
+        load_trades(args.broker, trades_topic, replay_path, products, partitions, args.encoding)
+
+    from confluent_kafka import Consumer
+
+    consumer = Consumer({'bootstrap.servers': args.broker, 'group.id': 'benchmark_watermarks'})
+    n_trades = _topic_size(consumer, trades_topic)
+    consumer.close()
+    logger.info(f'{n_trades} trades in {trades_topic}')
+
+    results = []
+    for num_workers in workers:
+        logger.info(f'Running trade_to_ohlc with {num_workers} workers')
+        results.append(run_workers(
+            broker=args.broker,
+            trades_topic=trades_topic,
+            n_trades=n_trades,
+            num_workers=num_workers,
+            partitions=partitions,
+            window_seconds=args.window_seconds,
+            encoding=args.encoding,
+            processing_mode=args.processing_mode,
+            idle_timeout_sec=args.idle_timeout,
+        ))
+
+    baseline = results[0]['candles_per_sec']
+    logger.info(f'{"workers":>8} {"candles":>10} {"seconds":>8} {"candles/s":>10} {"trades/s":>10} {"speed-up":>8}')
+    for result in results:
+        logger.info(
+            f"{result['workers']:>8} {result['candles']:>10} {result['seconds']:>8.1f} "
+            f"{result['candles_per_sec']:>10.0f} {result['trades_per_sec']:>10.0f} "
+            f"{result['candles_per_sec'] / baseline:>7.2f}x"
+        )
+
+    if len({result['candles'] for result in results}) > 1:
+        logger.error('The no. of candles depends on the no. of workers, the runs did not build the same candles')
@@ -0,0 +1,269 @@
+"""
+End-to-end benchmark of the feature pipeline against the local mock exchange:
+
+    mock_kraken -> trade_producer -> trade_to_ohlc -> topic_to_feature_store
+
+It starts the mock exchange, runs every service as a subprocess (with `poetry run`,
+in its own directory, like the Makefiles do) on fresh topics, reads the candles topic
+and reports:
+
+- trades/s the mock exchange sent, and trades/s that made it to the trades topic
+- candles/s written to the candles topic
+- trade-to-candle latency: the time between the end of a candle's window (the mock
+  exchange stamps trades with the wall-clock time) and the moment the candle
+  can be read from the candles topic. p50/p95/p99/max.
+- how far topic_to_feature_store got through the candles (committed offsets of its
+  consumer group), if it runs
+
+It needs a Kafka broker, e.g. `make start-redpanda` in docker-compose/ (external port 19092).
+
+    python benchmarks/pipeline_benchmark.py --broker localhost:19092 --trades-per-sec 5000 --duration 60
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+from quixstreams import Application
+
+sys.path.insert(0, str(Path(__file__).parent))
+from mock_kraken import MockKraken, start_mock_kraken  # noqa: E402
+
+SERVICES_DIR = Path(__file__).parent.parent / 'services'
+
+# the candles may be in any of our wire formats
+sys.path.insert(0, str(SERVICES_DIR / 'trade_to_ohlc'))
+from src.wire_format import decode  # noqa: E402
+
+
+def start_service(name: str, env: Dict[str, str]) -> subprocess.Popen:
+    """
+    Starts a service of the pipeline, with the given environment variables on top of ours.
+    """
+    logger.info(f'Starting {name}')
+    return subprocess.Popen(
+        ['poetry', 'run', 'python', 'src/main.py'],
+        cwd=SERVICES_DIR / name,
+        env={**os.environ, **env},
+    )
+
+
+def committed_offsets(broker: str, consumer_group: str, topic: str) -> int:
+    """
+    Returns the no. of messages of the topic the consumer group has committed.
+    """
+    from confluent_kafka import Consumer, TopicPartition
+
+    consumer = Consumer({'bootstrap.servers': broker, 'group.id': consumer_group})
+    try:
+        metadata = consumer.list_topics(topic, timeout=10)
+        partitions = [TopicPartition(topic, p) for p in metadata.topics[topic].partitions]
+        return sum(max(tp.offset, 0) for tp in consumer.committed(partitions, timeout=10))
+    finally:
+        consumer.close()
+
+
+def run_benchmark(
+    broker: str,
+    symbols: List[str],
+    trades_per_sec: float,
+    duration_sec: float,
+    window_seconds: int,
+    encoding: str,
+    with_feature_store: bool,
+    port: int,
+    feature_store_backend: str = 'hopsworks',
+) -> dict:
+    """
+    Runs the pipeline against the mock exchange for `duration_sec` seconds.
+
+    Args:
+        broker (str): The Kafka broker address.
+        symbols (List[str]): The symbols the mock exchange trades.
+        trades_per_sec (float): Trades per second the mock exchange sends.
+        duration_sec (float): How long we measure.
+        window_seconds (int): The candle window of trade_to_ohlc.
+        encoding (str): The wire format of the trades and candles topics.
+        with_feature_store (bool): Also run topic_to_feature_store on the candles.
+        port (int): The port of the mock exchange.
+        feature_store_backend (str): The backend of topic_to_feature_store, 'hopsworks'
+            or 'local' (an embedded feature store in a temporary directory).
+
+    Returns:
+        dict: The results.
+    """
+    exchange = MockKraken(symbols=symbols, trades_per_sec=trades_per_sec)
+    server = start_mock_kraken(exchange, port=port)
+    port = server.server_address[1]
+
+    # fresh topics and consumer groups for every run
+    run_id = uuid.uuid4().hex[:8]
+    trades_topic = f'benchmark_trades_{run_id}'
+    candles_topic = f'benchmark_candles_{run_id}'
+
+    services = [
+        start_service('trade_to_ohlc', {
+            'KAFKA_BROKER_ADDRESS': broker,
+            'KAFKA_INPUT_TOPIC': trades_topic,
+            'KAFKA_OUTPUT_TOPIC': candles_topic,
+            'KAFKA_CONSUMER_GROUP': f'benchmark_trade_to_ohlc_{run_id}',
+            'KAFKA_OUTPUT_TOPIC_ENCODING': encoding,
+            'OHLCV_WINDOW_SECONDS': str(window_seconds),
+        }),
+        start_service('trade_producer', {
+            'KAFKA_BROKER_ADDRESS': broker,
+            'KAFKA_TOPIC': trades_topic,
+            'KAFKA_TOPIC_ENCODING': encoding,
+            'PRODUCT_ID': json.dumps(symbols),
+            'LIVE_OR_HISTORICAL': 'live',
+            'KRAKEN_WS_URL': f'ws://localhost:{port}/v2',
+        }),
+    ]
+    feature_store_group = f'benchmark_topic_to_feature_store_{run_id}'
+    local_feature_store_dir = tempfile.TemporaryDirectory()
+    if with_feature_store:
+        services.append(start_service('topic_to_feature_store', {
+            'KAFKA_BROKER_ADDRESS': broker,
+            'KAFKA_INPUT_TOPIC': candles_topic,
+            'KAFKA_CONSUMER_GROUP': feature_store_group,
+            'FEATURE_STORE_BACKEND': feature_store_backend,
+            'LOCAL_FEATURE_STORE_PATH': local_feature_store_dir.name,
+        }))
+
+    app = Application(
+        broker_address=broker,
+        consumer_group=f'benchmark_reader_{run_id}',
+        auto_offset_reset='earliest',
+    )
+
+    latencies_ms = []
+    n_candles = 0
+    try:
+        with app.get_consumer() as consumer:
+            consumer.subscribe(topics=[candles_topic])
+
+            # the clock starts when the first candle comes out of the pipeline
+            start = None
+            n_trades_at_start = 0
+            while start is None or time.monotonic() - start < duration_sec:
+                if any(service.poll() is not None for service in services):
+                    raise RuntimeError('A service of the pipeline stopped, see its logs above')
+
+                msg = consumer.poll(0.1)
+                if msg is None:
+                    continue
+                if msg.error():
+                    logger.error(msg.error())
+                    continue
+
+                candle = decode(msg.value())
+
+                if start is None:
+                    # the first candles include the start-up of the services, we skip them
+                    start = time.monotonic()
+                    n_trades_at_start = exchange.n_live_trades
+                    continue
+
+                latencies_ms.append(time.time() * 1000 - candle['timestamp_ms'])
+                n_candles += 1
+
+            elapsed = time.monotonic() - start
+            n_exchange_trades = exchange.n_live_trades - n_trades_at_start
+
+        n_topic_trades = _count_messages(broker, trades_topic)
+        n_topic_candles = _count_messages(broker, candles_topic)
+        n_stored_candles = (
+            committed_offsets(broker, feature_store_group, candles_topic)
+            if with_feature_store
+            else None
+        )
+
+    finally:
+        for service in services:
+            service.terminate()
+        for service in services:
+            service.wait()
+        server.shutdown()
+        local_feature_store_dir.cleanup()
+
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        'exchange_trades_per_sec': n_exchange_trades / elapsed,
+        'trades_in_topic': n_topic_trades,
+        'candles_per_sec': n_candles / elapsed,
+        'candles_in_topic': n_topic_candles,
+        'candles_in_feature_store': n_stored_candles,
+        'trade_to_candle_latency_ms': {
+            'p50': p50, 'p95': p95, 'p99': p99, 'max': max(latencies_ms),
+        },
+    }
+
+
+def _count_messages(broker: str, topic: str) -> int:
+    """
+    Returns the no. of messages in the topic, from the watermarks of its partitions.
+    """
+    from confluent_kafka import Consumer, TopicPartition
+
+    consumer = Consumer({'bootstrap.servers': broker, 'group.id': 'benchmark_watermarks'})
+    try:
+        metadata = consumer.list_topics(topic, timeout=10)
+        n_messages = 0
+        for partition in metadata.topics[topic].partitions:
+            low, high = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+            n_messages += high - low
+        return n_messages
+    finally:
+        consumer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', default='localhost:19092')
+    parser.add_argument('--symbols', nargs='+', default=['BTC/USD', 'ETH/USD'])
+    parser.add_argument('--trades-per-sec', type=float, default=1000.0)
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--window-seconds', type=int, default=1)
+    parser.add_argument('--encoding', default='json', choices=['json', 'msgpack', 'struct'])
+    parser.add_argument('--with-feature-store', action='store_true',
+                        help='also run topic_to_feature_store (needs its credentials.env with hopsworks)')
+    parser.add_argument('--feature-store-backend', default='hopsworks', choices=['hopsworks', 'local'],
+                        help='local writes to an embedded feature store, without Hopsworks')
+    parser.add_argument('--port', type=int, default=0, help='port of the mock exchange, 0 for any')
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        broker=args.broker,
+        symbols=args.symbols,
+        trades_per_sec=args.trades_per_sec,
+        duration_sec=args.duration,
+        window_seconds=args.window_seconds,
+        encoding=args.encoding,
+        with_feature_store=args.with_feature_store,
+        port=args.port,
+        feature_store_backend=args.feature_store_backend,
+    )
+
+    latency = results['trade_to_candle_latency_ms']
+    logger.info(
+        f"Exchange: {results['exchange_trades_per_sec']:.1f} trades/s, "
+        f"{results['trades_in_topic']} trades in the topic"
+    )
+    logger.info(
+        f"trade_to_ohlc: {results['candles_per_sec']:.1f} candles/s, "
+        f"{results['candles_in_topic']} candles in the topic"
+    )
+    logger.info(
+        f"Trade-to-candle latency: p50={latency['p50']:.0f}ms p95={latency['p95']:.0f}ms "
+        f"p99={latency['p99']:.0f}ms max={latency['max']:.0f}ms"
+    )
+    if results['candles_in_feature_store'] is not None:
+        logger.info(f"topic_to_feature_store: {results['candles_in_feature_store']} candles committed")
@@ -0,0 +1,177 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+from loguru import logger
+
+from src.indicators import FEATURE_NAMES, Indicators
+from src.wire_format import INDICATORS_V1, decode, encode
+
+# the row of the series and its candle timestamp, packed in one int64 so that a single
+# running max tracks the latest candle of every series
+_ROW_SHIFT = 42
+
+
+class BatchIndicators:
+    """
+    Adds the indicators to chunks of candles, the same as the streaming mode does one
+    candle at a time:
+    - a series is the candles of one product at one window size, in the order they come in
+    - only the final candles count, and a candle that is not after the last one of its
+      series (e.g. sent again after a restart of trade_to_ohlc) is skipped
+
+    The indicators are recurrences (EMA, RSI) or running sums, so we do not vectorize
+    them along time, which would change the rounding. The candles of a chunk are taken
+    by rank in their series instead: the 1st candle of every series at once, then the
+    2nd one, and so on, each step being one vectorized `Indicators.update`.
+    """
+
+    def __init__(self, indicators: Indicators) -> None:
+        """
+        Args:
+            indicators (Indicators): The indicators to compute.
+
+        Returns:
+            None
+        """
+        self.indicators = indicators
+        self.state = indicators.new_state(0)
+
+        # the row of each series in the state, by (product_id, window_seconds)
+        self._rows: Dict[Tuple[str, int], int] = {}
+
+    def add(self, candles: List[dict]) -> List[dict]:
+        """
+        Adds a chunk of candles, in the order they came in.
+
+        Args:
+            candles (List[dict]): The candles.
+
+        Returns:
+            List[dict]: The final candles that are new in their series, with their
+                indicators, in the order of their series.
+        """
+        candles = [candle for candle in candles if candle.get('is_final', True)]
+        if not candles:
+            return []
+
+        rows = np.array([self._row(candle['product_id'], candle['window_seconds']) for candle in candles])
+        timestamp_ms = np.array([candle['timestamp_ms'] for candle in candles], dtype=np.int64)
+        close = np.array([candle['close'] for candle in candles], dtype=np.float64)
+
+        # group the candles by series, keeping their order within each series
+        order = np.argsort(rows, kind='stable')
+        rows, timestamp_ms, close = rows[order], timestamp_ms[order], close[order]
+
+        # skip the candles that are not after the latest one of their series so far
+        packed = (rows << _ROW_SHIFT) + timestamp_ms
+        latest = np.maximum.accumulate(packed)
+        same_series = np.r_[False, rows[1:] == rows[:-1]]
+        latest_before = np.where(same_series, np.r_[0, latest[:-1]] - (rows << _ROW_SHIFT), -1)
+        latest_before = np.maximum(latest_before, self.state['last_timestamp_ms'][rows])
+        is_new = timestamp_ms > latest_before
+        if not is_new.all():
+            logger.debug(f'Skipping {(~is_new).sum()} candles we already have')
+        order, rows, timestamp_ms, close = (a[is_new] for a in (order, rows, timestamp_ms, close))
+
+        # the rank of each candle in its series
+        is_first = np.r_[True, rows[1:] != rows[:-1]]
+        first = np.maximum.accumulate(np.where(is_first, np.arange(len(rows)), 0))
+        rank = np.arange(len(rows)) - first
+
+        features = {name: np.empty(len(rows)) for name in FEATURE_NAMES}
+        by_rank = np.argsort(rank, kind='stable')
+        bounds = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2 if len(rank) else 1))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            step = by_rank[start:end]
+            step_features = self.indicators.update(self.state, rows[step], close[step], timestamp_ms[step])
+            for name, values in step_features.items():
+                features[name][step] = values
+
+        features = {name: values.tolist() for name, values in features.items()}
+        return [
+            {**candles[i], **{name: features[name][j] for name in FEATURE_NAMES}}
+            for j, i in enumerate(order.tolist())
+        ]
+
+    def _row(self, product_id: str, window_seconds: int) -> int:
+        """
+        Returns the row of the series in the state, adding it if it is new.
+        """
+        key = (product_id, window_seconds)
+        if key not in self._rows:
+            self._rows[key] = len(self._rows)
+            new_row = self.indicators.new_state(1)
+            self.state = {name: np.concatenate([self.state[name], new_row[name]]) for name in self.state}
+        return self._rows[key]
+
+
+def add_indicators_batch(
+    app,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    indicators: Indicators,
+    kafka_output_topic_encoding: str = 'json',
+    batch_max_messages: int = 100_000,
+    batch_timeout_sec: float = 1.0,
+) -> None:
+    """
+    Batch mode of ohlc_to_indicators, for the historical candles. Reads the candles in
+    chunks of up to `batch_max_messages`, adds their indicators with BatchIndicators and
+    sends them to the output topic.
+
+    The indicators of a candle depend on all the candles of its series before it, and
+    the state of the series is only kept in memory. So we never commit offsets: every
+    run reads the candles from the start of the topic and sends the same values again,
+    which the feature store upserts by primary key.
+
+    Args:
+        app (Application): The Quix Streams application, with the consumer group.
+        kafka_input_topic (str): The topic of the candles.
+        kafka_output_topic (str): The topic of the candles with their indicators.
+        indicators (Indicators): The indicators to compute.
+        kafka_output_topic_encoding (str): Wire format of the output.
+        batch_max_messages (int): Max no. of candles in a chunk.
+        batch_timeout_sec (float): Max no. of seconds we wait to fill a chunk.
+
+    Returns:
+        None
+    """
+    batch = BatchIndicators(indicators)
+
+    with app.get_consumer(auto_commit_enable=False) as consumer, app.get_producer() as producer:
+        consumer.subscribe(topics=[kafka_input_topic])
+
+        while True:
+            messages = _poll_chunk(consumer, batch_max_messages, batch_timeout_sec)
+            if not messages:
+                continue
+
+            candles = batch.add([decode(msg.value()) for msg in messages])
+            for candle in candles:
+                producer.produce(
+                    topic=kafka_output_topic,
+                    key=candle['product_id'],
+                    value=encode(candle, INDICATORS_V1, kafka_output_topic_encoding),
+                )
+            producer.flush()
+            logger.debug(f'{len(messages)} candles -> {len(candles)} candles with indicators')
+
+
+def _poll_chunk(consumer, max_messages: int, timeout_sec: float) -> list:
+    """
+    Polls up to `max_messages` messages, for at most `timeout_sec` seconds.
+    """
+    import time
+
+    messages = []
+    deadline = time.monotonic() + timeout_sec
+    while len(messages) < max_messages and time.monotonic() < deadline:
+        msg = consumer.poll(0.1)
+        if msg is None:
+            continue
+        if msg.error():
+            logger.error(msg.error())
+            continue
+        messages.append(msg)
+
+    return messages
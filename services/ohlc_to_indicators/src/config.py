@@ -0,0 +1,33 @@
+from typing import Optional
+
+from pydantic_settings import BaseSettings
+
+
+class AppConfig(BaseSettings):
+
+    kafka_broker_address: str
+    kafka_input_topic: str
+    kafka_output_topic: str
+    kafka_consumer_group: str
+    # wire format of the candles with indicators we produce: 'json' (the default),
+    # 'msgpack' or 'struct'
+    kafka_output_topic_encoding: Optional[str] = 'json'
+    # 'streaming' (one candle at a time, state in the state store) or 'batch' (chunks
+    # of up to batch_max_messages candles, from the start of the topic, for the
+    # historical candles). Same values either way
+    processing_mode: Optional[str] = 'streaming'
+    batch_max_messages: Optional[int] = 100_000
+    batch_timeout_sec: Optional[float] = 1.0
+
+    # periods of the indicators, in candles
+    ema_fast_period: Optional[int] = 12
+    ema_slow_period: Optional[int] = 26
+    rsi_period: Optional[int] = 14
+    volatility_window: Optional[int] = 20
+    # log_return_k is the log return over return_steps candles
+    return_steps: Optional[int] = 5
+
+    class Config:
+        env_file = ".env"
+
+config = AppConfig()
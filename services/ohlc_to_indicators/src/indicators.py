@@ -0,0 +1,164 @@
+from typing import Dict
+
+import numpy as np
+
+FEATURE_NAMES = ('ema_fast', 'ema_slow', 'rsi', 'volatility', 'log_return', 'log_return_k')
+
+
+class Indicators:
+    """
+    Technical indicators of candle series, updated in O(1) per candle from a small state
+    per series (the candles of one product, at one window size):
+
+    - ema_fast, ema_slow: exponential moving averages of the close over `ema_fast_period`
+      and `ema_slow_period` candles (alpha = 2 / (period + 1)), from the first close on
+    - rsi: relative strength index over `rsi_period` candles, with Wilder's smoothing of
+      the gains and losses (alpha = 1 / period) from the first change on
+    - volatility: standard deviation of the log returns of the last `volatility_window`
+      candles, from running sums over a ring buffer of these returns
+    - log_return, log_return_k: log return of the close over 1 and over `return_steps`
+      candles, from a ring buffer of the last closes
+
+    An indicator is NaN until its series has enough candles: 2 for log_return,
+    `return_steps + 1` for log_return_k, `rsi_period + 1` for rsi and
+    `volatility_window + 1` for volatility.
+
+    The state of many series is kept in arrays, one row per series, and `update` takes
+    one candle of each of a set of rows. The streaming mode updates one row at a time,
+    the batch mode all the series of a chunk at once, with the very same operations, so
+    both give the same floats.
+    """
+
+    def __init__(
+        self,
+        ema_fast_period: int = 12,
+        ema_slow_period: int = 26,
+        rsi_period: int = 14,
+        volatility_window: int = 20,
+        return_steps: int = 5,
+    ) -> None:
+        """
+        Args:
+            ema_fast_period (int): The no. of candles of the fast EMA.
+            ema_slow_period (int): The no. of candles of the slow EMA.
+            rsi_period (int): The no. of candles of the RSI.
+            volatility_window (int): The no. of log returns of the volatility, at least 2.
+            return_steps (int): The no. of candles of log_return_k.
+
+        Returns:
+            None
+        """
+        if min(ema_fast_period, ema_slow_period, rsi_period, return_steps) < 1 or volatility_window < 2:
+            raise ValueError('The periods must be at least 1, and the volatility window at least 2')
+
+        self.rsi_period = rsi_period
+        self.volatility_window = volatility_window
+        self.return_steps = return_steps
+
+        self._ema_alphas = np.array([2 / (ema_fast_period + 1), 2 / (ema_slow_period + 1)])
+
+    def new_state(self, n_series: int) -> Dict[str, np.ndarray]:
+        """
+        Returns the state of `n_series` series without candles.
+        """
+        return {
+            'n_candles': np.zeros(n_series, dtype=np.int64),
+            'last_timestamp_ms': np.full(n_series, -1, dtype=np.int64),
+            # the last `return_steps` closes, the one of candle i at i % return_steps
+            'closes': np.zeros((n_series, self.return_steps)),
+            'ema': np.zeros((n_series, 2)),
+            'avg_gain': np.zeros(n_series),
+            'avg_loss': np.zeros(n_series),
+            # the last `volatility_window` log returns, the one of candle i at (i - 1) % window
+            'returns': np.zeros((n_series, self.volatility_window)),
+            'sum_returns': np.zeros(n_series),
+            'sum_squared_returns': np.zeros(n_series),
+        }
+
+    def update(
+        self,
+        state: Dict[str, np.ndarray],
+        rows: np.ndarray,
+        close: np.ndarray,
+        timestamp_ms: np.ndarray,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Adds the next candle of each of the series in `rows`.
+
+        Args:
+            state (Dict[str, np.ndarray]): The state of the series. Updated in place.
+            rows (np.ndarray): The rows of the series, each one at most once.
+            close (np.ndarray): The close of the next candle of each series.
+            timestamp_ms (np.ndarray): The timestamp of the next candle of each series.
+
+        Returns:
+            Dict[str, np.ndarray]: The indicators of these candles, by name (FEATURE_NAMES).
+        """
+        index = np.arange(len(rows))
+
+        # the no. of candles of each series before this one
+        n = state['n_candles'][rows]
+        has_prev = n > 0
+
+        closes = state['closes'][rows]
+        prev_close = np.where(has_prev, closes[index, (n - 1) % self.return_steps], close)
+        close_k_ago = closes[index, n % self.return_steps]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 0 for the first candle, which has no previous close
+            log_return = np.log(close / prev_close)
+            log_return_k = np.where(n >= self.return_steps, np.log(close / close_k_ago), np.nan)
+
+        # EMAs, from the first close on
+        ema = state['ema'][rows]
+        ema = np.where(
+            has_prev[:, None], ema + self._ema_alphas * (close[:, None] - ema), close[:, None]
+        )
+
+        # RSI: Wilder's averages of the gains and the losses, from the first change on
+        change = close - prev_close
+        gain = np.maximum(change, 0.0)
+        loss = np.maximum(-change, 0.0)
+        avg_gain = state['avg_gain'][rows]
+        avg_loss = state['avg_loss'][rows]
+        avg_gain = np.where(n == 1, gain, avg_gain + (gain - avg_gain) / self.rsi_period)
+        avg_loss = np.where(n == 1, loss, avg_loss + (loss - avg_loss) / self.rsi_period)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(avg_gain + avg_loss > 0, 100 * avg_gain / (avg_gain + avg_loss), 50.0)
+        rsi = np.where(n >= self.rsi_period, rsi, np.nan)
+
+        # volatility: the log return replaces the one `volatility_window` candles ago in
+        # the running sums
+        returns = state['returns'][rows]
+        slot = (n - 1) % self.volatility_window
+        oldest = np.where(n > self.volatility_window, returns[index, slot], 0.0)
+        new = np.where(has_prev, log_return, 0.0)
+        sum_returns = state['sum_returns'][rows] + new - oldest
+        sum_squared_returns = state['sum_squared_returns'][rows] + new * new - oldest * oldest
+        returns[index, slot] = np.where(has_prev, new, returns[index, slot])
+        variance = (
+            sum_squared_returns - sum_returns * sum_returns / self.volatility_window
+        ) / (self.volatility_window - 1)
+        volatility = np.where(n >= self.volatility_window, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+        closes[index, n % self.return_steps] = close
+
+        # save the state of the series
+        state['n_candles'][rows] = n + 1
+        state['last_timestamp_ms'][rows] = timestamp_ms
+        state['closes'][rows] = closes
+        state['ema'][rows] = ema
+        state['avg_gain'][rows] = avg_gain
+        state['avg_loss'][rows] = avg_loss
+        state['returns'][rows] = returns
+        state['sum_returns'][rows] = sum_returns
+        state['sum_squared_returns'][rows] = sum_squared_returns
+
+        return {
+            'ema_fast': ema[:, 0],
+            'ema_slow': ema[:, 1],
+            'rsi': rsi,
+            'volatility': volatility,
+            'log_return': np.where(has_prev, log_return, np.nan),
+            'log_return_k': log_return_k,
+        }
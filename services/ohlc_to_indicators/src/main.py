@@ -0,0 +1,137 @@
+from typing import List
+
+import numpy as np
+from loguru import logger
+from quixstreams import Application
+
+from src.indicators import Indicators
+from src.wire_format import INDICATORS_V1, WireDeserializer, WireSerializer
+
+
+def add_indicators(candle: dict, state, indicators: Indicators) -> List[dict]:
+    """
+    Updates the state of the candle's series, kept in the state of its key (the
+    product), and returns the candle with its indicators
+    """
+    key = f'indicators_{candle["window_seconds"]}'
+    series = state.get(key)
+    if series is None:
+        series = indicators.new_state(1)
+    else:
+        series = {name: np.array(values) for name, values in series.items()}
+
+    if series['n_candles'][0] > 0 and candle['timestamp_ms'] <= series['last_timestamp_ms'][0]:
+        logger.debug(f'Skipping a candle we already have: {candle}')
+        return []
+
+    features = indicators.update(
+        series,
+        rows=np.array([0]),
+        close=np.array([candle['close']], dtype=np.float64),
+        timestamp_ms=np.array([candle['timestamp_ms']], dtype=np.int64),
+    )
+    state.set(key, {name: values.tolist() for name, values in series.items()})
+
+    return [{**candle, **{name: values.item() for name, values in features.items()}}]
+
+
+def add_indicators_to_candles(
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_consumer_group: str,
+    indicators: Indicators,
+    kafka_output_topic_encoding: str = 'json',
+    processing_mode: str = 'streaming',
+    batch_max_messages: int = 100_000,
+    batch_timeout_sec: float = 1.0,
+) -> None:
+    """
+    Reads the candles of trade_to_ohlc from a redpanda topic
+    Adds the technical indicators of their series (EMA, RSI, volatility, log returns),
+    updated in O(1) per candle (see src/indicators.py)
+    Sends the candles with their indicators to the output redpanda topic
+
+    A series is the candles of one product at one window size. Only the final candles
+    are used, and a candle that is not after the last one of its series is skipped.
+
+    Args:
+        kafka_broker_address(str): address of kafka broker
+        kafka_input_topic(str): kafka topic to read the candles from
+        kafka_output_topic(str): kafka topic to write the candles with their indicators to
+        kafka_consumer_group(str): kafka consumer group
+        indicators(Indicators): the indicators to compute, with their periods
+        kafka_output_topic_encoding(str): wire format of the output, 'json', 'msgpack' or 'struct'
+        processing_mode(str): 'streaming' keeps the state of every series in the state
+            store, one candle at a time. 'batch' reads the candles in chunks from the start
+            of the topic (see src/batch_indicators.py), e.g. for the historical candles.
+            Both give the same values
+        batch_max_messages(int): max no. of candles in a chunk, in batch mode
+        batch_timeout_sec(float): max no. of seconds we wait to fill a chunk, in batch mode
+
+    Returns:
+        None
+    """
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group,
+        # in batch mode we never commit, so every run starts from the first candle
+        auto_offset_reset='earliest' if processing_mode == 'batch' else 'latest',
+    )
+
+    input_topic = app.topic(name=kafka_input_topic, value_deserializer=WireDeserializer())
+    output_topic = app.topic(name=kafka_output_topic, value_serializer=WireSerializer(INDICATORS_V1, kafka_output_topic_encoding))
+
+    if processing_mode == 'batch':
+        from src.batch_indicators import add_indicators_batch
+
+        add_indicators_batch(
+            app,
+            kafka_input_topic=input_topic.name,
+            kafka_output_topic=output_topic.name,
+            indicators=indicators,
+            kafka_output_topic_encoding=kafka_output_topic_encoding,
+            batch_max_messages=batch_max_messages,
+            batch_timeout_sec=batch_timeout_sec,
+        )
+        return
+
+    if processing_mode != 'streaming':
+        raise ValueError(f"processing_mode must be 'streaming' or 'batch', but got {processing_mode}")
+
+    sdf = app.dataframe(input_topic)
+
+    # the in-progress candles would count twice in the indicators
+    sdf = sdf.filter(lambda candle: candle.get('is_final', True))
+    sdf = sdf.apply(
+        lambda candle, state: add_indicators(candle, state, indicators), stateful=True, expand=True
+    )
+
+    # print the output to the console
+    sdf.update(logger.debug)
+
+    sdf = sdf.to_topic(output_topic)
+
+    app.run(sdf)
+
+
+if __name__ == '__main__':
+    from src.config import config
+
+    add_indicators_to_candles(
+        kafka_broker_address=config.kafka_broker_address,
+        kafka_input_topic=config.kafka_input_topic,
+        kafka_output_topic=config.kafka_output_topic,
+        kafka_consumer_group=config.kafka_consumer_group,
+        indicators=Indicators(
+            ema_fast_period=config.ema_fast_period,
+            ema_slow_period=config.ema_slow_period,
+            rsi_period=config.rsi_period,
+            volatility_window=config.volatility_window,
+            return_steps=config.return_steps,
+        ),
+        kafka_output_topic_encoding=config.kafka_output_topic_encoding,
+        processing_mode=config.processing_mode,
+        batch_max_messages=config.batch_max_messages,
+        batch_timeout_sec=config.batch_timeout_sec,
+    )
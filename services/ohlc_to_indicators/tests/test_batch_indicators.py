@@ -0,0 +1,103 @@
+import math
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+from src.batch_indicators import BatchIndicators
+from src.indicators import FEATURE_NAMES, Indicators
+from src.main import add_indicators
+
+
+class _State:
+    """
+    The state store of one key, as the streaming mode sees it.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[str, dict] = {}
+
+    def get(self, key: str):
+        return self._values.get(key)
+
+    def set(self, key: str, value: dict) -> None:
+        self._values[key] = value
+
+
+def _random_candles(rng: np.random.Generator, n_candles: int) -> List[dict]:
+    """
+    Candles of two products at two window sizes, interleaved, with some in-progress
+    candles and about 5% of the final ones sent again later, e.g. after a restart of
+    trade_to_ohlc.
+    """
+    candles = []
+    close = {}
+    n_windows = {}
+    for _ in range(n_candles):
+        product_id = str(rng.choice(['BTC/USD', 'ETH/USD']))
+        window_seconds = int(rng.choice([60, 300]))
+        series = (product_id, window_seconds)
+
+        n_windows[series] = n_windows.get(series, 0) + 1
+        close[series] = close.get(series, 100.0) * math.exp(rng.normal(0, 1e-2))
+        candle = {
+            'product_id': product_id,
+            'window_seconds': window_seconds,
+            'timestamp_ms': 1_700_000_000_000 + n_windows[series] * window_seconds * 1000,
+            'close': close[series],
+            'is_final': bool(rng.random() < 0.9),
+        }
+        candles.append(candle)
+
+        if candle['is_final'] and rng.random() < 0.05:
+            candles.insert(len(candles) - int(rng.integers(0, 10)), dict(candle))
+
+    return candles
+
+
+def _streaming(candles: List[dict], indicators: Indicators) -> List[dict]:
+    states: Dict[str, _State] = {}
+
+    out = []
+    for candle in candles:
+        if candle.get('is_final', True):
+            out += add_indicators(candle, states.setdefault(candle['product_id'], _State()), indicators)
+    return out
+
+
+def _batch(candles: List[dict], indicators: Indicators, rng: np.random.Generator) -> List[dict]:
+    batch = BatchIndicators(indicators)
+
+    out = []
+    start = 0
+    while start < len(candles):
+        chunk = candles[start:start + int(rng.integers(1, 200))]
+        out += batch.add(chunk)
+        start += len(chunk)
+    return out
+
+
+def _by_candle(candles: List[dict]) -> Dict[tuple, dict]:
+    return {
+        (candle['product_id'], candle['window_seconds'], candle['timestamp_ms']): candle
+        for candle in candles
+    }
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_indicators_match_the_streaming_ones(seed):
+    rng = np.random.default_rng(seed)
+    candles = _random_candles(rng, 2_000)
+    indicators = Indicators(ema_fast_period=3, ema_slow_period=8, rsi_period=5, volatility_window=4, return_steps=3)
+
+    streaming = _streaming(candles, indicators)
+    batch = _batch(candles, indicators, rng)
+
+    # every new final candle once, with the very same floats
+    assert len(batch) == len(streaming) == len(_by_candle(streaming))
+    batch = _by_candle(batch)
+    for key, candle in _by_candle(streaming).items():
+        for name in FEATURE_NAMES:
+            assert batch[key][name] == candle[name] or (
+                math.isnan(batch[key][name]) and math.isnan(candle[name])
+            ), (key, name)
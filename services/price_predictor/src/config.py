@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -6,6 +8,13 @@ class Config(BaseSettings):
     feature_view_version: int
     feature_group_name: str
     feature_group_version: int
+    # the same as the ones topic_to_feature_store writes the feature group with
+    feature_group_primary_keys: Optional[List[str]] = ['product_id', 'timestamp_ms']
+    feature_group_event_time: Optional[str] = 'timestamp_ms'
+    # 'hopsworks', or 'local' to read the embedded feature store that topic_to_feature_store
+    # writes under local_feature_store_path, without Hopsworks
+    feature_store_backend: Optional[str] = 'hopsworks'
+    local_feature_store_path: Optional[str] = 'feature_store'
     ohlc_window_sec: int
     product_id: str
     last_n_days: int
@@ -15,8 +24,9 @@ class Config(BaseSettings):
         env_file = ".env"
 
 class HopsworksConfig(BaseSettings):
-    hopsworks_project_name: str
-    hopsworks_api_key: str
+    # only needed with the 'hopsworks' feature store backend
+    hopsworks_project_name: Optional[str] = None
+    hopsworks_api_key: Optional[str] = None
 
     class Config:
         env_file = "hopsworks.credentials.env"
@@ -1,15 +1,12 @@
-from src.config import CometConfig, HopsworksConfig
+from src.config import CometConfig
+from src.feature_store import FeatureStore
 from typing import Optional
 
 from loguru import logger
 from comet_ml import Experiment
 def train_model(
-    hopsworks_config: HopsworksConfig,
     comet_config: CometConfig,
-    feature_view_name: str,
-    feature_view_version: int,
-    feature_group_name: str,
-    feature_group_version: int,
+    feature_store: FeatureStore,
     ohlc_window_sec: int,
     last_n_days: int,
     product_id: str,
@@ -21,6 +18,8 @@ def train_model(
     Reads feature from the feature store,
     Trains the predictive model and
     saves it to a model registry
+
+    The feature store is Hopsworks or the local one (see src/feature_store.py)
     
     '''
 
@@ -33,12 +32,8 @@ def train_model(
     from src.ohlc_data_reader import OhlcDataReader
 
     ohlc_data_reader = OhlcDataReader(
-        feature_view_name=feature_view_name,
-        feature_view_version=feature_view_version,
-        feature_group_name=feature_group_name,
-        feature_group_version=feature_group_version,
         ohlc_window_sec=ohlc_window_sec,
-        hopsworks_config=hopsworks_config
+        feature_store=feature_store,
     )
 
     # the data gathered here is already sorted
@@ -126,13 +121,24 @@ def train_model(
 if __name__ == "__main__":
 
     from src.config import config, hopsworks_config, comet_config
-    train_model(
-        hopsworks_config=hopsworks_config,
-        comet_config=comet_config,
-        feature_view_name=config.feature_view_name,
-        feature_view_version=config.feature_view_version,
+    from src.feature_store import get_feature_store
+
+    feature_store = get_feature_store(
+        backend=config.feature_store_backend,
         feature_group_name=config.feature_group_name,
         feature_group_version=config.feature_group_version,
+        primary_keys=config.feature_group_primary_keys,
+        event_time=config.feature_group_event_time,
+        local_path=config.local_feature_store_path,
+        hopsworks_project_name=hopsworks_config.hopsworks_project_name,
+        hopsworks_api_key=hopsworks_config.hopsworks_api_key,
+        feature_view_name=config.feature_view_name,
+        feature_view_version=config.feature_view_version,
+    )
+
+    train_model(
+        comet_config=comet_config,
+        feature_store=feature_store,
         ohlc_window_sec=config.ohlc_window_sec,
         product_id=config.product_id,
         last_n_days=config.last_n_days,
@@ -0,0 +1,120 @@
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# the next offset to read of each partition, by (topic, partition)
+Offsets = Dict[Tuple[str, int], int]
+
+
+class BackgroundWriter:
+    '''
+    Writes the batches to the feature store in a background thread, so that the consumer
+    keeps polling (and fills the next batch) while a batch is being inserted.
+
+    - at most `max_in_flight` batches are handed over and not written yet: `submit`
+      waits for one of them to be written, which is the backpressure on the consumer
+    - the batches are written one at a time, in the order they were submitted, and the
+      offsets of each written batch are handed back with `written_offsets`, for the
+      consumer to commit them. The consumer is only used by its own thread
+    - if a write fails, the batches after it are not written and `check` raises the
+      error in the consumer thread, so their offsets are never committed
+    '''
+
+    def __init__(self, write: Callable[[List[dict]], None], max_in_flight: int = 2) -> None:
+        '''
+        Args:
+            write: writes a batch to the feature store, durably once it returns
+            max_in_flight: the max no. of batches handed over and not written yet
+
+        Returns:
+            None
+        '''
+        if max_in_flight < 1:
+            raise ValueError(f'max_in_flight must be at least 1, but got {max_in_flight}')
+
+        self._write = write
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._batches: queue.Queue = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._written_offsets: Offsets = {}
+        self._error: Optional[BaseException] = None
+
+        self._thread = threading.Thread(target=self._run, name='feature-store-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, batch: List[dict], offsets: Offsets, timeout: Optional[float] = None) -> bool:
+        '''
+        Hands a batch over to the writer thread.
+
+        Args:
+            batch: the values to write
+            offsets: the next offset of each partition of the batch, to commit once it is written
+            timeout: the max no. of seconds to wait while `max_in_flight` batches are in flight.
+                None waits as long as it takes
+
+        Returns:
+            bool: whether the batch was handed over, False if we timed out
+        '''
+        self.check()
+        if not self._slots.acquire(timeout=timeout):
+            return False
+
+        self._batches.put((batch, offsets))
+        return True
+
+    def written_offsets(self) -> Offsets:
+        '''
+        Returns the offsets of the batches written since the last call, the latest one of
+        each partition, and forgets them.
+        '''
+        with self._lock:
+            offsets, self._written_offsets = self._written_offsets, {}
+        return offsets
+
+    def wait(self) -> None:
+        '''
+        Waits until all the batches handed over are written, and raises the error of the
+        writer thread if a write failed.
+        '''
+        self._batches.join()
+        self.check()
+
+    def check(self) -> None:
+        '''
+        Raises the error of the writer thread, if a write failed.
+        '''
+        if self._error is not None:
+            raise RuntimeError('Failed to write a batch to the feature store') from self._error
+
+    def close(self) -> None:
+        '''
+        Writes the batches handed over, then stops the writer thread.
+        '''
+        self._batches.put(None)
+        self._thread.join()
+        self.check()
+
+    def _run(self) -> None:
+        while True:
+            item = self._batches.get()
+            if item is None:
+                self._batches.task_done()
+                return
+
+            batch, offsets = item
+            try:
+                # after a failed write we drop the batches, so that their offsets are not
+                # committed either
+                if self._error is None:
+                    self._write(batch)
+                    with self._lock:
+                        self._written_offsets.update(offsets)
+            except Exception as e:
+                logger.exception(f'Failed to write a batch of {len(batch)} values to the feature store')
+                self._error = e
+            finally:
+                self._slots.release()
+                self._batches.task_done()
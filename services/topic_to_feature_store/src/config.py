@@ -7,17 +7,30 @@ class Config(BaseSettings):
     
     feature_group_name: str
     feature_group_version: int
+    # add window_seconds to the primary keys when trade_to_ohlc builds candles of
+    # several window sizes, e.g. ["product_id", "window_seconds", "timestamp_ms"]
     feature_group_primary_keys: List[str]
     feature_group_event_time: str
     start_offline_materialization: bool
+    # 'hopsworks', or 'local' for an embedded feature store under local_feature_store_path
+    # (SQLite + parquet files), to run without Hopsworks
+    feature_store_backend: Optional[str] = 'hopsworks'
+    local_feature_store_path: Optional[str] = 'feature_store'
+    # a batch is pushed when it has batch_size messages, or when its oldest message has
+    # waited batch_linger_ms, whichever comes first
     batch_size: Optional[int] = 1
+    batch_linger_ms: Optional[int] = 1000
+    # the max no. of batches waiting to be written to the feature store by the
+    # background writer, while we consume the next ones
+    max_in_flight_batches: Optional[int] = 2
 
     class Config:
         env_file = ".env"
 
 class HopsworksConfig(BaseSettings):
-    hopsworks_project_name: str
-    hopsworks_api_key: str
+    # only needed with the 'hopsworks' feature store backend
+    hopsworks_project_name: Optional[str] = None
+    hopsworks_api_key: Optional[str] = None
 
     class Config:
         env_file = "credentials.env"
@@ -0,0 +1,448 @@
+"""
+The feature store our services write the features to and read them from.
+
+This module is copied as-is in every service that uses the feature store
+(topic_to_feature_store, price_predictor), so they all agree on how the features are
+stored. If you change it, change it everywhere: `make check-shared-modules` at the root
+of the repo fails while the copies differ.
+
+A feature store holds the rows of one feature group, identified by their primary keys,
+with an event time in ms (e.g. `timestamp_ms`). It has three operations:
+
+- `write`: upserts rows by primary key, in the online and in the offline store
+- `read_online`: point lookups of rows by primary key, for inference
+- `read_offline`: range scan of the rows by event time, for training
+
+There are two backends, picked with `get_feature_store`:
+
+- 'hopsworks': the Hopsworks feature group, and a feature view on it for the reads
+- 'local': embedded, for running and benchmarking without Hopsworks. A SQLite table for
+  the online store, and parquet files partitioned by the date of the event time for the
+  offline store, all under one directory
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from loguru import logger
+
+BACKENDS = ('hopsworks', 'local')
+
+
+class FeatureStore(ABC):
+    """
+    The rows of one feature group, upserted by `primary_keys`, with their event time in
+    ms in the `event_time` column.
+    """
+
+    def __init__(
+        self,
+        feature_group_name: str,
+        feature_group_version: int,
+        primary_keys: List[str],
+        event_time: str,
+    ) -> None:
+        """
+        Args:
+            feature_group_name (str): The name of the feature group.
+            feature_group_version (int): The version of the feature group.
+            primary_keys (List[str]): The columns that identify a row.
+            event_time (str): The column of the event time, in ms.
+
+        Returns:
+            None
+        """
+        self.feature_group_name = feature_group_name
+        self.feature_group_version = feature_group_version
+        self.primary_keys = list(primary_keys)
+        self.event_time = event_time
+
+    @abstractmethod
+    def write(self, rows: List[dict]) -> None:
+        """
+        Upserts the rows by primary key. They are durably written once this returns.
+        """
+
+    @abstractmethod
+    def read_online(self, keys: List[Dict[str, Any]]) -> pd.DataFrame:
+        """
+        Returns the rows with these primary keys, the ones we have of them.
+
+        Args:
+            keys (List[Dict[str, Any]]): The primary keys, one dict per row.
+
+        Returns:
+            pd.DataFrame: The rows.
+        """
+
+    @abstractmethod
+    def read_offline(
+        self,
+        from_timestamp_ms: int,
+        to_timestamp_ms: int,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        """
+        Returns the rows with an event time in [from_timestamp_ms, to_timestamp_ms],
+        sorted by event time.
+
+        Args:
+            from_timestamp_ms (int): The first event time, in ms.
+            to_timestamp_ms (int): The last event time, in ms.
+            filters (Optional[Dict[str, Any]]): The value of some columns, e.g.
+                {'product_id': 'BTC/USD'}.
+
+        Returns:
+            pd.DataFrame: The rows.
+        """
+
+    def _select(
+        self,
+        df: pd.DataFrame,
+        from_timestamp_ms: int,
+        to_timestamp_ms: int,
+        filters: Optional[Dict[str, Any]],
+    ) -> pd.DataFrame:
+        """
+        Keeps the rows of `df` in the time range that match the filters, sorted by event time.
+        """
+        if df.empty:
+            return df
+
+        mask = (df[self.event_time] >= from_timestamp_ms) & (df[self.event_time] <= to_timestamp_ms)
+        for column, value in (filters or {}).items():
+            mask &= df[column] == value
+
+        return df[mask].sort_values(by=self.event_time).reset_index(drop=True)
+
+
+class HopsworksFeatureStore(FeatureStore):
+    """
+    The feature group in Hopsworks. The writes insert in the feature group, the reads go
+    through the feature view `feature_view_name`, created on the feature group if it
+    does not exist yet.
+
+    We log in to Hopsworks on the first operation, and get the feature group and the
+    feature view once.
+    """
+
+    def __init__(
+        self,
+        feature_group_name: str,
+        feature_group_version: int,
+        primary_keys: List[str],
+        event_time: str,
+        hopsworks_project_name: str,
+        hopsworks_api_key: str,
+        feature_view_name: Optional[str] = None,
+        feature_view_version: Optional[int] = None,
+        start_offline_materialization: bool = False,
+    ) -> None:
+        """
+        Args:
+            feature_group_name (str): The name of the feature group.
+            feature_group_version (int): The version of the feature group.
+            primary_keys (List[str]): The columns that identify a row.
+            event_time (str): The column of the event time, in ms.
+            hopsworks_project_name (str): The Hopsworks project.
+            hopsworks_api_key (str): The Hopsworks API key.
+            feature_view_name (Optional[str]): The feature view to read from. Only needed
+                for the reads.
+            feature_view_version (Optional[int]): The version of the feature view.
+            start_offline_materialization (bool): Whether to start the offline
+                materialization job after every write.
+
+        Returns:
+            None
+        """
+        super().__init__(feature_group_name, feature_group_version, primary_keys, event_time)
+        if not hopsworks_project_name or not hopsworks_api_key:
+            raise ValueError('The Hopsworks project name and API key are needed for the hopsworks backend')
+
+        self.hopsworks_project_name = hopsworks_project_name
+        self.hopsworks_api_key = hopsworks_api_key
+        self.feature_view_name = feature_view_name
+        self.feature_view_version = feature_view_version
+        self.start_offline_materialization = start_offline_materialization
+
+        self._fs = None
+        self._feature_group = None
+        self._feature_view = None
+
+    def write(self, rows: List[dict]) -> None:
+        feature_group = self._get_feature_group()
+        feature_group.insert(
+            pd.DataFrame(rows),
+            write_options={"start_offline_materialization": self.start_offline_materialization},
+        )
+
+    def read_online(self, keys: List[Dict[str, Any]]) -> pd.DataFrame:
+        feature_view = self._get_feature_view()
+        return feature_view.get_feature_vectors(entry=keys, return_type="pandas")
+
+    def read_offline(
+        self,
+        from_timestamp_ms: int,
+        to_timestamp_ms: int,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        feature_view = self._get_feature_view()
+        # only the rows of the range are read, by their event time in ms. The end is
+        # exclusive in some versions of Hopsworks, `_select` keeps the exact range
+        features = feature_view.get_batch_data(
+            start_time=from_timestamp_ms,
+            end_time=to_timestamp_ms + 1,
+        )
+        return self._select(features, from_timestamp_ms, to_timestamp_ms, filters)
+
+    def _get_feature_store(self):
+        """
+        Returns the Hopsworks feature store, logging in the first time.
+        """
+        if self._fs is None:
+            import hopsworks
+
+            project = hopsworks.login(
+                project=self.hopsworks_project_name,
+                api_key_value=self.hopsworks_api_key,
+            )
+            self._fs = project.get_feature_store()
+
+        return self._fs
+
+    def _get_feature_group(self):
+        """
+        Returns the feature group, created if it does not exist yet.
+        """
+        if self._feature_group is None:
+            self._feature_group = self._get_feature_store().get_or_create_feature_group(
+                name=self.feature_group_name,
+                version=self.feature_group_version,
+                primary_key=self.primary_keys,
+                event_time=self.event_time,
+                online_enabled=True,
+            )
+
+        return self._feature_group
+
+    def _get_feature_view(self):
+        """
+        Returns the feature view on the feature group, created if it does not exist yet.
+        """
+        if self._feature_view is not None:
+            return self._feature_view
+
+        if self.feature_view_name is None:
+            raise ValueError('The feature view name and version are needed to read from Hopsworks')
+
+        fs = self._get_feature_store()
+        feature_group = fs.get_feature_group(
+            name=self.feature_group_name,
+            version=self.feature_group_version,
+        )
+        feature_view = fs.get_or_create_feature_view(
+            name=self.feature_view_name,
+            version=self.feature_view_version,
+            query=feature_group.select_all(),
+        )
+
+        # if the feature view already existed, it must be on the same feature group
+        parent_feature_group = feature_view.get_parent_feature_groups().accessible[0]
+        if parent_feature_group.name != feature_group.name or \
+            parent_feature_group.version != feature_group.version:
+            raise ValueError(
+                'The feature view and feature group names and versions do not match.'
+            )
+
+        self._feature_view = feature_view
+        return feature_view
+
+
+class LocalFeatureStore(FeatureStore):
+    """
+    The feature group on the local disk, under `path/<name>_<version>/`:
+
+    - online.sqlite: the online store, the latest row of every primary key, as JSON,
+      in a table keyed by the primary key columns
+    - offline/date=YYYY-MM-DD/part-*.parquet: the offline store, one file per write and
+      date of the event time. The files are only ever added, and a read keeps the
+      latest row written of every primary key, so a write is an upsert there too
+
+    A file is written under a temporary name and renamed, so a reader (e.g. the
+    training of price_predictor, while topic_to_feature_store writes) never sees half
+    a file. There is no compaction of the offline files.
+    """
+
+    def __init__(
+        self,
+        feature_group_name: str,
+        feature_group_version: int,
+        primary_keys: List[str],
+        event_time: str,
+        path: str = 'feature_store',
+    ) -> None:
+        """
+        Args:
+            feature_group_name (str): The name of the feature group.
+            feature_group_version (int): The version of the feature group.
+            primary_keys (List[str]): The columns that identify a row.
+            event_time (str): The column of the event time, in ms.
+            path (str): The directory of the local feature store.
+
+        Returns:
+            None
+        """
+        super().__init__(feature_group_name, feature_group_version, primary_keys, event_time)
+
+        self._dir = Path(path) / f'{feature_group_name}_{feature_group_version}'
+        self._offline_dir = self._dir / 'offline'
+        self._offline_dir.mkdir(parents=True, exist_ok=True)
+        self._online_path = self._dir / 'online.sqlite'
+
+        columns = ', '.join(f'"{key}"' for key in self.primary_keys)
+        with closing(self._connect()) as conn, conn:
+            # readers do not block the writer, and the other way round
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS features ({columns}, value TEXT NOT NULL, PRIMARY KEY ({columns}))'
+            )
+
+    def write(self, rows: List[dict]) -> None:
+        if not rows:
+            return
+
+        # offline store: one file per date of the event time
+        df = pd.DataFrame(rows)
+        dates = pd.to_datetime(df[self.event_time], unit='ms', utc=True).dt.strftime('%Y-%m-%d')
+        for day, partition in df.groupby(dates, sort=False):
+            partition_dir = self._offline_dir / f'date={day}'
+            partition_dir.mkdir(exist_ok=True)
+            # the files of a partition sort in the order they were written
+            file_name = f'part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet'
+            tmp_path = partition_dir / f'.{file_name}.tmp'
+            partition.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, partition_dir / file_name)
+
+        # online store
+        placeholders = ', '.join('?' for _ in range(len(self.primary_keys) + 1))
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f'INSERT OR REPLACE INTO features VALUES ({placeholders})',
+                [[row[key] for key in self.primary_keys] + [json.dumps(row)] for row in rows],
+            )
+
+    def read_online(self, keys: List[Dict[str, Any]]) -> pd.DataFrame:
+        where = ' AND '.join(f'"{key}" = ?' for key in self.primary_keys)
+        rows = []
+        with closing(self._connect()) as conn:
+            for key in keys:
+                found = conn.execute(
+                    f'SELECT value FROM features WHERE {where}',
+                    [key[name] for name in self.primary_keys],
+                ).fetchone()
+                if found is not None:
+                    rows.append(json.loads(found[0]))
+
+        return pd.DataFrame(rows)
+
+    def read_offline(
+        self,
+        from_timestamp_ms: int,
+        to_timestamp_ms: int,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        # only the partitions of the dates in the range
+        day = _date(from_timestamp_ms)
+        files = []
+        while day <= _date(to_timestamp_ms):
+            partition_dir = self._offline_dir / f'date={day:%Y-%m-%d}'
+            if partition_dir.exists():
+                files += sorted(partition_dir.glob('part-*.parquet'))
+            day += timedelta(days=1)
+
+        if not files:
+            return pd.DataFrame()
+
+        df = pd.concat([pd.read_parquet(file) for file in files], ignore_index=True)
+        # the latest row written of every primary key
+        df = df.drop_duplicates(subset=self.primary_keys, keep='last')
+        logger.debug(f'Read {len(df)} rows from {len(files)} files of the offline store')
+
+        return self._select(df, from_timestamp_ms, to_timestamp_ms, filters)
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per operation, as the writes may come from another thread
+        return sqlite3.connect(self._online_path, timeout=30)
+
+
+def _date(timestamp_ms: int) -> date:
+    """
+    Returns the UTC date of a timestamp in ms, the offline partition of its rows.
+    """
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).date()
+
+
+def get_feature_store(
+    backend: str,
+    feature_group_name: str,
+    feature_group_version: int,
+    primary_keys: List[str],
+    event_time: str,
+    local_path: str = 'feature_store',
+    hopsworks_project_name: Optional[str] = None,
+    hopsworks_api_key: Optional[str] = None,
+    feature_view_name: Optional[str] = None,
+    feature_view_version: Optional[int] = None,
+    start_offline_materialization: bool = False,
+) -> FeatureStore:
+    """
+    Returns the feature store of the feature group, with the given backend.
+
+    Args:
+        backend (str): 'hopsworks' or 'local'.
+        feature_group_name (str): The name of the feature group.
+        feature_group_version (int): The version of the feature group.
+        primary_keys (List[str]): The columns that identify a row.
+        event_time (str): The column of the event time, in ms.
+        local_path (str): The directory of the local feature store.
+        hopsworks_project_name (Optional[str]): The Hopsworks project.
+        hopsworks_api_key (Optional[str]): The Hopsworks API key.
+        feature_view_name (Optional[str]): The Hopsworks feature view to read from.
+        feature_view_version (Optional[int]): The version of the feature view.
+        start_offline_materialization (bool): Whether Hopsworks starts the offline
+            materialization job after every write.
+
+    Returns:
+        FeatureStore: The feature store.
+    """
+    if backend == 'hopsworks':
+        return HopsworksFeatureStore(
+            feature_group_name,
+            feature_group_version,
+            primary_keys,
+            event_time,
+            hopsworks_project_name=hopsworks_project_name,
+            hopsworks_api_key=hopsworks_api_key,
+            feature_view_name=feature_view_name,
+            feature_view_version=feature_view_version,
+            start_offline_materialization=start_offline_materialization,
+        )
+
+    if backend == 'local':
+        return LocalFeatureStore(
+            feature_group_name,
+            feature_group_version,
+            primary_keys,
+            event_time,
+            path=local_path,
+        )
+
+    raise ValueError(f'backend must be one of {BACKENDS}, but got {backend}')
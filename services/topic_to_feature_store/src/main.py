@@ -1,29 +1,45 @@
+import signal
+import time
+from confluent_kafka import KafkaException, TopicPartition
 from quixstreams import Application
-from typing import List
+from typing import Optional
 from loguru import logger
-import json
-from src.config import config
-from src.hopsworks_api import push_value_to_feature_store
+from src.wire_format import decode
+from src.feature_store import FeatureStore
+from src.background_writer import BackgroundWriter
 def topic_to_feature_store(kafka_broker_address: str,
                             kafka_input_topic: str,
                             kafka_consumer_group: str,
-                            feature_group_name: str,
-                            feature_group_version: int,
-                            feature_group_primary_key: List[str],
-                            feature_group_event_time: str,
-                            start_offline_materialization: bool,
-                            batch_size: int):
+                            feature_store: FeatureStore,
+                            batch_size: int,
+                            batch_linger_ms: Optional[int] = None,
+                            max_in_flight_batches: int = 2):
     '''
     Reads from a Kafka input topic and pushes them in a feature store
+
+    Messages are pushed in batches, one insert per batch: a batch is pushed when it has
+    `batch_size` messages, or when its oldest message has waited `batch_linger_ms`,
+    whichever comes first. So a live pipeline can use big batches and still push every
+    message within `batch_linger_ms`, and the tail of a backfill does not wait forever.
+    What is left is pushed when we are stopped (Ctrl-C or SIGTERM).
+
+    The batches are inserted by a background thread, so we keep consuming (filling the
+    next batch) while a batch is being written. At most `max_in_flight_batches` batches
+    wait to be written; past that we pause the partitions until the feature store
+    catches up. The offsets of a batch are committed only once it is written, so a
+    crash replays the batches that were not written (the feature store upserts them
+    by primary key) instead of losing them.
     
     Args:
         kafka_broker_address: Kafka broker address
         kafka_input_topic: Kafka topic to read the data from
         kafka_consumer_group: Kafka consumer group
-        feature_group_name: Feature group name
-        feature_group_version: Feature group version
-        start_offline_materialization: Whether to start offline materialization
-        batch_size: the no. of messages to accumulate in memory before pushing to feature store
+        feature_store: the feature store to push to, Hopsworks or local (see src/feature_store.py)
+        batch_size: the max no. of messages to accumulate in memory before pushing to feature store
+        batch_linger_ms: the max time a message waits in memory before its batch is pushed.
+            None waits until the batch is full
+        max_in_flight_batches: the max no. of batches handed to the background writer and
+            not written yet. 1 writes a batch while the next one is filled
 
     Returns:
         None
@@ -32,57 +48,174 @@ def topic_to_feature_store(kafka_broker_address: str,
     # Create an Application instance with Kafka config
     app = Application(broker_address=kafka_broker_address,
                       consumer_group=kafka_consumer_group,)
-    
+
+    # the inserts run in a background thread, so that we keep consuming while a batch is
+    # being written (see src/background_writer.py)
+    writer = BackgroundWriter(
+        write=feature_store.write,
+        max_in_flight=max_in_flight_batches,
+    )
+
     batch = []
+    # the next offset of each partition of the batch, committed once the batch is written
+    batch_offsets = {}
+    # when the oldest message of the batch was added, to push it within `batch_linger_ms`
+    batch_started_at = None
+
+    # the batch `push_batch` waits to hand over to the writer, while we keep polling.
+    # A rebalance in one of these polls hands it over first (see `drain`)
+    pending = None
+    pending_offsets = {}
 
-    with app.get_consumer() as consumer:
+    # stop polling on Ctrl-C or SIGTERM (docker stop), and push what we have
+    stopping = False
 
-        consumer.subscribe(topics=[kafka_input_topic])
+    def stop(signum, frame):
+        nonlocal stopping
+        logger.info("Stopping... Pushing the last batch to feature store")
+        stopping = True
 
-        while True:
-            msg = consumer.poll(0.1)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
 
+    # offsets are only committed once their batch is written to the feature store
+    with app.get_consumer(auto_commit_enable=False) as consumer:
+
+        def add_message(msg):
+            nonlocal batch_started_at
             if msg is None:
-                continue
-            elif msg.error():
+                return
+            if msg.error():
                 logger.error(msg.error())
-                continue
+                return
+
+            # JSON, msgpack or struct, whatever the producer of the topic was set up with
+            value = decode(msg.value())
 
-            value = msg.value()
-            value = json.loads(value.decode('utf-8'))
-            
+            if not batch:
+                batch_started_at = time.monotonic()
             batch.append(value)
+            batch_offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
 
-            if len(batch) < batch_size:
-                logger.debug(f"Batch has size {len(batch)} < {batch_size}")
-                continue
+        def commit_written_offsets():
+            offsets = writer.written_offsets()
+            if not offsets:
+                return
+            try:
+                consumer.commit(
+                    offsets=[TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()],
+                    asynchronous=False,
+                )
+            except KafkaException as e:
+                # e.g. the partitions were revoked while their batch was written. Their
+                # new consumer reads it again, and the feature store upserts it
+                logger.warning(f"Failed to commit the offsets of the written batches {offsets}: {e}")
+                return
+            logger.debug(f"Committed the offsets of the written batches: {offsets}")
 
-            logger.debug(f"Batch has size {len(batch)} >= {batch_size}... Pushing to feature store")
-            
-            push_value_to_feature_store(
-                  batch,
-                  feature_group_name,
-                  feature_group_version,
-                  feature_group_primary_key,
-                  feature_group_event_time,
-                  start_offline_materialization,             
-            )
+        def push_batch():
+            nonlocal batch, batch_offsets, batch_started_at, pending, pending_offsets
+            pending, pending_offsets = batch, batch_offsets
 
             # Clear the batch so we can store the next batch
-            batch = []            
+            batch = []
+            batch_offsets = {}
+            batch_started_at = None
+
+            # while `max_in_flight_batches` batches are being written, pause the partitions
+            # and keep polling, so that we stay in the consumer group without reading more
+            paused = False
+            while pending is not None:
+                if writer.submit(pending, pending_offsets, timeout=0.1):
+                    pending, pending_offsets = None, {}
+                    break
+                if not paused:
+                    logger.debug("The feature store is behind... Pausing the consumer")
+                    consumer.pause(consumer.assignment())
+                    paused = True
+                commit_written_offsets()
+                # messages fetched before the pause go to the next batch. If the poll
+                # revokes partitions, `drain` writes the pending batch
+                add_message(consumer.poll(0))
+
+            if paused:
+                # the assignment may have changed while we were paused
+                consumer.resume(consumer.assignment())
+
+        def drain():
+            '''
+            Pushes the pending batch and the batch, waits until every batch is written
+            and commits them
+            '''
+            nonlocal batch, batch_offsets, batch_started_at, pending, pending_offsets
+            # the pending batch has the older messages, so it is written (and committed) first
+            if pending is not None:
+                writer.submit(pending, pending_offsets)
+                pending, pending_offsets = None, {}
+            if batch:
+                writer.submit(batch, batch_offsets)
+                batch = []
+                batch_offsets = {}
+                batch_started_at = None
+            writer.wait()
+            commit_written_offsets()
+
+        # write what we read of the revoked partitions, and commit it before they go to
+        # another consumer, which starts from the committed offsets
+        consumer.subscribe(topics=[kafka_input_topic], on_revoke=lambda consumer, partitions: drain())
+
+        while not stopping:
+            # the error of the writer thread, if a write failed. We stop without committing
+            writer.check()
+            commit_written_offsets()
+
+            # don't wait in poll past the moment the batch is due
+            timeout = 0.1
+            if batch and batch_linger_ms is not None:
+                timeout = max(0.0, min(timeout, batch_started_at + batch_linger_ms / 1000 - time.monotonic()))
+
+            add_message(consumer.poll(timeout))
+
+            if not batch:
+                continue
+
+            if len(batch) >= batch_size:
+                logger.debug(f"Batch has size {len(batch)} >= {batch_size}... Pushing to feature store")
+            elif batch_linger_ms is not None and time.monotonic() - batch_started_at >= batch_linger_ms / 1000:
+                logger.debug(f"Batch of size {len(batch)} waited {batch_linger_ms}ms... Pushing to feature store")
+            else:
+                continue
+
+            push_batch()
+
+        # push what is left, wait until everything is written and commit it
+        drain()
+        writer.close()
 
 if __name__ == "__main__":
    
-    from src.config import config
+    from src.config import config, hopsworks_config
+    from src.feature_store import get_feature_store
+
+    feature_store = get_feature_store(
+    backend=config.feature_store_backend,
+    feature_group_name=config.feature_group_name,
+    feature_group_version=config.feature_group_version,
+    primary_keys=config.feature_group_primary_keys,
+    event_time=config.feature_group_event_time,
+    local_path=config.local_feature_store_path,
+    hopsworks_project_name=hopsworks_config.hopsworks_project_name,
+    hopsworks_api_key=hopsworks_config.hopsworks_api_key,
+    start_offline_materialization=config.start_offline_materialization,
+    )
+
     topic_to_feature_store(
     kafka_broker_address=config.kafka_broker_address,
     kafka_input_topic=config.kafka_input_topic,
     kafka_consumer_group=config.kafka_consumer_group,
-    feature_group_name=config.feature_group_name,
-    feature_group_version=config.feature_group_version ,
-    feature_group_primary_key=config.feature_group_primary_keys,
-    feature_group_event_time=config.feature_group_event_time,
-    start_offline_materialization=config.start_offline_materialization,
-    batch_size=config.batch_size
+    feature_store=feature_store,
+    batch_size=config.batch_size,
+    batch_linger_ms=config.batch_linger_ms,
+    max_in_flight_batches=config.max_in_flight_batches,
    )
 
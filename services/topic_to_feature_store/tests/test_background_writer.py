@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import List
+
+import pytest
+
+from src.background_writer import BackgroundWriter
+
+
+class _FeatureStore:
+    """
+    Records the batches written, and blocks each write until `release` is set
+    """
+
+    def __init__(self, fail_on: int = None) -> None:
+        self.written: List[list] = []
+        self.release = threading.Event()
+        self.release.set()
+        self.fail_on = fail_on
+        self.n_writing = 0
+        self.max_writing = 0
+
+    def write(self, batch: list) -> None:
+        self.n_writing += 1
+        self.max_writing = max(self.max_writing, self.n_writing)
+        try:
+            self.release.wait()
+            if len(self.written) == self.fail_on:
+                raise ValueError('The feature store is down')
+            self.written.append(batch)
+        finally:
+            self.n_writing -= 1
+
+
+def test_the_offsets_come_back_once_the_batch_is_written():
+    store = _FeatureStore()
+    store.release.clear()
+    writer = BackgroundWriter(store.write)
+
+    assert writer.submit([{'a': 1}], {('topic', 0): 1})
+    assert writer.submit([{'a': 2}], {('topic', 0): 2, ('topic', 1): 5})
+    time.sleep(0.1)
+    assert writer.written_offsets() == {}
+
+    store.release.set()
+    writer.wait()
+    # the latest offset of each partition, once
+    assert store.written == [[{'a': 1}], [{'a': 2}]]
+    assert writer.written_offsets() == {('topic', 0): 2, ('topic', 1): 5}
+    assert writer.written_offsets() == {}
+    writer.close()
+
+
+def test_at_most_max_in_flight_batches_wait_to_be_written():
+    store = _FeatureStore()
+    store.release.clear()
+    writer = BackgroundWriter(store.write, max_in_flight=2)
+
+    assert writer.submit([1], {('topic', 0): 1}, timeout=0.1)
+    assert writer.submit([2], {('topic', 0): 2}, timeout=0.1)
+    started = time.monotonic()
+    assert not writer.submit([3], {('topic', 0): 3}, timeout=0.2)
+    assert time.monotonic() - started >= 0.2
+
+    # a slot is free once a batch is written
+    store.release.set()
+    assert writer.submit([3], {('topic', 0): 3}, timeout=1.0)
+    writer.close()
+
+    # one at a time, in the order they were submitted
+    assert store.written == [[1], [2], [3]]
+    assert store.max_writing == 1
+    assert writer.written_offsets() == {('topic', 0): 3}
+
+
+def test_a_failed_write_drops_the_batches_after_it():
+    store = _FeatureStore(fail_on=1)
+    store.release.clear()
+    writer = BackgroundWriter(store.write, max_in_flight=3)
+
+    writer.submit([1], {('topic', 0): 1})
+    writer.submit([2], {('topic', 0): 2})
+    writer.submit([3], {('topic', 0): 3})
+    store.release.set()
+
+    with pytest.raises(RuntimeError, match='Failed to write a batch') as error:
+        writer.wait()
+    assert isinstance(error.value.__cause__, ValueError)
+
+    # only the offsets of the batch written before the failure
+    assert store.written == [[1]]
+    assert writer.written_offsets() == {('topic', 0): 1}
+    with pytest.raises(RuntimeError):
+        writer.check()
+    with pytest.raises(RuntimeError):
+        writer.submit([4], {('topic', 0): 4})
+
+
+def test_max_in_flight_must_be_at_least_1():
+    with pytest.raises(ValueError, match='max_in_flight'):
+        BackgroundWriter(lambda batch: None, max_in_flight=0)
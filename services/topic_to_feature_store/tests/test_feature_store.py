@@ -0,0 +1,110 @@
+import pytest
+
+from src.feature_store import LocalFeatureStore, get_feature_store
+
+# 2024-10-01 00:00 UTC
+DAY_MS = 1_727_740_800_000
+MINUTE_MS = 60_000
+
+
+def _store(tmp_path) -> LocalFeatureStore:
+    return get_feature_store(
+        backend='local',
+        feature_group_name='ohlcv',
+        feature_group_version=1,
+        primary_keys=['product_id', 'timestamp_ms'],
+        event_time='timestamp_ms',
+        local_path=str(tmp_path),
+    )
+
+
+def _row(product_id: str, timestamp_ms: int, close: float) -> dict:
+    return {'product_id': product_id, 'timestamp_ms': timestamp_ms, 'close': close}
+
+
+def test_get_feature_store(tmp_path):
+    assert isinstance(_store(tmp_path), LocalFeatureStore)
+    with pytest.raises(ValueError, match='backend must be one of'):
+        get_feature_store('redis', 'ohlcv', 1, ['product_id'], 'timestamp_ms')
+
+
+def test_a_write_upserts_by_primary_key(tmp_path):
+    store = _store(tmp_path)
+    store.write([_row('BTC/USD', DAY_MS, 100.0), _row('ETH/USD', DAY_MS, 10.0)])
+    store.write([_row('BTC/USD', DAY_MS, 101.0)])
+
+    online = store.read_online([{'product_id': 'BTC/USD', 'timestamp_ms': DAY_MS}])
+    assert online.to_dict('records') == [_row('BTC/USD', DAY_MS, 101.0)]
+
+    offline = store.read_offline(DAY_MS, DAY_MS)
+    assert sorted(offline.to_dict('records'), key=lambda row: row['product_id']) == [
+        _row('BTC/USD', DAY_MS, 101.0), _row('ETH/USD', DAY_MS, 10.0)
+    ]
+
+
+def test_read_online(tmp_path):
+    store = _store(tmp_path)
+    store.write([_row('BTC/USD', DAY_MS + i * MINUTE_MS, 100.0 + i) for i in range(3)])
+
+    # the rows we have, in the order of the keys
+    online = store.read_online([
+        {'product_id': 'BTC/USD', 'timestamp_ms': DAY_MS + 2 * MINUTE_MS},
+        {'product_id': 'ETH/USD', 'timestamp_ms': DAY_MS},
+        {'product_id': 'BTC/USD', 'timestamp_ms': DAY_MS},
+    ])
+    assert online.to_dict('records') == [
+        _row('BTC/USD', DAY_MS + 2 * MINUTE_MS, 102.0), _row('BTC/USD', DAY_MS, 100.0)
+    ]
+    assert store.read_online([{'product_id': 'ETH/USD', 'timestamp_ms': DAY_MS}]).empty
+
+
+def test_read_offline_of_a_time_range(tmp_path):
+    store = _store(tmp_path)
+    # an hour either side of midnight, in two writes and two date partitions, out of order
+    rows = [
+        _row(product_id, DAY_MS + i * MINUTE_MS, float(i))
+        for i in range(-60, 60)
+        for product_id in ['BTC/USD', 'ETH/USD']
+    ]
+    store.write(rows[120:])
+    store.write(rows[:120])
+    assert sorted(p.name for p in (tmp_path / 'ohlcv_1' / 'offline').iterdir()) == [
+        'date=2024-09-30', 'date=2024-10-01'
+    ]
+
+    # both ends included, sorted by event time
+    offline = store.read_offline(DAY_MS - 10 * MINUTE_MS, DAY_MS + 10 * MINUTE_MS)
+    assert len(offline) == 2 * 21
+    assert offline['timestamp_ms'].is_monotonic_increasing
+    assert offline['timestamp_ms'].min() == DAY_MS - 10 * MINUTE_MS
+    assert offline['timestamp_ms'].max() == DAY_MS + 10 * MINUTE_MS
+
+    offline = store.read_offline(DAY_MS, DAY_MS + 59 * MINUTE_MS, filters={'product_id': 'ETH/USD'})
+    assert offline.to_dict('records') == [
+        _row('ETH/USD', DAY_MS + i * MINUTE_MS, float(i)) for i in range(60)
+    ]
+
+    assert store.read_offline(DAY_MS + 2 * 24 * 60 * MINUTE_MS, DAY_MS + 3 * 24 * 60 * MINUTE_MS).empty
+
+
+def test_read_offline_keeps_the_last_row_written_of_a_key(tmp_path):
+    store = _store(tmp_path)
+    store.write([_row('BTC/USD', DAY_MS, 1.0), _row('BTC/USD', DAY_MS, 2.0)])
+    store.write([_row('BTC/USD', DAY_MS + MINUTE_MS, 3.0)])
+    store.write([_row('BTC/USD', DAY_MS, 4.0), _row('BTC/USD', DAY_MS + MINUTE_MS, 5.0)])
+    store.write([_row('BTC/USD', DAY_MS, 6.0)])
+
+    offline = store.read_offline(DAY_MS, DAY_MS + MINUTE_MS)
+    assert offline.to_dict('records') == [
+        _row('BTC/USD', DAY_MS, 6.0), _row('BTC/USD', DAY_MS + MINUTE_MS, 5.0)
+    ]
+
+    # the same rows online
+    online = store.read_online([
+        {'product_id': 'BTC/USD', 'timestamp_ms': DAY_MS},
+        {'product_id': 'BTC/USD', 'timestamp_ms': DAY_MS + MINUTE_MS},
+    ])
+    assert online.to_dict('records') == offline.to_dict('records')
+
+    # a new store on the same directory reads them back too
+    assert _store(tmp_path).read_offline(DAY_MS, DAY_MS + MINUTE_MS).equals(offline)
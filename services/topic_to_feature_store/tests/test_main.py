@@ -0,0 +1,175 @@
+import json
+import signal
+import threading
+from typing import List
+
+import pytest
+from confluent_kafka import TopicPartition
+
+from src import main
+from tests.test_background_writer import _FeatureStore
+
+TOPIC = 'indicators'
+
+
+class _Message:
+    def __init__(self, offset: int) -> None:
+        self._offset = offset
+
+    def value(self) -> bytes:
+        return json.dumps({'product_id': 'BTC/USD', 'offset': self._offset}).encode()
+
+    def topic(self) -> str:
+        return TOPIC
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+    def error(self):
+        return None
+
+
+class _Consumer:
+    """
+    One partition of `n_messages` messages, in place of the Kafka consumer. Once they are
+    all read, it stops topic_to_feature_store like a SIGTERM would.
+
+    Every commit checks that the messages before the committed offset are written.
+    """
+
+    def __init__(self, n_messages: int, store: _FeatureStore, handlers: dict, revoke_after: int = None):
+        self.messages = [_Message(offset) for offset in range(n_messages)]
+        self.n_polled = 0
+        self.store = store
+        self.handlers = handlers
+        self.committed = None
+        self.paused = False
+        self.polled_when_paused = None
+
+        # what is written and committed when the partition is revoked, after `revoke_after` messages
+        self.revoke_after = revoke_after
+        self.at_revoke = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def subscribe(self, topics: List[str], on_revoke) -> None:
+        self.on_revoke = on_revoke
+
+    def poll(self, timeout: float):
+        if self.n_polled == self.revoke_after and self.at_revoke is None:
+            self.on_revoke(self, [TopicPartition(TOPIC, 0)])
+            self.at_revoke = (_written_offsets(self.store), self.committed)
+
+        if self.paused:
+            return None
+        if self.n_polled == len(self.messages):
+            self.handlers[signal.SIGTERM](signal.SIGTERM, None)
+            return None
+
+        self.n_polled += 1
+        return self.messages[self.n_polled - 1]
+
+    def commit(self, offsets: List[TopicPartition], asynchronous: bool) -> None:
+        (tp,) = offsets
+        assert set(range(tp.offset)) <= _written_offsets(self.store)
+        self.committed = tp.offset
+
+    def assignment(self) -> List[TopicPartition]:
+        return [TopicPartition(TOPIC, 0)]
+
+    def pause(self, partitions: List[TopicPartition]) -> None:
+        self.paused = True
+        self.polled_when_paused = self.n_polled
+
+    def resume(self, partitions: List[TopicPartition]) -> None:
+        self.paused = False
+
+
+class _App:
+    def __init__(self, consumer: _Consumer) -> None:
+        self.consumer = consumer
+
+    def get_consumer(self, auto_commit_enable: bool) -> _Consumer:
+        return self.consumer
+
+
+def _written_offsets(store: _FeatureStore) -> set:
+    return {row['offset'] for batch in store.written for row in batch}
+
+
+@pytest.fixture
+def run(monkeypatch):
+    """
+    Runs topic_to_feature_store on a _Consumer, and returns the consumer.
+    """
+    handlers = {}
+    monkeypatch.setattr(signal, 'signal', handlers.__setitem__)
+
+    def run(store: _FeatureStore, n_messages: int, revoke_after: int = None, **kwargs) -> _Consumer:
+        consumer = _Consumer(n_messages, store, handlers, revoke_after)
+        monkeypatch.setattr(main, 'Application', lambda **app_kwargs: _App(consumer))
+        kwargs.setdefault('batch_linger_ms', None)
+        main.topic_to_feature_store(
+            kafka_broker_address='localhost:9092',
+            kafka_input_topic=TOPIC,
+            kafka_consumer_group='test',
+            feature_store=store,
+            **kwargs,
+        )
+        return consumer
+
+    return run
+
+
+def test_the_offsets_are_committed_once_the_batch_is_written(run):
+    store = _FeatureStore()
+
+    consumer = run(store, n_messages=10, batch_size=3)
+
+    # every message written once, in batches of 3 and the rest when we stop
+    assert [[row['offset'] for row in batch] for batch in store.written] == [
+        [0, 1, 2], [3, 4, 5], [6, 7, 8], [9]
+    ]
+    assert consumer.committed == 10
+
+
+def test_the_consumer_pauses_while_max_in_flight_batches_wait(run):
+    store = _FeatureStore()
+    store.release.clear()
+    # let the writes through a while after the consumer is paused
+    threading.Timer(0.5, store.release.set).start()
+
+    consumer = run(store, n_messages=20, batch_size=2, max_in_flight_batches=2)
+
+    # paused with 2 batches in flight and the 3rd one waiting to be handed over
+    assert consumer.polled_when_paused == 6
+    assert _written_offsets(store) == set(range(20))
+    assert consumer.committed == 20
+
+
+def test_a_failed_write_stops_without_committing_its_batch(run):
+    store = _FeatureStore(fail_on=1)
+
+    with pytest.raises(RuntimeError, match='Failed to write a batch'):
+        run(store, n_messages=10, batch_size=3)
+
+    assert _written_offsets(store) == {0, 1, 2}
+    assert len(store.written) == 1
+
+
+def test_a_revoked_partition_is_written_and_committed_first(run):
+    store = _FeatureStore()
+
+    consumer = run(store, n_messages=8, revoke_after=5, batch_size=100)
+
+    # the 5 messages read when the partition was revoked, in a batch that was not full
+    assert consumer.at_revoke == (set(range(5)), 5)
+    assert [len(batch) for batch in store.written] == [5, 3]
+    assert consumer.committed == 8
@@ -0,0 +1,210 @@
+import asyncio
+from typing import List, Optional
+
+from loguru import logger
+from quixstreams import Application
+from quixstreams.models.topics import Topic, TopicConfig
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade_batch import TradeBatch
+from src.checkpointer import Checkpointer
+from src.delivery_stats import DeliveryStats
+from src.wire_format import TRADE_V1, WireSerializer
+
+# marks the end of the stream in the queue, so the producer task knows it can stop
+_END_OF_STREAM = object()
+
+
+async def produce_trades_async(
+        kafka_broker_address: str,
+        kafka_topic: str,
+        trade_data_source: TradeSource,
+        queue_max_size: int = 1_000,
+        batch_size: int = 500,
+        backpressure: str = 'block',
+        kafka_topic_encoding: str = 'json',
+        producer_extra_config: Optional[dict] = None,
+        stats_interval_sec: float = 10.0,
+        checkpoint_interval_sec: float = 5.0,
+        kafka_topic_partitions: Optional[int] = None,
+):
+    '''
+    Reads trades from the `trade_data_source` and saves them in a given Kafka topic,
+    with socket reads and Kafka produce decoupled by a bounded queue.
+
+    - a reader task pulls batches of trades from the source and puts them in the queue
+    - a producer task drains the queue, sending up to `batch_size` trades in one go
+
+    Both blocking calls (the socket read and the Kafka produce) run in worker threads,
+    so a slow Kafka client never holds back the socket read, and the other way round.
+
+    Args:
+        kafka_broker_address: Kafka broker address
+        kafka_topic: Kafka topic to save the trades
+        trade_data_source: Where the trades come from
+        queue_max_size: Max no. of batches (one per socket message or REST page)
+            buffered between the reader and the producer
+        batch_size: No. of trades after which the producer stops taking more batches
+            from the queue and sends what it has
+        backpressure: What the reader does when the queue is full.
+            'block' waits for the producer to catch up.
+            'drop_oldest' discards the oldest buffered batch to make room, and is
+            rejected for a source with checkpoints, as they would skip the dropped trades.
+        kafka_topic_encoding: Wire format of the messages, 'json', 'msgpack' or 'struct'
+            (see src/wire_format.py)
+        producer_extra_config: librdkafka settings of the producer, e.g. linger.ms,
+            batch.size, compression.type or acks
+        stats_interval_sec: Seconds between two producer stats lines
+        checkpoint_interval_sec: Min seconds between two checkpoints of the source, if it
+            supports them (e.g. a historical backfill with a checkpoint_dir)
+        kafka_topic_partitions: No. of partitions of the topic, if we create it. Trades are
+            keyed by product, so up to that many consumers can share the products.
+            Defaults to the broker's
+
+    Returns:
+        None
+    '''
+    if backpressure not in ('block', 'drop_oldest'):
+        raise ValueError(f"backpressure must be 'block' or 'drop_oldest', but got {backpressure}")
+    if backpressure == 'drop_oldest' and trade_data_source.checkpoint() is not None:
+        # a checkpoint after a dropped batch would skip its trades for good on restart
+        raise ValueError(
+            "backpressure='drop_oldest' loses trades, so it cannot be used with a source "
+            "that checkpoints, e.g. a backfill with a checkpoint_dir. Use 'block'"
+        )
+
+    app = Application(broker_address=kafka_broker_address, producer_extra_config=producer_extra_config)
+    # a new topic gets `kafka_topic_partitions` partitions (on our single redpanda broker)
+    topic_config = (
+        TopicConfig(num_partitions=kafka_topic_partitions, replication_factor=1)
+        if kafka_topic_partitions
+        else None
+    )
+    topic = app.topic(
+        name=kafka_topic, value_serializer=WireSerializer(TRADE_V1, kafka_topic_encoding), config=topic_config
+    )
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_max_size)
+    stats = DeliveryStats(interval_sec=stats_interval_sec)
+
+    with app.get_producer() as producer:
+        checkpointer = Checkpointer(trade_data_source, producer, stats, interval_sec=checkpoint_interval_sec)
+
+        reader = asyncio.create_task(
+            _read_trades(trade_data_source, queue, backpressure)
+        )
+        writer = asyncio.create_task(
+            _produce_batches(queue, producer, topic, batch_size, kafka_topic_encoding, stats, checkpointer)
+        )
+
+        # both tasks finish once the source is done and the queue is drained.
+        # If either of them fails we cancel the other one and re-raise the error
+        done, pending = await asyncio.wait(
+            [reader, writer], return_when=asyncio.FIRST_EXCEPTION
+        )
+        for task in pending:
+            task.cancel()
+
+        for task in done:
+            task.result()
+
+        # the source is exhausted and the queue drained: wait for every delivery, then
+        # save where we stopped
+        checkpointer.finish(trade_data_source.checkpoint())
+
+
+async def _read_trades(
+        trade_data_source: TradeSource,
+        queue: asyncio.Queue,
+        backpressure: str,
+):
+    '''
+    Reads batches of trades from the source until it is done, and puts them in the queue,
+    each one with the checkpoint of the source right after it.
+    '''
+    n_dropped = 0
+
+    while not trade_data_source.is_done():
+        trades: TradeBatch = await asyncio.to_thread(trade_data_source.get_trades)
+        checkpoint = trade_data_source.checkpoint()
+
+        # empty batches still move the checkpoint forward, e.g. at the end of a segment
+        if len(trades) == 0 and checkpoint is None:
+            continue
+
+        if backpressure == 'drop_oldest' and queue.full():
+            dropped_trades, _ = queue.get_nowait()
+            n_dropped += len(dropped_trades)
+            logger.warning(f"Queue is full, dropped {n_dropped} trades so far")
+
+        await queue.put((trades, checkpoint))
+
+    await queue.put(_END_OF_STREAM)
+
+
+async def _produce_batches(
+        queue: asyncio.Queue,
+        producer,
+        topic: Topic,
+        batch_size: int,
+        encoding: str,
+        stats: DeliveryStats,
+        checkpointer: Checkpointer,
+):
+    '''
+    Drains the queue and produces the trades to Kafka, up to about `batch_size` trades at a time.
+    '''
+    checkpoint = None
+
+    while True:
+        batches: List[TradeBatch] = []
+        n_trades = 0
+        end_of_stream = False
+
+        # wait for at least one batch, then take whatever else is already buffered
+        item = await queue.get()
+        while True:
+            if item is _END_OF_STREAM:
+                end_of_stream = True
+                break
+
+            trades, checkpoint = item
+            batches.append(trades)
+            n_trades += len(trades)
+
+            if n_trades >= batch_size or queue.empty():
+                break
+            item = queue.get_nowait()
+
+        if batches:
+            await asyncio.to_thread(_produce_batches_sync, producer, topic, batches, encoding, stats)
+            stats.maybe_log(queue_depth=len(producer))
+            logger.debug("Pushed {} trades to Kafka topic, {} batches still in the queue", n_trades, queue.qsize())
+
+        # flushing the producer blocks, so it runs in a worker thread too.
+        # The last checkpoint is committed by `Checkpointer.finish`
+        if not end_of_stream:
+            await asyncio.to_thread(checkpointer.maybe_commit, checkpoint)
+
+        if end_of_stream:
+            return
+
+
+def _produce_batches_sync(
+        producer,
+        topic: Topic,
+        batches: List[TradeBatch],
+        encoding: str,
+        stats: DeliveryStats,
+):
+    '''
+    Serializes and produces the batches of trades, then serves the delivery callbacks.
+    '''
+    for trades in batches:
+        messages = trades.to_messages(encoding)
+        for key, value in messages:
+            producer.produce(topic=topic.name, value=value, key=key, on_delivery=stats.on_delivery)
+
+        stats.on_produce(len(messages), sum(len(value) for _, value in messages))
+
+    producer.poll(0)
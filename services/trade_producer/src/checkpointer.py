@@ -0,0 +1,106 @@
+import time
+from typing import Optional
+
+from loguru import logger
+
+from src.delivery_stats import DeliveryStats
+from src.trade_data_source.base import TradeSource
+
+
+class Checkpointer:
+    """
+    Commits the checkpoints of a TradeSource, at most every `interval_sec` seconds,
+    once every trade returned before the checkpoint has been delivered to Kafka.
+
+    Before each commit we flush the producer. If any message failed to be delivered
+    since the last commit we stop with an error instead, so a restart resumes from
+    the last checkpoint and no trade is lost.
+    """
+
+    def __init__(
+        self,
+        trade_data_source: TradeSource,
+        producer,
+        stats: DeliveryStats,
+        interval_sec: float = 5.0,
+    ) -> None:
+        """
+        Args:
+            trade_data_source (TradeSource): The source whose checkpoints we commit.
+            producer: The Kafka producer the trades are sent with.
+            stats (DeliveryStats): The delivery callback of the producer, which counts the errors.
+            interval_sec (float): Min no. of seconds between two commits, as each of
+                them flushes the producer.
+
+        Returns:
+            None
+        """
+        self.trade_data_source = trade_data_source
+        self.producer = producer
+        self.stats = stats
+        self.interval_sec = interval_sec
+
+        self._last_commit_time = time.monotonic()
+        self._n_errors_at_last_commit = stats.n_errors_total
+
+    def maybe_commit(self, checkpoint: Optional[dict], force: bool = False) -> None:
+        """
+        Commits the checkpoint if `interval_sec` went by since the last commit, or if `force`.
+
+        Args:
+            checkpoint (Optional[dict]): The checkpoint of the source right after the last
+                trades we produced. None if the source cannot resume.
+            force (bool): Commit now, e.g. when the source is done.
+
+        Returns:
+            None
+        """
+        if checkpoint is None:
+            return
+
+        if not force and time.monotonic() - self._last_commit_time < self.interval_sec:
+            return
+
+        self.producer.flush()
+
+        n_errors = self.stats.n_errors_total - self._n_errors_at_last_commit
+        if n_errors > 0:
+            raise RuntimeError(
+                f'{n_errors} trades could not be delivered to Kafka since the last checkpoint. '
+                f'Restart to resume from it'
+            )
+
+        self.trade_data_source.commit_checkpoint(checkpoint)
+        logger.debug('Committed the checkpoint of the trade source')
+
+        self._last_commit_time = time.monotonic()
+
+    def finish(self, checkpoint: Optional[dict]) -> None:
+        """
+        Ends the run once the source is done: flushes the producer, logs the summary of
+        the run and commits the last checkpoint, marked complete.
+
+        Raises if any trade of the run could not be delivered, so a backfill job exits
+        with an error and a restart resumes from the last checkpoint.
+
+        Args:
+            checkpoint (Optional[dict]): The checkpoint of the source after its last trades.
+
+        Returns:
+            None
+        """
+        self.producer.flush()
+        self.stats.log_summary()
+
+        if self.stats.n_errors_total > 0:
+            raise RuntimeError(
+                f'{self.stats.n_errors_total} trades could not be delivered to Kafka. '
+                f'Restart to resume from the last checkpoint'
+            )
+
+        # the next run starts a new job instead of resuming this finished one
+        if checkpoint is not None:
+            checkpoint = {**checkpoint, 'complete': True}
+
+        self.maybe_commit(checkpoint, force=True)
+        logger.info('The trade source is done, stopping')
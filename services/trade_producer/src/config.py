@@ -1,16 +1,91 @@
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional, Union
 
 class Config(BaseSettings):
     kafka_broker_address: str
     kafka_topic: str
-    product_id: str
+    # either a single product id, e.g. PRODUCT_ID=BTC/USD, or a JSON list of them,
+    # e.g. PRODUCT_ID='["BTC/USD", "ETH/USD"]'. It is always a list after validation.
+    product_id: Union[str, List[str]]
     
+    # 'live', 'historical', 'replay', or 'hybrid': backfill the last_n_days, then
+    # switch to the live trades without a gap (see src/trade_data_source/hybrid_trade_source.py)
     live_or_historical: Optional[str] = None
     last_n_days: Optional[int] = None
+    # hybrid mode buffers up to this many batches of live trades during the backfill.
+    # Past that it stops reading the socket, and fills the gap from the REST API later
+    hybrid_max_buffered_batches: Optional[int] = 10_000
+
+    # endpoints of the Kraken APIs, e.g. to run against benchmarks/mock_kraken.py.
+    # The REST URL is a template with {product_id} and {since_ns} placeholders
+    kraken_ws_url: Optional[str] = None
+    kraken_rest_url: Optional[str] = None
+
+    # when the Websocket connection drops, we reconnect with exponential backoff (up to
+    # kraken_ws_max_backoff_sec between two attempts) and fetch the trades we missed from
+    # the REST API. None retries forever
+    kraken_ws_gap_fill: Optional[bool] = True
+    kraken_ws_max_reconnect_attempts: Optional[int] = None
+    kraken_ws_max_backoff_sec: Optional[float] = 60.0
+
+    # historical backfill: the range is split in `backfill_n_shards` time shards that are
+    # fetched concurrently, all of them sharing one rate limiter
+    backfill_n_shards: Optional[int] = 1
+    backfill_max_workers: Optional[int] = None
+    kraken_rest_requests_per_sec: Optional[float] = 1.0
+    # the REST rate limiter speeds up from kraken_rest_requests_per_sec until Kraken
+    # pushes back, but never beyond this rate
+    kraken_rest_max_requests_per_sec: Optional[float] = 10.0
+    # fixed boundaries of the backfill job, in Unix milliseconds, instead of last_n_days
+    backfill_from_ms: Optional[int] = None
+    backfill_to_ms: Optional[int] = None
+    # where the backfill keeps its checkpoints. A restarted backfill resumes from them,
+    # with the boundaries of its first run, instead of producing everything again
+    backfill_checkpoint_dir: Optional[str] = None
+    checkpoint_interval_sec: Optional[float] = 5.0
+    # where historical trades are kept between backfills, partitioned by product and day.
+    # Only the time ranges that are not there yet are downloaded from Kraken
+    cache_dir: Optional[str] = None
+
+    # replay mode (LIVE_OR_HISTORICAL=replay): recorded trades in parquet or JSONL files
+    # (a file or a directory, like cache_dir) replayed at `replay_speed` times real time.
+    # A replay_speed of 0 replays them as fast as possible
+    replay_path: Optional[str] = None
+    replay_speed: Optional[float] = 1.0
+
+    # 'sync' runs the blocking read -> produce loop, 'async' decouples the socket reads
+    # from the Kafka produce with a bounded queue (see src/async_producer.py)
+    ingestion_mode: Optional[str] = 'sync'
+    async_queue_max_size: Optional[int] = 1_000
+    async_batch_size: Optional[int] = 500
+    async_backpressure: Optional[str] = 'block'
+
+    # wire format of the trades we produce: 'json' (the default), 'msgpack' or 'struct'.
+    # Consumers tell the encodings apart on their own (see src/wire_format.py)
+    kafka_topic_encoding: Optional[str] = 'json'
+    # no. of partitions of the trades topic, when we create it. The trades are keyed by
+    # product, so up to that many trade_to_ohlc workers can share them
+    kafka_topic_partitions: Optional[int] = None
+
+    # Kafka producer tuning (librdkafka settings): wait up to linger_ms to fill batches of
+    # up to batch_size bytes, compress them, and wait for `acks` replicas to acknowledge
+    kafka_producer_linger_ms: Optional[int] = 100
+    kafka_producer_batch_size: Optional[int] = 1_000_000
+    kafka_producer_compression_type: Optional[str] = 'lz4'
+    kafka_producer_acks: Optional[str] = 'all'
+    # seconds between two producer stats lines (msgs/s, bytes/s, queue depth, delivery latency)
+    producer_stats_interval_sec: Optional[float] = 10.0
+
+    @field_validator('product_id')
+    @classmethod
+    def _product_id_as_list(cls, value: Union[str, List[str]]) -> List[str]:
+        if isinstance(value, str):
+            return [value]
+        return value
 
     class Config:
         env_file = ".env"
 
 
-config = Config()
\ No newline at end of file
+config = Config()
@@ -0,0 +1,136 @@
+import random
+import time
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+
+class DeliveryStats:
+    """
+    Keeps track of what the producer sends to Kafka and what Kafka acknowledges,
+    and logs one stats line every `interval_sec` seconds:
+
+        msgs/s, bytes/s, producer queue depth, delivery latency p50/p95/p99, errors
+
+    and a summary of the whole run with `log_summary`, e.g. at the end of a backfill job.
+
+    `on_delivery` is the delivery callback we pass to every `produce` call. It is one
+    bound method shared by all the messages, so we do not build a closure per message.
+    """
+
+    def __init__(self, interval_sec: float = 10.0, max_latency_samples: int = 10_000) -> None:
+        """
+        Args:
+            interval_sec (float): Seconds between two stats lines.
+            max_latency_samples (int): Max no. of delivery latencies kept per interval
+                to compute the percentiles. Beyond that we keep a uniform random sample.
+
+        Returns:
+            None
+        """
+        self.interval_sec = interval_sec
+        self.max_latency_samples = max_latency_samples
+
+        # totals since the start
+        self._start = time.monotonic()
+        self.n_batches_total = 0
+        self.n_produced_total = 0
+        self.n_bytes_total = 0
+        self.n_delivered_total = 0
+        self.n_errors_total = 0
+        self.errors_by_code: Counter = Counter()
+
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self._window_start = time.monotonic()
+        self._n_produced = 0
+        self._n_bytes = 0
+        self._n_delivered = 0
+        self._n_latencies_seen = 0
+        self._latencies_ms = []
+
+    def on_produce(self, n_messages: int, n_bytes: int) -> None:
+        """
+        Counts messages handed over to the producer, one batch of the source (a socket
+        message or a REST page) at a time.
+        """
+        if n_messages > 0:
+            self.n_batches_total += 1
+        self.n_produced_total += n_messages
+        self.n_bytes_total += n_bytes
+        self._n_produced += n_messages
+        self._n_bytes += n_bytes
+
+    def on_delivery(self, err, msg) -> None:
+        """
+        Delivery callback of the Kafka producer, called from `poll` / `flush`.
+        """
+        if err is not None:
+            self.n_errors_total += 1
+            self.errors_by_code[err.name()] += 1
+            # log each kind of error once, the stats line keeps the counts
+            if self.errors_by_code[err.name()] == 1:
+                logger.error(f"Failed to deliver message to {msg.topic()}: {err}")
+            return
+
+        self.n_delivered_total += 1
+        self._n_delivered += 1
+
+        latency = msg.latency()
+        if latency is None:
+            return
+
+        # reservoir sampling, so the percentiles cost the same whatever the throughput
+        self._n_latencies_seen += 1
+        if len(self._latencies_ms) < self.max_latency_samples:
+            self._latencies_ms.append(latency * 1000)
+        else:
+            i = random.randrange(self._n_latencies_seen)
+            if i < self.max_latency_samples:
+                self._latencies_ms[i] = latency * 1000
+
+    def maybe_log(self, queue_depth: Optional[int] = None) -> None:
+        """
+        Logs the stats line if at least `interval_sec` seconds went by since the last one.
+
+        Args:
+            queue_depth (Optional[int]): No. of messages waiting in the producer queue.
+
+        Returns:
+            None
+        """
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.interval_sec:
+            return
+
+        if self._latencies_ms:
+            p50, p95, p99 = np.percentile(self._latencies_ms, [50, 95, 99])
+            latency = f"p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms"
+        else:
+            latency = "n/a"
+
+        logger.info(
+            f"Producer stats: {self._n_produced / elapsed:.1f} msgs/s, "
+            f"{self._n_bytes / elapsed:.1f} bytes/s, "
+            f"{self._n_delivered} delivered, queue depth {queue_depth}, "
+            f"delivery latency {latency}, "
+            f"{self.n_errors_total} errors {dict(self.errors_by_code)}"
+        )
+
+        self._reset_window()
+
+    def log_summary(self) -> None:
+        """
+        Logs the totals of the whole run: trades, batches, bytes, wall time and throughput.
+        """
+        elapsed = time.monotonic() - self._start
+
+        logger.info(
+            f"Produced {self.n_produced_total} trades from {self.n_batches_total} pages, "
+            f"{self.n_bytes_total} bytes, in {elapsed:.1f}s "
+            f"({self.n_produced_total / elapsed:.1f} trades/s, {self.n_bytes_total / elapsed:.1f} bytes/s). "
+            f"{self.n_delivered_total} delivered, {self.n_errors_total} errors {dict(self.errors_by_code)}"
+        )
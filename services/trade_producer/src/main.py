@@ -1,21 +1,44 @@
 from quixstreams import Application
+from quixstreams.models.topics import TopicConfig
 from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
 from loguru import logger
-from typing import List
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 from src.trade_data_source.base import TradeSource
+from src.wire_format import TRADE_V1, WireSerializer
+from src.delivery_stats import DeliveryStats
+from src.checkpointer import Checkpointer
+from typing import Optional
 def produce_trades(
         kafka_broker_address: str,
         kafka_topic: str,
         trade_data_source: TradeSource,
+        kafka_topic_encoding: str = 'json',
+        producer_extra_config: Optional[dict] = None,
+        stats_interval_sec: float = 10.0,
+        checkpoint_interval_sec: float = 5.0,
+        kafka_topic_partitions: Optional[int] = None,
 ):
     '''
-    Reads from a Kraken Websocket API endpoint and save them in a given Kafka topic
+    Reads from a Kraken Websocket API endpoint and save them in a given Kafka topic.
+
+    Runs until the source is done, which a live source never is. Then it flushes the
+    producer, commits the last checkpoint and logs a summary of the run. If any trade
+    could not be delivered it raises, so a backfill job exits non-zero.
 
     Args:
         kafka_broker_address: Kafka broker address
         kafka_topic: Kafka topic to save the trades
-        product_id: Product id to filter the trades
+        trade_data_source: Where the trades come from
+        kafka_topic_encoding: Wire format of the messages, 'json', 'msgpack' or 'struct'
+            (see src/wire_format.py)
+        producer_extra_config: librdkafka settings of the producer, e.g. linger.ms,
+            batch.size, compression.type or acks
+        stats_interval_sec: Seconds between two producer stats lines
+        checkpoint_interval_sec: Min seconds between two checkpoints of the source, if it
+            supports them (e.g. a historical backfill with a checkpoint_dir)
+        kafka_topic_partitions: No. of partitions of the topic, if we create it. Trades are
+            keyed by product, so up to that many consumers can share the products.
+            Defaults to the broker's
 
     Returns:
         None
@@ -23,29 +46,50 @@ def produce_trades(
     
 
     # Create an Application instance with Kafka config
-    app = Application(broker_address=kafka_broker_address)
+    app = Application(broker_address=kafka_broker_address, producer_extra_config=producer_extra_config)
 
-    # Define a topic "my_topic" with JSON serialization
-    topic = app.topic(name=kafka_topic, value_serializer='json')
+    # a new topic gets `kafka_topic_partitions` partitions (on our single redpanda broker)
+    topic_config = (
+        TopicConfig(num_partitions=kafka_topic_partitions, replication_factor=1)
+        if kafka_topic_partitions
+        else None
+    )
 
-    # Create a KrakenWebsocketAPI instance
-    
-    # Create a Producer instance
+    # Define a topic "my_topic" with our wire format (JSON unless told otherwise)
+    topic = app.topic(
+        name=kafka_topic, value_serializer=WireSerializer(TRADE_V1, kafka_topic_encoding), config=topic_config
+    )
+
+    # counts what we send and what Kafka acknowledges, and logs it every `stats_interval_sec`
+    stats = DeliveryStats(interval_sec=stats_interval_sec)
+
+    # Create a Producer instance. Leaving the `with` block flushes the messages still in its queue
     with app.get_producer() as producer:
-        while True:
-            
-            trades: List[Trade] = trade_data_source.get_trades() # this will the trades which will be a list of dictionaries with a product_id key and a list of trades as value.
-            
-            for trade in trades:
+
+        # saves where the source is, once the trades before that point are in Kafka
+        checkpointer = Checkpointer(trade_data_source, producer, stats, interval_sec=checkpoint_interval_sec)
+
+        while not trade_data_source.is_done():
             
-                # Serialize an event using the defined Topic
-                # transform it into a sequence of bytes
-                message = topic.serialize(key=trade.product_id, value=trade.model_dump()) # the point of adding key here is to partition the data which helps to read the data from the kafka topic in parallel 
-                
-                # Produce a message into the Kafka topic
-                producer.produce(topic=topic.name, value=message.value, key=message.key)
+            trades: TradeBatch = trade_data_source.get_trades() # a batch of trades, stored as columns
+
+            # Serialize the whole batch straight from its columns, without building a Trade per row.
+            # Each message is keyed by its product_id to partition the data, which helps to read the data from the kafka topic in parallel
+            messages = trades.to_messages(kafka_topic_encoding)
+            for key, value in messages:
+
+                # Produce a message into the Kafka topic. `produce` also serves the delivery callbacks
+                producer.produce(topic=topic.name, value=value, key=key, on_delivery=stats.on_delivery)
 
-                logger.debug(f"Pushed trade to Kafka topic: {trade}")
+            stats.on_produce(len(messages), sum(len(value) for _, value in messages))
+            stats.maybe_log(queue_depth=len(producer))
+            checkpointer.maybe_commit(trade_data_source.checkpoint())
+
+            # the message is only formatted if debug logs are enabled
+            logger.debug("Pushed {} trades to Kafka topic", len(trades))
+
+        # the source is exhausted: wait for every delivery, then save where we stopped
+        checkpointer.finish(trade_data_source.checkpoint())
             
                 
 if __name__ == "__main__":
@@ -56,17 +100,137 @@ if __name__ == "__main__":
     if config.live_or_historical == "live":
             
         from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
-        kraken_api = KrakenWebsocketAPI(product_id=config.product_id)
+        from src.trade_data_source.rate_limiter import AdaptiveRateLimiter
+        # one connection for all the products we track. It reconnects on its own, and
+        # fills the gaps from the REST API
+        kraken_api = KrakenWebsocketAPI(
+            product_ids=config.product_id,
+            url=config.kraken_ws_url,
+            rest_url=config.kraken_rest_url,
+            rate_limiter=AdaptiveRateLimiter(
+                rate_per_sec=config.kraken_rest_requests_per_sec,
+                max_rate_per_sec=config.kraken_rest_max_requests_per_sec,
+            ),
+            gap_fill=config.kraken_ws_gap_fill,
+            max_reconnect_attempts=config.kraken_ws_max_reconnect_attempts,
+            max_backoff_sec=config.kraken_ws_max_backoff_sec,
+        )
 
     elif config.live_or_historical == "historical":
 
         from src.trade_data_source.kraken_rest_api import KrakenRestAPI
-        kraken_api = KrakenRestAPI(product_id=config.product_id, last_n_days=config.last_n_days)
+        from src.trade_data_source.rate_limiter import AdaptiveRateLimiter
+
+        # the REST API pages through the trades of one pair at a time
+        if len(config.product_id) != 1:
+            raise ValueError(f"historical mode expects exactly one product_id, but got {config.product_id}")
+
+        if config.backfill_n_shards > 1:
+
+            from src.trade_data_source.sharded_kraken_rest_api import ShardedKrakenRestAPI
+            kraken_api = ShardedKrakenRestAPI(
+                product_id=config.product_id[0],
+                last_n_days=config.last_n_days,
+                n_shards=config.backfill_n_shards,
+                max_workers=config.backfill_max_workers,
+                rate_per_sec=config.kraken_rest_requests_per_sec,
+                max_rate_per_sec=config.kraken_rest_max_requests_per_sec,
+                cache_dir=config.cache_dir,
+                url=config.kraken_rest_url,
+                from_ms=config.backfill_from_ms,
+                to_ms=config.backfill_to_ms,
+                checkpoint_dir=config.backfill_checkpoint_dir,
+            )
+
+        else:
+            kraken_api = KrakenRestAPI(
+                product_id=config.product_id[0],
+                last_n_days=config.last_n_days,
+                rate_limiter=AdaptiveRateLimiter(
+                    rate_per_sec=config.kraken_rest_requests_per_sec,
+                    max_rate_per_sec=config.kraken_rest_max_requests_per_sec,
+                ),
+                cache_dir=config.cache_dir,
+                url=config.kraken_rest_url,
+                from_ms=config.backfill_from_ms,
+                to_ms=config.backfill_to_ms,
+                checkpoint_dir=config.backfill_checkpoint_dir,
+            )
+
+    elif config.live_or_historical == "replay":
+
+        from src.trade_data_source.file_replay import FileReplayTradeSource
+        # recorded trades, e.g. the cache_dir of a backfill, replayed at N times real time
+        kraken_api = FileReplayTradeSource(
+            paths=config.replay_path,
+            speed=config.replay_speed,
+            product_ids=config.product_id,
+        )
+
+    elif config.live_or_historical == "hybrid":
+
+        from src.trade_data_source.hybrid_trade_source import HybridTradeSource
+        from src.trade_data_source.rate_limiter import AdaptiveRateLimiter
+        # backfills the last_n_days (or since backfill_from_ms), then streams live trades,
+        # all on one topic
+        kraken_api = HybridTradeSource(
+            product_ids=config.product_id,
+            last_n_days=config.last_n_days,
+            from_ms=config.backfill_from_ms,
+            cache_dir=config.cache_dir,
+            rate_limiter=AdaptiveRateLimiter(
+                rate_per_sec=config.kraken_rest_requests_per_sec,
+                max_rate_per_sec=config.kraken_rest_max_requests_per_sec,
+            ),
+            ws_url=config.kraken_ws_url,
+            rest_url=config.kraken_rest_url,
+            max_buffered_batches=config.hybrid_max_buffered_batches,
+        )
+
+    else:
+        raise ValueError(f"live_or_historical must be 'live', 'historical', 'replay' or 'hybrid', but got {config.live_or_historical}")    
+
+    # batching and compression of the Kafka producer
+    producer_extra_config = {
+        'linger.ms': config.kafka_producer_linger_ms,
+        'batch.size': config.kafka_producer_batch_size,
+        'compression.type': config.kafka_producer_compression_type,
+        'acks': config.kafka_producer_acks,
+    }
+    if config.kafka_producer_acks != 'all':
+        # idempotent producing (on by default in quixstreams) needs acks=all
+        producer_extra_config['enable.idempotence'] = False
+
+    if config.ingestion_mode == "async":
+
+        import asyncio
+        from src.async_producer import produce_trades_async
+
+        asyncio.run(produce_trades_async(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_topic=config.kafka_topic,
+            trade_data_source=kraken_api,
+            queue_max_size=config.async_queue_max_size,
+            batch_size=config.async_batch_size,
+            backpressure=config.async_backpressure,
+            kafka_topic_encoding=config.kafka_topic_encoding,
+            producer_extra_config=producer_extra_config,
+            stats_interval_sec=config.producer_stats_interval_sec,
+            checkpoint_interval_sec=config.checkpoint_interval_sec,
+            kafka_topic_partitions=config.kafka_topic_partitions,
+        ))
+
+    elif config.ingestion_mode == "sync":
+        produce_trades(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_topic=config.kafka_topic,
+            trade_data_source=kraken_api,
+            kafka_topic_encoding=config.kafka_topic_encoding,
+            producer_extra_config=producer_extra_config,
+            stats_interval_sec=config.producer_stats_interval_sec,
+            checkpoint_interval_sec=config.checkpoint_interval_sec,
+            kafka_topic_partitions=config.kafka_topic_partitions,
+        )
 
     else:
-        raise ValueError(f"live_or_historical must be 'live' or 'historical', but got {config.live_or_historical}")    
-    produce_trades(
-        kafka_broker_address=config.kafka_broker_address,
-        kafka_topic=config.kafka_topic,
-        trade_data_source=kraken_api
-    )
\ No newline at end of file
+        raise ValueError(f"ingestion_mode must be 'sync' or 'async', but got {config.ingestion_mode}")
\ No newline at end of file
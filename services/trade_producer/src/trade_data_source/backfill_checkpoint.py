@@ -0,0 +1,101 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+
+class BackfillCheckpointStore:
+    """
+    Durable checkpoints of historical backfills, one JSON file per product:
+
+        {checkpoint_dir}/{product}.json
+
+    A checkpoint holds the boundaries of the backfill job, fixed when the job first
+    started, and the position of every shard of the job, e.g.
+
+        {
+            "product_id": "BTC/USD",
+            "from_ms": 1727740800000,
+            "to_ms": 1730332800000,
+            "shards": [
+                {"segments": [[1727740800000, 1730332800000, false]], "since_ns": 1728000000123456789}
+            ]
+        }
+
+    where `segments` are the ranges the shard still has to read and `since_ns` the
+    pagination cursor inside the first of them (see KrakenRestAPI).
+
+    A checkpoint is only saved once every trade before it is in Kafka, so a restarted
+    backfill resumes right after the last trade it produced.
+
+    The last checkpoint of a job that ran to the end is marked `"complete": true`
+    (see Checkpointer.finish), so the next backfill of the product starts a new job
+    instead of resuming the finished one.
+    """
+
+    def __init__(self, checkpoint_dir: str) -> None:
+        self.checkpoint_dir = Path(checkpoint_dir)
+
+        if not self.checkpoint_dir.exists():
+            # create the checkpoint directory if it does not exist
+            self.checkpoint_dir.mkdir(parents=True)
+
+    def load(
+        self,
+        product_id: str,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+    ) -> Optional[dict]:
+        """
+        Returns the checkpoint of the unfinished backfill of the given product, or None
+        if there is none, or if the last backfill ran to the end.
+
+        Args:
+            product_id (str): The product of the backfill.
+            from_ms (Optional[int]): Start of the time range we were asked to backfill, if any.
+            to_ms (Optional[int]): End of the time range we were asked to backfill, if any.
+
+        Raises:
+            ValueError: if we were asked for a time range other than the one of the
+                unfinished backfill, which we would otherwise resume instead.
+        """
+        path = self._get_path(product_id)
+        if not path.exists():
+            return None
+
+        checkpoint = json.loads(path.read_text())
+        if checkpoint.get('complete', False):
+            logger.info(f'The last backfill of {product_id} is complete, starting a new one')
+            return None
+
+        if (from_ms, to_ms) != (None, None) and (from_ms, to_ms) != (
+            checkpoint['from_ms'],
+            checkpoint['to_ms'],
+        ):
+            raise ValueError(
+                f"The unfinished backfill of {product_id} in {path} is for "
+                f"[{checkpoint['from_ms']}, {checkpoint['to_ms']}], not [{from_ms}, {to_ms}]. "
+                f"Resume it with the same range, or delete its checkpoint"
+            )
+
+        return checkpoint
+
+    def save(self, product_id: str, checkpoint: dict) -> None:
+        """
+        Saves the checkpoint of the given product, replacing the previous one.
+        """
+        path = self._get_path(product_id)
+
+        # write to a temporary file first, so a crash never leaves a half-written checkpoint
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _get_path(self, product_id: str) -> Path:
+        # product ids like BTC/USD are not valid file names
+        return self.checkpoint_dir / f"{product_id.replace('/', '-')}.json"
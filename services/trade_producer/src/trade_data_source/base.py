@@ -1,14 +1,14 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Optional
 
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 
 class TradeSource(ABC):
 
     @abstractmethod
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         '''
-        Retrieves the trades from whatever source you connect to
+        Retrieves the trades from whatever source you connect to, as a batch of columns
         '''
         pass
 
@@ -17,4 +17,18 @@ class TradeSource(ABC):
         '''
         Returns True if there are no more trades to read, otherwise False
         '''
-        pass
\ No newline at end of file
+        pass
+
+    def checkpoint(self) -> Optional[dict]:
+        '''
+        Returns the position right after the trades returned so far by get_trades,
+        to resume from after a restart. None if the source cannot resume.
+        '''
+        return None
+
+    def commit_checkpoint(self, checkpoint: dict) -> None:
+        '''
+        Saves a checkpoint returned by `checkpoint()`. Only call it once every trade
+        returned before that checkpoint is durably in Kafka.
+        '''
+        pass
@@ -0,0 +1,132 @@
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class FileReplayTradeSource(TradeSource):
+    """
+    Replays recorded trades from parquet or JSONL files, at a multiple of real time.
+
+    The files can be the parquet parts of a TradeStore (the `cache_dir` of a backfill)
+    or JSONL files with one trade per line, as we produce them to Kafka. The trades of
+    all the files are merged and replayed in event-time order, across all the products.
+
+    With `speed=10`, one minute of recorded trades is replayed in 6 seconds. With
+    `speed=None` (or 0) trades are replayed as fast as the consumer can take them.
+    """
+
+    def __init__(
+        self,
+        paths: Union[str, List[str]],
+        speed: Optional[float] = 1.0,
+        product_ids: Optional[List[str]] = None,
+        max_batch_size: int = 1_000,
+    ) -> None:
+        """
+        Args:
+            paths (Union[str, List[str]]): Files to replay, or directories that are searched
+                recursively for *.parquet and *.jsonl files.
+            speed (Optional[float]): Replay speed as a multiple of real time.
+                None or 0 replays as fast as possible.
+            product_ids (Optional[List[str]]): Only replay the trades of these products.
+                Defaults to all of them.
+            max_batch_size (int): Max no. of trades returned by one `get_trades` call.
+
+        Returns:
+            None
+        """
+        self.speed = speed or None
+        self.max_batch_size = max_batch_size
+
+        files = self._find_files([paths] if isinstance(paths, str) else paths)
+        if not files:
+            raise ValueError(f'No parquet or JSONL files found in {paths}')
+
+        trades = TradeBatch.concat([self._read_file(path) for path in files])
+        if product_ids is not None:
+            trades = trades[np.isin(trades.product_id, product_ids)]
+
+        # a stable sort keeps the order of the files for trades in the same millisecond
+        self.trades = trades[np.argsort(trades.timestamp_ms, kind='stable')]
+        self._cursor = 0
+
+        # wall-clock time at which we replay the first trade, set on the first call
+        self._start_time: Optional[float] = None
+
+        logger.debug(f'Replaying {len(self.trades)} trades from {len(files)} files at speed {self.speed or "max"}')
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next trades that are due at the replay speed, in event-time order.
+        Waits until the next trade is due if none is.
+        """
+        if self.is_done():
+            return TradeBatch.empty()
+
+        end = min(self._cursor + self.max_batch_size, len(self.trades))
+
+        if self.speed is not None:
+            first_ts = self.trades.timestamp_ms[0]
+            if self._start_time is None:
+                self._start_time = time.monotonic()
+
+            # wait until the next trade is due
+            next_due = self._start_time + (self.trades.timestamp_ms[self._cursor] - first_ts) / 1000 / self.speed
+            wait = next_due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            # and return it with all the trades that are due by now
+            due_ts = first_ts + (time.monotonic() - self._start_time) * 1000 * self.speed
+            end = min(end, int(np.searchsorted(self.trades.timestamp_ms, due_ts, side='right')))
+            end = max(end, self._cursor + 1)
+
+        trades = self.trades[self._cursor:end]
+        self._cursor = end
+
+        return trades
+
+    def is_done(self) -> bool:
+        return self._cursor >= len(self.trades)
+
+    @staticmethod
+    def _find_files(paths: List[str]) -> List[Path]:
+        """
+        Expands the directories in `paths` to the parquet and JSONL files they contain.
+        """
+        files = []
+        for path in map(Path, paths):
+            if path.is_dir():
+                files.extend(sorted(path.rglob('*.parquet')))
+                files.extend(sorted(path.rglob('*.jsonl')))
+            else:
+                files.append(path)
+
+        return files
+
+    @staticmethod
+    def _read_file(path: Path) -> TradeBatch:
+        """
+        Reads the trades of one parquet or JSONL file.
+        """
+        if path.suffix == '.parquet':
+            import pyarrow.parquet as pq
+
+            return TradeBatch.from_arrow(pq.read_table(path))
+
+        if path.suffix in ('.jsonl', '.json'):
+            import pyarrow.json as pj
+
+            table = pj.read_json(path)
+            if table.num_rows == 0:
+                return TradeBatch.empty()
+
+            return TradeBatch.from_arrow(table)
+
+        raise ValueError(f'Cannot replay {path}, only parquet and JSONL files are supported')
@@ -0,0 +1,221 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI, make_session, ts_to_date
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.rate_limiter import AdaptiveRateLimiter, RateLimiter
+from src.trade_data_source.seen_trades import SeenTrades
+from src.trade_data_source.trade_batch import TradeBatch
+from src.trade_data_source.trade_store import MS_PER_DAY
+
+# how long get_trades waits for live trades before it returns an empty batch
+_LIVE_POLL_TIMEOUT_SEC = 1.0
+
+# how far behind our clock the cached part of the backfill stops
+_HISTORY_MARGIN_MS = 60_000
+
+
+class HybridTradeSource(TradeSource):
+    """
+    Backfills the historical trades of the products, then switches to the live stream,
+    without a gap and without duplicates, on one topic.
+
+    1. We subscribe to the live trades first. They are buffered while we backfill.
+    2. For each product, we page the REST API forward from `from_ms` until it reaches
+       the first buffered live trade of the product, or until it has no newer trades
+       (an empty page) if the product did not trade since we subscribed. The last REST
+       trade we return is the cut-off.
+    3. Then we return the buffered live trades, and keep streaming, without the ones
+       the REST API already returned: those before the cut-off, and those in the
+       same millisecond as the cut-off that match a REST trade.
+
+    The cut-off uses the exchange timestamps, not our clock. Every trade after the first
+    live trade, or after an empty REST page, happened after we subscribed, so the live
+    stream has it.
+
+    The buffer of live trades is bounded. Once it is full we stop reading the socket
+    until the backfill catches up. If Kraken drops the stalled connection meanwhile,
+    KrakenWebsocketAPI reconnects and fetches the trades we missed from the REST API,
+    so a long backfill costs a few gap fills instead of unbounded memory.
+    """
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        last_n_days: Optional[int] = None,
+        from_ms: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        ws_url: Optional[str] = None,
+        rest_url: Optional[str] = None,
+        max_buffered_batches: int = 10_000,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The products we backfill and then stream live.
+            last_n_days (Optional[int]): The number of days of history we backfill.
+            from_ms (Optional[int]): Start of the backfill, used instead of `last_n_days`.
+            cache_dir (Optional[str]): The directory of the trade store used by the backfill.
+            rate_limiter (Optional[RateLimiter]): Caps the rate of the REST requests.
+            ws_url (Optional[str]): The Websocket API endpoint, defaults to Kraken's.
+            rest_url (Optional[str]): The URL template of the REST Trades endpoint, defaults to Kraken's.
+            max_buffered_batches (int): The max number of batches of live trades (one per
+                socket message) we buffer during the backfill, which bounds the memory we use.
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.cache_dir = cache_dir
+        self.rest_url = rest_url
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(rate_per_sec=1.0)
+        self.session = make_session()
+
+        if from_ms is not None:
+            self.from_ms = from_ms
+        elif last_n_days is not None:
+            self.from_ms, _ = KrakenRestAPI._init_from_to_ms(last_n_days)
+        else:
+            raise ValueError('Either last_n_days or from_ms must be provided')
+
+        # the part of the history that can go to the cache: up to a minute ago, so it is
+        # complete on the exchange by the time we fetch it, even if our clock is a bit off.
+        # The trades after it are paged until we catch up, without caching them
+        self.history_to_ms = int(time.time() * 1000) - _HISTORY_MARGIN_MS
+
+        # 1. subscribe to the live trades before we start the backfill, and buffer them
+        self._ws = KrakenWebsocketAPI(
+            product_ids=product_ids, url=ws_url, rest_url=rest_url, rate_limiter=self.rate_limiter
+        )
+        self._live_trades: queue.Queue = queue.Queue(maxsize=max_buffered_batches)
+        self._first_live_ms: Dict[str, int] = {}
+        self._live_reader = threading.Thread(target=self._read_live_trades, daemon=True)
+        self._live_reader.start()
+
+        # 2. the backfill, one product at a time
+        self._products_to_backfill = list(product_ids)
+        self._rest: Optional[KrakenRestAPI] = None
+        self._catching_up = False
+
+        # the cut-off of each product, and the REST trades in that millisecond
+        self._rest_trades = SeenTrades()
+
+        logger.info(
+            f'Backfilling {product_ids} since {ts_to_date(self.from_ms)}, then switching to live trades'
+        )
+
+    def _read_live_trades(self) -> None:
+        """
+        Reads the live trades and puts them in the buffer. Runs in a background thread,
+        which waits while the buffer is full.
+        """
+        try:
+            while True:
+                trades = self._ws.get_trades()
+                if len(trades) == 0:
+                    continue
+
+                for product_id, timestamp_ms in zip(trades.product_id.tolist(), trades.timestamp_ms.tolist()):
+                    self._first_live_ms.setdefault(product_id, timestamp_ms)
+                self._live_trades.put(trades)
+        except Exception as e:
+            # get_trades re-raises it
+            self._live_trades.put(e)
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next page of the backfill, or the next live trades once every
+        product is backfilled.
+        """
+        if self._products_to_backfill:
+            return self._get_backfill_trades()
+
+        try:
+            trades = self._live_trades.get(timeout=_LIVE_POLL_TIMEOUT_SEC)
+        except queue.Empty:
+            return TradeBatch.empty()
+
+        if isinstance(trades, Exception):
+            raise trades
+
+        return self._drop_backfilled(trades)
+
+    def _get_backfill_trades(self) -> TradeBatch:
+        """
+        Returns the next page of the backfill of the current product.
+        """
+        product_id = self._products_to_backfill[0]
+
+        if self._rest is None:
+            # the history, which the cache can keep
+            self._rest = self._make_rest_api(
+                product_id, self.from_ms, self.history_to_ms, cache_dir=self.cache_dir
+            )
+
+        trades = self._rest.get_trades()
+
+        # we reached the live trades once the REST API returns trades after the first one
+        first_live_ms = self._first_live_ms.get(product_id)
+        reached_live = (
+            self._catching_up
+            and first_live_ms is not None
+            and len(trades) > 0
+            and trades.timestamp_ms[-1] > first_live_ms
+        )
+        if reached_live:
+            trades = trades[trades.timestamp_ms <= first_live_ms]
+
+        self._rest_trades.add(trades)
+
+        if not reached_live and not self._rest.is_done():
+            return trades
+
+        if not self._catching_up:
+            # the trades since the backfill started. We page until we reach the live
+            # trades, so `to_ms` only has to be later than any trade we can get
+            self._rest = self._make_rest_api(
+                product_id, self.history_to_ms + 1, int(time.time() * 1000) + MS_PER_DAY
+            )
+            self._catching_up = True
+            return trades
+
+        caught_up_ms = self._rest_trades.last_ms.get(product_id, self.history_to_ms)
+        logger.info(f'Backfill of {product_id} caught up at {ts_to_date(caught_up_ms)}')
+        self._products_to_backfill.pop(0)
+        self._rest = None
+        self._catching_up = False
+
+        return trades
+
+    def _make_rest_api(
+        self, product_id: str, from_ms: int, to_ms: int, cache_dir: Optional[str] = None
+    ) -> KrakenRestAPI:
+        return KrakenRestAPI(
+            product_id=product_id,
+            from_ms=from_ms,
+            to_ms=to_ms,
+            cache_dir=cache_dir,
+            rate_limiter=self.rate_limiter,
+            session=self.session,
+            url=self.rest_url,
+        )
+
+    def _drop_backfilled(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Drops the live trades the backfill already returned.
+        """
+        n_trades = len(trades)
+        trades = self._rest_trades.drop_seen(trades)
+
+        if len(trades) < n_trades:
+            logger.debug(f'Dropped {n_trades - len(trades)} live trades already backfilled')
+        return trades
+
+    def is_done(self) -> bool:
+        # after the backfill we stream live trades forever
+        return False
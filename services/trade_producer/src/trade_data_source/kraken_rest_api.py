@@ -1,19 +1,29 @@
-import json
-from pathlib import Path
-from time import sleep
-from typing import Dict, List, Optional, Tuple
-from src.trade_data_source.trade import Trade
+from typing import List, Optional, Tuple
+from src.trade_data_source.trade_batch import TradeBatch
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.rate_limiter import AdaptiveRateLimiter, RateLimiter
+from src.trade_data_source.trade_store import TradeStore, end_of_day_ms
+from src.trade_data_source.backfill_checkpoint import BackfillCheckpointStore
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from loguru import logger
 class KrakenRestAPI(TradeSource):
-    URL = 'https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_sec}'
+    URL = 'https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_ns}'
 
     def __init__(
         self,
         product_id: str,
-        last_n_days: int,
+        last_n_days: Optional[int] = None,
         cache_dir: Optional[str] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        session: Optional[requests.Session] = None,
+        url: Optional[str] = None,
+        checkpoint_dir: Optional[str] = None,
+        resume_from: Optional[dict] = None,
+        max_throttled_attempts: int = 30,
     ) -> None:
         """
         Basic initialization of the Kraken Rest API.
@@ -22,32 +32,124 @@ class KrakenRestAPI(TradeSource):
             product_id (str): One product ID for which we want to get the trades.
             last_n_days (int): The number of days from which we want to get historical data.
             cache_dir (Optional[str]): The directory where we will store the historical data to
+            from_ms (Optional[int]): Start of the time range, used instead of `last_n_days`.
+            to_ms (Optional[int]): End of the time range (inclusive), used instead of `last_n_days`.
+            rate_limiter (Optional[RateLimiter]): Caps the rate of requests to the API. Pass the
+                same instance to several KrakenRestAPI objects to give them a shared budget.
+                Defaults to an AdaptiveRateLimiter starting at 1 request per second.
+            session (Optional[requests.Session]): The HTTP session (and connection pool) we
+                send the requests with. Defaults to a new session with keep-alive.
+            url (Optional[str]): The URL template of the Trades endpoint, with {product_id}
+                and {since_ns} placeholders. Defaults to Kraken's.
+            checkpoint_dir (Optional[str]): The directory where we keep the checkpoints of
+                the backfill. If an earlier backfill of this product did not finish we
+                resume it, with the job boundaries of its first run (see BackfillCheckpointStore).
+            resume_from (Optional[dict]): The position to resume from, as returned by
+                `cursor()`. Used by ShardedKrakenRestAPI to resume its shards.
+            max_throttled_attempts (int): The max number of times in a row we send the
+                same request while Kraken tells us to slow down. Past that we raise,
+                instead of hanging the backfill on a throttled key.
 
         Returns:
             None
         """
         self.product_id = product_id
-        self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
+        self.url = url or self.URL
+
+        self.checkpoints = (
+            BackfillCheckpointStore(checkpoint_dir) if checkpoint_dir is not None else None
+        )
+        checkpoint = (
+            self.checkpoints.load(product_id, from_ms=from_ms, to_ms=to_ms)
+            if self.checkpoints is not None
+            else None
+        )
+
+        if checkpoint is not None:
+            # the job boundaries are the ones of the first run, not recomputed from today
+            self.from_ms, self.to_ms = checkpoint['from_ms'], checkpoint['to_ms']
+            if len(checkpoint['shards']) != 1:
+                raise ValueError(
+                    f"The checkpoint of {product_id} has {len(checkpoint['shards'])} shards, "
+                    f"resume it with backfill_n_shards={len(checkpoint['shards'])}"
+                )
+            resume_from = checkpoint['shards'][0]
+            logger.info(f'Resuming the backfill of {product_id} from its checkpoint')
+        elif from_ms is not None and to_ms is not None:
+            self.from_ms, self.to_ms = from_ms, to_ms
+        elif last_n_days is not None:
+            self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
+        else:
+            raise ValueError('Either last_n_days or both from_ms and to_ms must be provided')
+
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(rate_per_sec=1.0)
+        self.max_throttled_attempts = max_throttled_attempts
+        self.session = session or make_session()
 
         logger.debug(
             f'Initializing KrakenRestAPI: from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
         )
 
-        # the timestamp from which we want to fetch historical data
-        # this will be updated after each batch of trades is fetched from the API
-        # self.since_ms = from_ms
-        self.last_trade_ms = self.from_ms
+        # cache_dir is the directory where we will store the historical data to speed up
+        # service restarts and later backfills over overlapping time ranges
+        self.store = TradeStore(cache_dir) if cache_dir is not None else None
+
+        # The plan: the range [from_ms, to_ms] split into segments (from_ms, to_ms, cached)
+        # in time order. Cached segments are read from the store, the others are
+        # downloaded from the API (and saved to the store, if we have one).
+        # When we resume, the plan is what was left of it at the checkpoint.
+        if resume_from is not None:
+            self._segments: List[Tuple[int, int, bool]] = [
+                tuple(segment) for segment in resume_from['segments']
+            ]
+        else:
+            self._segments = self._plan_segments()
+        logger.debug(
+            f'{sum(1 for *_, cached in self._segments if not cached)} ranges to download, '
+            f'{sum(1 for *_, cached in self._segments if cached)} ranges in the cache'
+        )
+
+        # the pagination cursor of the segment we are downloading, in nanoseconds.
+        # After each page we move it to the `last` value Kraken returns, which points
+        # right after the last trade of the page. This way no trade is fetched twice
+        # or skipped, even when several trades share the same millisecond.
+        self.since_ns: Optional[int] = resume_from['since_ns'] if resume_from is not None else None
+
+        # trades we downloaded but did not save to the store yet. We save them one day
+        # at a time, and only up to the last millisecond we know is complete.
+        self._unsaved_from_ms: Optional[int] = None
+        self._unsaved_trades: List[TradeBatch] = []
+        if self.since_ns is not None:
+            # we resume in the middle of a segment. The trades before the cursor are not
+            # fetched again, so the first range we can save starts on the next millisecond
+            self._unsaved_from_ms = self.since_ns // 1_000_000 + 1
+
+    def _plan_segments(self) -> List[Tuple[int, int, bool]]:
+        """
+        Splits [self.from_ms, self.to_ms] into the segments we read from the store
+        and the ones we need to download from the API.
+
+        Returns:
+            List[Tuple[int, int, bool]]: (from_ms, to_ms, cached) for each segment,
+                in time order. Both ends are inclusive.
+        """
+        if self.store is None:
+            return [(self.from_ms, self.to_ms, False)]
 
-        # are we done fetching historical data?
-        # Yes, if the last batch of trades has a data['result'][product_id]['last'] >= self.to_ms
-        # self._is_done = False
+        missing = self.store.missing_ranges(self.product_id, self.from_ms, self.to_ms)
 
-        # cache_dir is the directory where we will store the historical data to speed up
-        # service restarts
-        self.use_cache = False
-        if cache_dir is not None:
-            self.cache = CachedTradeData(cache_dir)
-            self.use_cache = True
+        segments = []
+        start = self.from_ms
+        for missing_from, missing_to in missing:
+            if missing_from > start:
+                segments.append((start, missing_from - 1, True))
+            segments.append((missing_from, missing_to, False))
+            start = missing_to + 1
+
+        if start <= self.to_ms:
+            segments.append((start, self.to_ms, True))
+
+        return segments
 
     @staticmethod
     def _init_from_to_ms(last_n_days: int) -> Tuple[int, int]:
@@ -76,180 +178,222 @@ class KrakenRestAPI(TradeSource):
 
         return from_ms, to_ms
 
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         """
-        Fetches a batch of trades from the Kraken Rest API and returns them as a list
-        of dictionaries.
+        Fetches a batch of trades from the cache or from the Kraken Rest API and
+        returns them in timestamp order.
 
         Args:
             None
 
         Returns:
-            List[Trade]: A list of dictionaries, where each dictionary contains the trade data.
+            TradeBatch: The trades, as columns.
         """
-        # Replace the placeholders in the URL with the actual values for
-        # - product_id
-        # - since_ns
-        since_ns = self.last_trade_ms * 1_000_000
-        payload = {}
-        headers = {'Accept': 'application/json'}
-        url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
-        logger.debug(f'{url=}')
+        if not self._segments:
+            return TradeBatch.empty()
+
+        segment_from_ms, segment_to_ms, cached = self._segments[0]
 
-        if self.use_cache and self.cache.has(url):
-            # read the data from the cache
-            trades = self.cache.read(url)
+        if cached:
+            # read at most one day at a time from the store
+            chunk_to_ms = min(segment_to_ms, end_of_day_ms(segment_from_ms))
+            trades = self.store.read(self.product_id, segment_from_ms, chunk_to_ms)
             logger.debug(
-                f'Loaded {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the cache'
+                f'Loaded {len(trades)} trades for {self.product_id}, since={ts_to_date(segment_from_ms)} from the cache'
             )
-        else:
-            # make the request to the Kraken REST API
-            response = requests.request('GET', url, headers=headers, data=payload)
 
-            # parse string into dictionary
-            data = json.loads(response.text)
+            if chunk_to_ms < segment_to_ms:
+                self._segments[0] = (chunk_to_ms + 1, segment_to_ms, True)
+            else:
+                self._segments.pop(0)
 
-            # TODO: Error handling
-            # It can happen that we get an error response from KrakenRESTAP like the following:
-            # data = {'error': ['EGeneral:Too many requests']}
-            # To solve this have several options
-            #
-            # Option 1. Check if the `error` key is present in the `data` and has
-            # a non-empty list value. If so, we could raise an exception, or even better, implment
-            # a retry mechanism, using a library like `retry` https://github.com/invl/retry
-            #
-            # Option 2. Simply slow down the rate at which we are making requests to the Kraken API,
-            # and cross your fingers.
-            #
-            # Option 3. Implement both Option 1 and Option 2, so you don't need to cross your fingers.
-            #
-            # Here is an example of how you could implement Option 2
-            if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info('Too many requests. Sleeping for 30 seconds')
-                sleep(30)
-
-            # Python trick
-            # Instead of initializing an empty list and appending to it, like this
-            #
-            # trades = []
-            # for trade in data['result'][self.product_ids[0]]:
-            #     trades.append({
-            #         'price': float(trade[0]),
-            #         'volume': float(trade[1]),
-            #         'time': int(trade[2]),
-            #     })
-            #
-            # You can use a list comprehension to do the same thing
-            trades = [
-                Trade(
-                    price=float(trade[0]),
-                    quantity=float(trade[1]),
-                    timestamp_ms=int(trade[2] * 1000),
-                    product_id=self.product_id,
-                )
-                for trade in data['result'][self.product_id]
-            ]
+            return trades
 
-            logger.debug(
-                f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
-            )
+        if self.since_ns is None:
+            # first page of this segment
+            self.since_ns = segment_from_ms * 1_000_000
+            self._unsaved_from_ms = segment_from_ms
 
-            if self.use_cache:
-                # write the data to the cache
-                self.cache.write(url, trades)
-                logger.debug(
-                    f'Wrote to cache for {self.product_id}, since={ns_to_date(since_ns)}'
-                )
+        since_ns = self.since_ns
+        url = self.url.format(product_id=self.product_id, since_ns=since_ns)
+        logger.debug(f'{url=}')
+
+        trades, last_ns = self._fetch_page(url)
+        logger.debug(
+            f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
+        )
 
-            # slow down the rate at which we are making requests to the Kraken API
-            sleep(1)
+        # filter out trades that are after the end of the segment
+        trades = trades[trades.timestamp_ms <= segment_to_ms]
 
-        if trades[-1].timestamp_ms == self.last_trade_ms:
-            # if the last trade timestamp in the batch is the same as self.last_trade_ms,
-            # then we need to increment it by 1 to avoid repeating the exact same API request,
-            # which would result in an infinite loop
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
+        if len(trades) == 0 or last_ns <= since_ns or last_ns // 1_000_000 > segment_to_ms:
+            # we either went past the end of the segment, or Kraken has no trades
+            # newer than the cursor. Either way this segment is done
+            self._segments.pop(0)
+            self.since_ns = None
+            segment_done = True
         else:
-            # otherwise, update self.last_trade_ms to the timestamp of the last trade
-            # in the batch
-            self.last_trade_ms = trades[-1].timestamp_ms
-        
-        # filter out trades that are after the end timestamp
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
+            # move the cursor right after the last trade of this page
+            self.since_ns = last_ns
+            segment_done = False
 
-        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
-        #     # self.cache._get_file_path(url)
-        #     breakpoint()
+        if self.store is not None:
+            self._save_to_store(trades, last_ns, segment_to_ms, segment_done)
 
         return trades
 
-    def is_done(self) -> bool:
-        # return self._is_done
-        return self.last_trade_ms >= self.to_ms
+    def _save_to_store(
+        self,
+        trades: TradeBatch,
+        last_ns: int,
+        segment_to_ms: int,
+        segment_done: bool,
+    ) -> None:
+        """
+        Saves the downloaded trades to the store, one day at a time.
 
+        The store expects all the trades of every range it saves, but the next page
+        may still contain trades from the same millisecond as the last trade of this
+        page. So we only save up to the millisecond before it, unless we went past
+        the end of the segment.
+        """
+        self._unsaved_trades.append(trades)
 
-class CachedTradeData:
-    """
-    A class to handle the caching of trade data fetched from the Kraken REST API.
-    """
+        last_ms = last_ns // 1_000_000
+        complete_to_ms = segment_to_ms if last_ms > segment_to_ms else last_ms - 1
 
-    def __init__(self, cache_dir: str) -> None:
-        self.cache_dir = Path(cache_dir)
+        if not segment_done and end_of_day_ms(self._unsaved_from_ms) > complete_to_ms:
+            # wait until we have the whole day
+            return
 
-        if not self.cache_dir.exists():
-            # create the cache directory if it does not exist
-            self.cache_dir.mkdir(parents=True)
+        unsaved_trades = TradeBatch.concat(self._unsaved_trades)
 
-    def read(self, url: str) -> List[Trade]:
-        """
-        Reads from the cache the trade data for the given url
-        """
-        file_path = self._get_file_path(url)
+        while self._unsaved_from_ms <= complete_to_ms:
+            day_to_ms = end_of_day_ms(self._unsaved_from_ms)
+            if day_to_ms > complete_to_ms:
+                if not segment_done:
+                    # wait until we have the whole day
+                    break
+                day_to_ms = complete_to_ms
 
-        if file_path.exists():
-            # read the data from the parquet file
-            import pandas as pd
+            day_trades = unsaved_trades[unsaved_trades.timestamp_ms <= day_to_ms]
+            self.store.write(self.product_id, self._unsaved_from_ms, day_to_ms, day_trades)
+            logger.debug(
+                f'Wrote {len(day_trades)} trades to cache for {self.product_id}, since={ts_to_date(self._unsaved_from_ms)}'
+            )
 
-            data = pd.read_parquet(file_path)
-            # transform the data to a list of Trade objects
-            return [Trade(**trade) for trade in data.to_dict(orient='records')]
+            unsaved_trades = unsaved_trades[len(day_trades):]
+            self._unsaved_from_ms = day_to_ms + 1
 
-        return []
+        if segment_done:
+            self._unsaved_trades = []
+            self._unsaved_from_ms = None
+        else:
+            self._unsaved_trades = [unsaved_trades]
 
-    def write(self, url: str, trades: List[Trade]) -> None:
+    def _fetch_page(self, url: str) -> Tuple[TradeBatch, int]:
         """
-        Saves the given trades to a parquet file in the cache directory.
+        Sends one request to the Kraken REST API and parses the response.
+
+        We retry the same request if Kraken tells us to slow down, up to
+        `self.max_throttled_attempts` attempts. The rate limiter is told about every
+        success and every rate-limit error, so it can adapt the pace.
+
+        Args:
+            url (str): The URL of the page we want to fetch.
+
+        Returns:
+            Tuple[TradeBatch, int]: The trades of the page, and the `last` cursor (in
+                nanoseconds) we have to use as `since` for the next page.
         """
-        if not trades:
-            return
+        headers = {'Accept': 'application/json'}
 
-        # transform the trades to a pandas DataFrame
-        import pandas as pd
+        for attempt in range(1, self.max_throttled_attempts + 1):
+            # make the request to the Kraken REST API, once the rate limiter allows it
+            self.rate_limiter.acquire()
+            response = self.session.get(url, headers=headers, timeout=30)
 
-        data = pd.DataFrame([trade.model_dump() for trade in trades])
+            if response.status_code == 429:
+                self.rate_limiter.on_throttle()
+                logger.info(
+                    f'HTTP 429. Slowing down to {self.rate_limiter.rate_per_sec:.2f} req/s '
+                    f'(attempt {attempt}/{self.max_throttled_attempts})'
+                )
+                continue
 
-        # write the DataFrame to a parquet file
-        file_path = self._get_file_path(url)
-        data.to_parquet(file_path)
+            response.raise_for_status()
 
-    def has(self, url: str) -> bool:
-        """
-        Returns True if the cache has the trade data for the given url, False otherwise.
-        """
-        file_path = self._get_file_path(url)
-        return file_path.exists()
+            # parse string into dictionary
+            data = response.json()
 
-    def _get_file_path(self, url: str) -> str:
+            # It can happen that we get an error response from the Kraken REST API like
+            # data = {'error': ['EGeneral:Too many requests']}
+            # In that case we slow down and retry the same page, any other error is fatal
+            if data.get('error'):
+                if any('Too many requests' in error for error in data['error']):
+                    self.rate_limiter.on_throttle()
+                    logger.info(
+                        f'Too many requests. Slowing down to {self.rate_limiter.rate_per_sec:.2f} req/s '
+                        f'(attempt {attempt}/{self.max_throttled_attempts})'
+                    )
+                    continue
+
+                raise RuntimeError(f'Kraken REST API returned an error: {data["error"]}')
+
+            self.rate_limiter.on_success()
+            break
+        else:
+            raise RuntimeError(
+                f'Kraken REST API kept throttling us after {self.max_throttled_attempts} attempts: {url}'
+            )
+
+        # the result has one key with the trades of the pair (Kraken may use its own
+        # name for the pair, e.g. XXBTZUSD) and a 'last' key with the next cursor
+        result = data['result']
+        last_ns = int(result.pop('last'))
+        (raw_trades,) = result.values()
+
+        # each raw trade is [price, volume, time, side, type, misc, trade_id], with price
+        # and volume as strings and time in (fractional) seconds. We build each column
+        # for the whole page at once, and NumPy parses the strings in bulk.
+        trades = TradeBatch(
+            product_id=np.full(len(raw_trades), self.product_id, dtype=object),
+            price=np.array([trade[0] for trade in raw_trades], dtype=np.float64),
+            quantity=np.array([trade[1] for trade in raw_trades], dtype=np.float64),
+            timestamp_ms=(
+                np.array([trade[2] for trade in raw_trades], dtype=np.float64) * 1000
+            ).astype(np.int64),
+        )
+
+        return trades, last_ns
+
+    def is_done(self) -> bool:
+        return not self._segments
+
+    def cursor(self) -> dict:
         """
-        Returns the file path where the trade data for the given url is (or will be) stored.
+        Returns the position right after the trades returned so far: the segments we
+        still have to read, and the pagination cursor inside the first of them.
         """
-        # use the given url to generate a unique file name in a deterministic way
-        import hashlib
+        return {
+            'segments': [list(segment) for segment in self._segments],
+            'since_ns': self.since_ns,
+        }
+
+    def checkpoint(self) -> Optional[dict]:
+        if self.checkpoints is None:
+            return None
+
+        return {
+            'product_id': self.product_id,
+            'from_ms': self.from_ms,
+            'to_ms': self.to_ms,
+            'shards': [self.cursor()],
+        }
 
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f'{url_hash}.parquet'
-        # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+    def commit_checkpoint(self, checkpoint: dict) -> None:
+        if self.checkpoints is not None:
+            self.checkpoints.save(self.product_id, checkpoint)
 
 
 def ts_to_date(ts: int) -> str:
@@ -283,4 +427,23 @@ def ns_to_date(ns: int) -> str:
 
     return datetime.fromtimestamp(ns / 1_000_000_000, tz=timezone.utc).strftime(
         '%Y-%m-%d %H:%M:%S'
-    )
\ No newline at end of file
+    )
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """
+    Creates an HTTP session with a pool of keep-alive connections, so we don't pay
+    a new TCP + TLS handshake on every request.
+
+    Args:
+        pool_size (int): The max number of connections kept open per host. Set it to
+            the number of threads that share the session.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -1,6 +1,10 @@
-from typing import List
+from typing import Dict, List, Optional
 from time import sleep
-from websocket import create_connection
+import copy
+import random
+import numpy as np
+import time
+from websocket import create_connection, WebSocketException, WebSocketTimeoutException
 from loguru import logger
 import json
 from pydantic import BaseModel
@@ -11,8 +15,14 @@ from pydantic import BaseModel
 #     quantity: float
 #     timestamp_ms: int
 
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch, parse_iso_timestamps_ms
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.rate_limiter import RateLimiter
+from src.trade_data_source.seen_trades import SeenTrades
+
+# how long we wait for the live trades in between two REST pages of a gap fill
+_GAP_FILL_POLL_SEC = 0.05
+
 class KrakenWebsocketAPI(TradeSource):
     URL = "wss://ws.kraken.com/v2"
     
@@ -20,83 +30,308 @@ class KrakenWebsocketAPI(TradeSource):
     Class for reading realtime trades from Kraken Websocket API
     '''
     
-    def __init__(self, product_id: str):
+    def __init__(
+        self,
+        product_ids: List[str],
+        url: Optional[str] = None,
+        rest_url: Optional[str] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        gap_fill: bool = True,
+        max_reconnect_attempts: Optional[int] = None,
+        initial_backoff_sec: float = 1.0,
+        max_backoff_sec: float = 60.0,
+    ):
         '''
         Initialize the KrakenWebsocketAPI instance
 
         Args:
-            product_id: Product id to filter the trades
+            product_ids: Product ids to subscribe to. All of them share one connection.
+            url: The Websocket API endpoint, defaults to Kraken's. Point it at a local
+                mock exchange to run without network access.
+            rest_url: The URL template of the REST Trades endpoint we fill the gaps
+                from, defaults to Kraken's.
+            rate_limiter: Caps the rate of the REST requests of the gap fills.
+            gap_fill: After a reconnect, fetch the trades we missed from the REST API.
+            max_reconnect_attempts: Give up after this many failed reconnects in a row.
+                None retries forever.
+            initial_backoff_sec: Wait before the 2nd reconnect attempt, doubled after
+                each failed attempt.
+            max_backoff_sec: Max wait between two reconnect attempts.
         '''
         
-        self.product_id = product_id
+        self.product_ids = product_ids
+        self.url = url or self.URL
+        self.rest_url = rest_url
+        self.rate_limiter = rate_limiter
+        self.gap_fill = gap_fill
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.initial_backoff_sec = initial_backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+
+        # metrics of the connection
+        self.n_reconnects = 0
+        self.n_recovered_trades = 0
+
+        # trades that arrive while we are still waiting for the subscription acks
+        # of other symbols. They are returned on the first call to get_trades()
+        self._pending_trades: List[TradeBatch] = []
+
+        # where the trades we returned stopped, to know what we missed after a disconnect
+        self._returned_trades = SeenTrades()
+        # when each product was first subscribed, where its gap fill starts while we
+        # have not returned any trade of it
+        self._subscribed_ms: Dict[str, int] = {}
+        # the trades the last gap fill returned, the live stream repeats some of them
+        self._recovered_trades: Optional[SeenTrades] = None
+
+        self._connect()
+
+    def _connect(self):
+        '''
+        Opens the connection to Kraken Websocket API and subscribes to the trades.
+        '''
+        self._pending_trades = []
 
         ## establish connection with Kraken Websocket API
-        self._ws = create_connection(self.URL)
+        self._ws = create_connection(self.url)
         logger.info("Connected to Kraken Websocket API")
 
-        self._subscribe(product_id=product_id)
+        self._subscribe(product_ids=self.product_ids)
+
+    def _reconnect(self) -> TradeBatch:
+        '''
+        Reconnects with exponential backoff (and jitter) and subscribes again. Then
+        fetches the trades we missed while we were disconnected from the REST API.
+
+        Returns:
+            The trades of the outage, without the ones we already returned
+        '''
+        disconnected_at = time.monotonic()
+        backoff_sec = self.initial_backoff_sec
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                self._ws.close()
+                self._connect()
+                recovered = self._fill_gap() if self.gap_fill else TradeBatch.empty()
+                break
+            # RuntimeError is an error answer from Kraken, e.g. EService:Unavailable to
+            # the subscription or to a REST request of the gap fill, while the outage lasts.
+            # The gap fill starts over on the next attempt, from the last trade we returned
+            except (WebSocketException, OSError, RuntimeError) as e:
+                if self.max_reconnect_attempts is not None and attempt >= self.max_reconnect_attempts:
+                    raise
+
+                # randomize the waits, so many clients do not reconnect all at once
+                wait_sec = backoff_sec * random.uniform(0.5, 1.0)
+                logger.warning(f"Reconnect attempt {attempt} failed: {e}. Retrying in {wait_sec:.1f}s")
+                sleep(wait_sec)
+                backoff_sec = min(backoff_sec * 2, self.max_backoff_sec)
+
+        self.n_reconnects += 1
+        self.n_recovered_trades += len(recovered)
+        logger.info(
+            f"Reconnected to Kraken Websocket API after {time.monotonic() - disconnected_at:.1f}s "
+            f"({attempt} attempts), recovered {len(recovered)} trades of the outage. "
+            f"{self.n_reconnects} reconnects and {self.n_recovered_trades} recovered trades so far"
+        )
+        return recovered
+
+    def _fill_gap(self) -> TradeBatch:
+        '''
+        Fetches, from the REST API, the trades each product had since the last trade we
+        returned, up to its first trade on the new connection. Like HybridTradeSource,
+        we stop once the REST API returns trades after that one, or an empty page if the
+        product did not trade since we subscribed again. A product we did not return any
+        trade of yet is filled from the time of its first subscription.
+
+        Raises the errors of the REST API, so `_reconnect` retries with its backoff.
+
+        Returns:
+            The trades we missed, without the ones we already returned
+        '''
+        from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+
+        recovered = []
+        self._recovered_trades = SeenTrades()
+
+        # a copy, as dropping trades uses it up and this attempt may fail halfway
+        returned_trades = copy.deepcopy(self._returned_trades)
+
+        for product_id in self.product_ids:
+            last_ms = returned_trades.last_ms.get(product_id, self._subscribed_ms.get(product_id))
+            if last_ms is None:
+                continue
+
+            rest = KrakenRestAPI(
+                product_id=product_id,
+                from_ms=last_ms,
+                to_ms=int(time.time() * 1000) + 24 * 60 * 60 * 1000,
+                rate_limiter=self.rate_limiter,
+                url=self.rest_url,
+            )
+
+            while True:
+                # the first trade of the product on the new connection, if it came already
+                self._buffer_live_trades()
+                first_live_ms = min(
+                    (
+                        int(trades.timestamp_ms[trades.product_id == product_id].min())
+                        for trades in self._pending_trades
+                        if (trades.product_id == product_id).any()
+                    ),
+                    default=None,
+                )
+
+                trades = rest.get_trades()
+                reached_live = (
+                    first_live_ms is not None
+                    and len(trades) > 0
+                    and trades.timestamp_ms[-1] > first_live_ms
+                )
+                if reached_live:
+                    trades = trades[trades.timestamp_ms <= first_live_ms]
+
+                trades = returned_trades.drop_seen(trades)
+                self._recovered_trades.add(trades)
+                recovered.append(trades)
+
+                if reached_live or rest.is_done():
+                    break
+
+        # the products one after the other, merged back in time order
+        recovered = TradeBatch.concat(recovered) if recovered else TradeBatch.empty()
+        recovered = recovered[np.argsort(recovered.timestamp_ms, kind='stable')]
+        self._returned_trades.add(recovered)
+        return recovered
+
+    def _buffer_live_trades(self):
+        '''
+        Reads the messages that arrive on the connection for up to _GAP_FILL_POLL_SEC,
+        and keeps their trades for get_trades().
+        '''
+        deadline = time.monotonic() + _GAP_FILL_POLL_SEC
+        try:
+            while time.monotonic() < deadline:
+                self._ws.settimeout(max(deadline - time.monotonic(), 0.001))
+                message = json.loads(self._ws.recv())
+                if message.get('channel') == 'trade':
+                    self._pending_trades.append(self._parse_trades(message))
+        except WebSocketTimeoutException:
+            pass
+        finally:
+            self._ws.settimeout(None)
     
-    def _subscribe(self, product_id: str):
+    def _subscribe(self, product_ids: List[str]):
         '''
-        Establish connection with Kraken Websocket API and subscribe to the trades for a given product_id
+        Subscribe to the trades for the given product_ids on the open connection,
+        and wait until Kraken has acknowledged the subscription of every symbol.
 
         Args:
-            product_id: Product id to filter the trades
+            product_ids: Product ids to filter the trades
         '''
 
-        logger.info(f"Subscribing to trades for {product_id}")
+        logger.info(f"Subscribing to trades for {product_ids}")
         msg = { 
             'method': 'subscribe',
             'params': {
                 'channel': 'trade',
-                'symbol': [product_id],
+                'symbol': product_ids,
                 'snapshot': False                
             }
         }
 
         self._ws.send(json.dumps(msg))
 
-        logger.info("Subscription worked")
+        ## Kraken sends one ack per symbol, e.g.
+        ## {"method": "subscribe", "result": {"channel": "trade", "symbol": "BTC/USD", ...}, "success": true, ...}
+        ## interleaved with status and heartbeat messages, and possibly with trades of the
+        ## symbols that were already acknowledged.
+        pending_acks = set(product_ids)
+        while pending_acks:
+            message = json.loads(self._ws.recv())
 
+            if message.get('method') == 'subscribe':
+                if not message.get('success'):
+                    raise RuntimeError(f"Subscription failed: {message.get('error')}")
 
-        ## the first 2 messages we get from kraken websocket API are not useful
-        ## as they contain no trade data just confirmation that subscription worked
+                symbol = message['result']['symbol']
+                pending_acks.discard(symbol)
+                self._subscribed_ms.setdefault(symbol, int(time.time() * 1000))
+                logger.info(f"Subscription worked for {symbol}")
 
-        for product_id in [product_id]:
-            _ = self._ws.recv()
-            _ = self._ws.recv()
+            elif message.get('channel') == 'trade':
+                self._pending_trades.append(self._parse_trades(message))
 
-    
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
+        '''
+        Returns the latest batch of trades from Kraken Websocket API. If the connection
+        dropped, the trades we missed in the meantime.
+        '''
+        if self._pending_trades:
+            trades = TradeBatch.concat(self._pending_trades)
+            self._pending_trades = []
+            return self._returned(trades)
+
+        try:
+            trades = self._recv_trades()
+        except (WebSocketException, OSError) as e:
+            logger.warning(f"Lost the connection to Kraken Websocket API: {e}. Reconnecting")
+            return self._reconnect()
+
+        return self._returned(trades)
+
+    def _returned(self, trades: TradeBatch) -> TradeBatch:
         '''
-        Returns the latest batch of trades from Kraken Websocket API
+        Drops the live trades the last gap fill already returned, and keeps track of
+        where the trades we return stopped.
         '''
-        message = self._ws.recv()
+        if len(trades) == 0 or not self.gap_fill:
+            return trades
 
-        if 'heartbeat' in message:
+        if self._recovered_trades is not None:
+            trades = self._recovered_trades.drop_seen(trades)
+
+        self._returned_trades.add(trades)
+        return trades
+
+    def _recv_trades(self) -> TradeBatch:
+        '''
+        Reads the next message from the connection, and returns its trades
+        '''
+        message = json.loads(self._ws.recv())
+
+        if message.get('channel') == 'heartbeat':
             # When there are no trades, we get a heartbeat
             logger.info("Heartbeat received")
-            return []  # Return an empty list instead of None
+            return TradeBatch.empty()  # Return an empty batch instead of None
 
-        # Parse the message JSON
-        message = json.loads(message)
-        
-        trades = []
-        for trade in message['data']:
-            # Extract relevant trade data and create Trade objects
-            ## so again in meesage['data'] we have multiple things like side,price,qty,timestamp etc
-    #        ## we only want the price,qty,timestamp(in ms) and product_id
-            trades.append(
-                Trade(
-                    product_id=trade['symbol'],
-                    price=trade['price'],
-                    quantity=trade['qty'],
-                    timestamp_ms=self.to_ms(trade['timestamp'])
-                     # timestamp=trade['timestamp'] ## this will error out becuase in the Pydantic setting above we've defined what datatypes should be in the timestamp
-                )
-            )
+        if message.get('channel') != 'trade':
+            # status updates and other control messages carry no trades
+            logger.debug(f"Skipping non-trade message: {message}")
+            return TradeBatch.empty()
 
-        return trades
+        return self._parse_trades(message)
+
+    def _parse_trades(self, message: dict) -> TradeBatch:
+        '''
+        Transforms a message from the `trade` channel into a TradeBatch.
+        Each trade keeps its own symbol as product_id, so messages are keyed (and
+        partitioned) per product even though all products share one connection.
+        '''
+        ## in message['data'] we have multiple things like side,price,qty,timestamp etc
+        ## we only want the price,qty,timestamp(in ms) and product_id, and we build
+        ## each of them as a column for the whole message at once
+        data = message['data']
+
+        return TradeBatch(
+            product_id=[trade['symbol'] for trade in data],
+            price=[trade['price'] for trade in data],
+            quantity=[trade['qty'] for trade in data],
+            timestamp_ms=parse_iso_timestamps_ms([trade['timestamp'] for trade in data]),
+        )
 
         ## below is an example of how to return a list of dummy trades
         # event = [{
@@ -115,33 +350,10 @@ class KrakenWebsocketAPI(TradeSource):
 
     def is_done(self)->bool:
         '''
-        Returns True if there are no more trades to read
-        '''
-        False
-
-    def to_ms(self, timestamp: str)->int:
+        Returns True if there are no more trades to read. A live stream never ends
         '''
-        Converts a timestamp to milliseconds
+        return False
 
-        Args:
-            timestamp: Timestamp to convert
-
-        Returns:
-            timestamp in milliseconds
-        '''
-        # parse a string like '2024-01-01T00:36:45.456789Z' to a datetime object
-        # assuming utc timezone
-        # then transform this datetime object into a unix timezone
-        from datetime import datetime, timezone
-
-        timestamp = datetime.fromisoformat(timestamp[:-1]).replace(tzinfo=timezone.utc)
-        return int(timestamp.timestamp() * 1000)
-
-    def is_done(self)->bool:
-        '''
-        Returns True if there are no more trades to read
-        '''
-        False
 
 # from datetime import datetime, timezone
 # from typing import List
@@ -0,0 +1,122 @@
+import threading
+from time import monotonic, sleep
+
+
+class RateLimiter:
+    """
+    A token bucket that caps the rate of requests we send to an API.
+
+    One instance can be shared by several threads (e.g. the shards of a backfill),
+    so that all of them together stay within the same global rate budget.
+    """
+
+    def __init__(self, rate_per_sec: float, burst: int = 1) -> None:
+        """
+        Args:
+            rate_per_sec (float): The number of requests per second we are allowed to send.
+            burst (int): The max number of requests we can send back to back after
+                being idle for a while.
+
+        Returns:
+            None
+        """
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._last_refill = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until we are allowed to send one more request.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                # time until the bucket has one full token again
+                wait_sec = (1 - self._tokens) / self.rate_per_sec
+
+            sleep(wait_sec)
+
+    def _refill(self) -> None:
+        """
+        Adds the tokens accumulated since the last refill, up to `self.burst`.
+        Must be called with `self._lock` held.
+        """
+        now = monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last_refill) * self.rate_per_sec
+        )
+        self._last_refill = now
+
+    def on_success(self) -> None:
+        """
+        Feedback hook, called after a request went through. A fixed-rate limiter ignores it.
+        """
+        pass
+
+    def on_throttle(self) -> None:
+        """
+        Feedback hook, called when the API told us to slow down. A fixed-rate limiter ignores it.
+        """
+        pass
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    A token bucket whose rate follows AIMD (additive increase, multiplicative decrease).
+
+    Every successful request raises the rate a little, until the API pushes back
+    with a rate-limit error. Then the rate is cut by `decrease_factor` and we start
+    probing upwards again. This way we settle close to the highest rate the API
+    accepts, without having to know it in advance.
+    """
+
+    def __init__(
+        self,
+        rate_per_sec: float,
+        min_rate_per_sec: float = 0.1,
+        max_rate_per_sec: float = 10.0,
+        increase_per_success: float = 0.05,
+        decrease_factor: float = 0.5,
+        burst: int = 1,
+    ) -> None:
+        """
+        Args:
+            rate_per_sec (float): The rate we start with.
+            min_rate_per_sec (float): The rate never goes below this value.
+            max_rate_per_sec (float): The rate never goes above this value.
+            increase_per_success (float): How much the rate grows after each successful request.
+            decrease_factor (float): The rate is multiplied by this value when we get throttled.
+            burst (int): The max number of requests we can send back to back.
+
+        Returns:
+            None
+        """
+        super().__init__(rate_per_sec=rate_per_sec, burst=burst)
+        self.min_rate_per_sec = min_rate_per_sec
+        self.max_rate_per_sec = max_rate_per_sec
+        self.increase_per_success = increase_per_success
+        self.decrease_factor = decrease_factor
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._refill()
+            self.rate_per_sec = min(
+                self.max_rate_per_sec, self.rate_per_sec + self.increase_per_success
+            )
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._refill()
+            self.rate_per_sec = max(
+                self.min_rate_per_sec, self.rate_per_sec * self.decrease_factor
+            )
+            # empty the bucket, so the next request waits a full period at the new rate
+            self._tokens = 0.0
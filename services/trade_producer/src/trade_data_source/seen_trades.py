@@ -0,0 +1,67 @@
+from collections import Counter
+from typing import Dict
+
+import numpy as np
+
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class SeenTrades:
+    """
+    Where a stream of trades stopped, per product: the timestamp of its last trade,
+    and the (price, quantity) of its trades in that millisecond.
+
+    We use it to stitch two streams of the same trades, e.g. the REST API and the
+    Websocket API, on the exchange timestamps. A trade of the other stream was already
+    seen if it is before the last millisecond, or in it and matches a trade we saw
+    there. Trades have no id on the Websocket API, so that is the best we can do.
+    """
+
+    def __init__(self) -> None:
+        self.last_ms: Dict[str, int] = {}
+        self.last_trades: Dict[str, Counter] = {}
+
+    def add(self, trades: TradeBatch) -> None:
+        """
+        Moves the position of every product in `trades` to its last trade. The trades
+        of each product must be in time order.
+        """
+        if len(trades) == 0:
+            return
+
+        for product_id in set(trades.product_id.tolist()):
+            timestamps_ms = trades.timestamp_ms[trades.product_id == product_id]
+            last_ms = int(timestamps_ms[-1])
+
+            in_last_ms = (trades.product_id == product_id) & (trades.timestamp_ms == last_ms)
+            pairs = Counter(zip(trades.price[in_last_ms].tolist(), trades.quantity[in_last_ms].tolist()))
+
+            if product_id not in self.last_ms or last_ms > self.last_ms[product_id]:
+                self.last_ms[product_id] = last_ms
+                self.last_trades[product_id] = pairs
+            elif last_ms == self.last_ms[product_id]:
+                self.last_trades[product_id] += pairs
+
+    def drop_seen(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Returns `trades` without the ones we already saw. Each trade we saw in the last
+        millisecond only drops one trade of `trades`.
+        """
+        keep = np.ones(len(trades), dtype=bool)
+
+        for product_id, last_ms in self.last_ms.items():
+            is_product = trades.product_id == product_id
+            keep &= ~(is_product & (trades.timestamp_ms < last_ms))
+
+            # trades in the last millisecond are only dropped if we saw them too
+            seen = self.last_trades[product_id]
+            for i in np.flatnonzero(is_product & (trades.timestamp_ms == last_ms)):
+                pair = (trades.price[i], trades.quantity[i])
+                if seen[pair] > 0:
+                    seen[pair] -= 1
+                    keep[i] = False
+
+        if keep.all():
+            return trades
+
+        return trades[keep]
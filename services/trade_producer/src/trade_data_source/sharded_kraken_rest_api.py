@@ -0,0 +1,243 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from src.trade_data_source.backfill_checkpoint import BackfillCheckpointStore
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI, make_session, ts_to_date
+from src.trade_data_source.rate_limiter import AdaptiveRateLimiter
+from src.trade_data_source.trade_batch import TradeBatch
+
+# marks the end of a shard in its queue of pages
+_END_OF_SHARD = object()
+
+
+class ShardedKrakenRestAPI(TradeSource):
+    """
+    Backfills historical trades by splitting `[from_ms, to_ms]` into time shards
+    and fetching them concurrently from the Kraken REST API.
+
+    All shards share one AdaptiveRateLimiter and one pooled HTTP session, so together
+    they stay within the same global request budget. Pages are returned shard by
+    shard, in shard order, so the trades we hand to the producer are still sorted
+    by timestamp.
+    """
+
+    def __init__(
+        self,
+        product_id: str,
+        last_n_days: Optional[int],
+        n_shards: int,
+        max_workers: Optional[int] = None,
+        rate_per_sec: float = 1.0,
+        max_rate_per_sec: float = 10.0,
+        max_buffered_pages: int = 100,
+        cache_dir: Optional[str] = None,
+        url: Optional[str] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        checkpoint_dir: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            product_id (str): One product ID for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            n_shards (int): The number of time shards we split the range into.
+            max_workers (Optional[int]): The number of shards fetched at the same time.
+                Defaults to `n_shards`.
+            rate_per_sec (float): The initial request rate shared by all the shards.
+            max_rate_per_sec (float): The rate limiter never speeds up beyond this rate.
+            max_buffered_pages (int): The max number of pages a shard fetches ahead of
+                the consumer, which bounds the memory we use.
+            cache_dir (Optional[str]): The directory where we will store the historical data to
+            url (Optional[str]): The URL template of the Trades endpoint, defaults to Kraken's.
+            from_ms (Optional[int]): Start of the time range, used instead of `last_n_days`.
+            to_ms (Optional[int]): End of the time range (inclusive), used instead of `last_n_days`.
+            checkpoint_dir (Optional[str]): The directory where we keep the checkpoints of
+                the backfill. If an earlier backfill of this product did not finish, every
+                shard resumes from its checkpoint, with the job boundaries and the no. of
+                shards of its first run.
+
+        Returns:
+            None
+        """
+        self.product_id = product_id
+
+        self.checkpoints = (
+            BackfillCheckpointStore(checkpoint_dir) if checkpoint_dir is not None else None
+        )
+        checkpoint = (
+            self.checkpoints.load(product_id, from_ms=from_ms, to_ms=to_ms)
+            if self.checkpoints is not None
+            else None
+        )
+
+        if checkpoint is not None:
+            # the job boundaries and shards are the ones of the first run
+            self.from_ms, self.to_ms = checkpoint['from_ms'], checkpoint['to_ms']
+            n_shards = len(checkpoint['shards'])
+            resume_from = checkpoint['shards']
+            logger.info(f'Resuming the backfill of {product_id} from its checkpoint')
+        else:
+            if from_ms is not None and to_ms is not None:
+                self.from_ms, self.to_ms = from_ms, to_ms
+            elif last_n_days is not None:
+                self.from_ms, self.to_ms = KrakenRestAPI._init_from_to_ms(last_n_days)
+            else:
+                raise ValueError('Either last_n_days or both from_ms and to_ms must be provided')
+            resume_from = None
+
+        max_workers = max_workers or n_shards
+        self.rate_limiter = AdaptiveRateLimiter(
+            rate_per_sec=rate_per_sec, max_rate_per_sec=max_rate_per_sec
+        )
+        self.session = make_session(pool_size=max_workers)
+
+        self._shards = [
+            KrakenRestAPI(
+                product_id=product_id,
+                from_ms=shard_from_ms,
+                to_ms=shard_to_ms,
+                cache_dir=cache_dir,
+                rate_limiter=self.rate_limiter,
+                session=self.session,
+                url=url,
+                resume_from=resume_from[shard_index] if resume_from is not None else None,
+            )
+            for shard_index, (shard_from_ms, shard_to_ms) in enumerate(
+                self._split_into_shards(self.from_ms, self.to_ms, n_shards)
+            )
+        ]
+        self._pages = [queue.Queue(maxsize=max_buffered_pages) for _ in self._shards]
+
+        # the position of every shard right after the last page we returned. Shards
+        # fetch ahead, so this is what we checkpoint, not the position of the shards
+        self._shard_cursors = [shard.cursor() for shard in self._shards]
+
+        # index of the shard whose pages we are currently returning
+        self._current_shard = 0
+
+        # set when we stop early, so the worker threads do not block forever
+        self._stop = threading.Event()
+
+        # shards are submitted in order, so the shard we are reading from is always
+        # running (or already finished) and the ones after it are fetched ahead
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        for shard_index in range(len(self._shards)):
+            self._executor.submit(self._fetch_shard, shard_index)
+
+        logger.debug(
+            f'Initializing ShardedKrakenRestAPI: {len(self._shards)} shards, '
+            f'from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
+        )
+
+    @staticmethod
+    def _split_into_shards(
+        from_ms: int, to_ms: int, n_shards: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Splits `[from_ms, to_ms]` into `n_shards` contiguous, non-overlapping ranges
+        of (almost) the same length. Both ends of every range are inclusive.
+
+        Args:
+            from_ms (int): Start of the range.
+            to_ms (int): End of the range.
+            n_shards (int): The number of shards.
+
+        Returns:
+            List[Tuple[int, int]]: The (from_ms, to_ms) of each shard, in time order.
+        """
+        n_shards = max(1, min(n_shards, to_ms - from_ms))
+        bounds = [
+            from_ms + (to_ms - from_ms) * i // n_shards for i in range(n_shards + 1)
+        ]
+
+        return [
+            (bounds[i], bounds[i + 1] - 1 if i < n_shards - 1 else to_ms)
+            for i in range(n_shards)
+        ]
+
+    def _fetch_shard(self, shard_index: int) -> None:
+        """
+        Pages through one shard and puts its pages in the shard's queue.
+        Runs in a worker thread.
+        """
+        shard = self._shards[shard_index]
+        pages = self._pages[shard_index]
+
+        try:
+            while not shard.is_done() and not self._stop.is_set():
+                trades = shard.get_trades()
+                self._put(pages, (trades, shard.cursor()))
+
+            self._put(pages, _END_OF_SHARD)
+
+        except Exception as e:
+            # the consumer re-raises it when it reaches this shard
+            self._put(pages, e)
+
+    def _put(self, pages: queue.Queue, item) -> None:
+        """
+        Puts an item in the queue, waiting while it is full unless we are stopping.
+        """
+        while not self._stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next page of trades, in timestamp order across shards.
+
+        Args:
+            None
+
+        Returns:
+            TradeBatch: The trades of the next page.
+        """
+        while self._current_shard < len(self._shards):
+            page = self._pages[self._current_shard].get()
+
+            if page is _END_OF_SHARD:
+                logger.debug(f'Shard {self._current_shard} of {self.product_id} is done')
+                self._current_shard += 1
+                continue
+
+            if isinstance(page, Exception):
+                self.close()
+                raise page
+
+            trades, self._shard_cursors[self._current_shard] = page
+            return trades
+
+        return TradeBatch.empty()
+
+    def is_done(self) -> bool:
+        return self._current_shard >= len(self._shards)
+
+    def checkpoint(self) -> Optional[dict]:
+        if self.checkpoints is None:
+            return None
+
+        return {
+            'product_id': self.product_id,
+            'from_ms': self.from_ms,
+            'to_ms': self.to_ms,
+            'shards': list(self._shard_cursors),
+        }
+
+    def commit_checkpoint(self, checkpoint: dict) -> None:
+        if self.checkpoints is not None:
+            self.checkpoints.save(self.product_id, checkpoint)
+
+    def close(self) -> None:
+        """
+        Stops the worker threads, e.g. when we stop consuming before we are done.
+        """
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,283 @@
+import json
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from src.trade_data_source.trade import Trade
+
+
+class TradeBatch:
+    """
+    A batch of trades stored as columns (NumPy arrays) instead of one Trade object
+    per trade.
+
+    This is what every TradeSource returns. The sources build the columns in bulk
+    from the exchange messages (or straight from the parquet files of the cache),
+    the batch is validated once when it is created, and the producer serializes
+    it to Kafka messages without ever building a Trade object.
+    """
+
+    __slots__ = ('product_id', 'price', 'quantity', 'timestamp_ms')
+
+    def __init__(
+        self,
+        product_id: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        timestamp_ms: np.ndarray,
+    ) -> None:
+        """
+        Args:
+            product_id (np.ndarray): The product of each trade, as Python strings.
+            price (np.ndarray): The price of each trade.
+            quantity (np.ndarray): The quantity of each trade.
+            timestamp_ms (np.ndarray): The time of each trade, in Unix milliseconds.
+
+        Returns:
+            None
+        """
+        # np.asarray does not copy arrays that already have the right dtype
+        self.product_id = np.asarray(product_id, dtype=object)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.quantity = np.asarray(quantity, dtype=np.float64)
+        self.timestamp_ms = np.asarray(timestamp_ms, dtype=np.int64)
+
+        self._validate()
+
+    def _validate(self) -> None:
+        """
+        Checks the whole batch at once, instead of validating every trade on its own.
+        """
+        n_trades = len(self.timestamp_ms)
+        if not (len(self.product_id) == len(self.price) == len(self.quantity) == n_trades):
+            raise ValueError('All the columns of a TradeBatch must have the same length')
+
+        if not np.isfinite(self.price).all() or (self.price <= 0).any():
+            raise ValueError('Trade prices must be finite and positive')
+
+        if not np.isfinite(self.quantity).all() or (self.quantity < 0).any():
+            raise ValueError('Trade quantities must be finite and non-negative')
+
+        if (self.timestamp_ms <= 0).any():
+            raise ValueError('Trade timestamps must be positive Unix milliseconds')
+
+    @classmethod
+    def empty(cls) -> 'TradeBatch':
+        return cls(
+            product_id=np.array([], dtype=object),
+            price=np.array([], dtype=np.float64),
+            quantity=np.array([], dtype=np.float64),
+            timestamp_ms=np.array([], dtype=np.int64),
+        )
+
+    @classmethod
+    def from_arrow(cls, table) -> 'TradeBatch':
+        """
+        Wraps the columns of a pyarrow Table with the Trade fields. Numeric columns
+        without nulls are not copied.
+        """
+        return cls(
+            product_id=table.column('product_id').to_numpy(),
+            price=table.column('price').to_numpy(),
+            quantity=table.column('quantity').to_numpy(),
+            timestamp_ms=table.column('timestamp_ms').to_numpy(),
+        )
+
+    @classmethod
+    def from_trades(cls, trades: Sequence[Trade]) -> 'TradeBatch':
+        """
+        Builds a batch from a list of Trade objects.
+        """
+        return cls(
+            product_id=[trade.product_id for trade in trades],
+            price=[trade.price for trade in trades],
+            quantity=[trade.quantity for trade in trades],
+            timestamp_ms=[trade.timestamp_ms for trade in trades],
+        )
+
+    @classmethod
+    def concat(cls, batches: Sequence['TradeBatch']) -> 'TradeBatch':
+        """
+        Concatenates several batches into one, keeping their order.
+        """
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        return cls(
+            product_id=np.concatenate([batch.product_id for batch in batches]),
+            price=np.concatenate([batch.price for batch in batches]),
+            quantity=np.concatenate([batch.quantity for batch in batches]),
+            timestamp_ms=np.concatenate([batch.timestamp_ms for batch in batches]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    def __repr__(self) -> str:
+        return f'TradeBatch(n_trades={len(self)})'
+
+    def __getitem__(self, index) -> 'TradeBatch':
+        """
+        Returns the rows selected by a slice or a boolean mask, as a new batch.
+        """
+        return TradeBatch(
+            product_id=self.product_id[index],
+            price=self.price[index],
+            quantity=self.quantity[index],
+            timestamp_ms=self.timestamp_ms[index],
+        )
+
+    def __iter__(self) -> Iterator[Trade]:
+        """
+        Yields one Trade per row, for the code paths that still work trade by trade.
+        """
+        for product_id, price, quantity, timestamp_ms in zip(
+            self.product_id.tolist(),
+            self.price.tolist(),
+            self.quantity.tolist(),
+            self.timestamp_ms.tolist(),
+        ):
+            yield Trade(
+                product_id=product_id,
+                price=price,
+                quantity=quantity,
+                timestamp_ms=timestamp_ms,
+            )
+
+    def to_arrow(self):
+        """
+        Returns the batch as a pyarrow Table with the Trade fields as columns.
+        """
+        import pyarrow as pa
+
+        return pa.table(
+            {
+                'product_id': pa.array(self.product_id, type=pa.string()),
+                'price': self.price,
+                'quantity': self.quantity,
+                'timestamp_ms': self.timestamp_ms,
+            }
+        )
+
+    def to_messages(self, encoding: str = 'json') -> List[Tuple[bytes, bytes]]:
+        """
+        Serializes the batch to (key, value) Kafka messages in the given wire
+        format encoding (see src/wire_format.py). The key is the product_id.
+
+        Args:
+            encoding (str): One of 'json', 'msgpack' or 'struct'.
+
+        Returns:
+            List[Tuple[bytes, bytes]]: The (key, value) messages, in the order of the batch.
+        """
+        if encoding == 'json':
+            return self.to_json_messages()
+
+        if encoding == 'struct':
+            return self.to_struct_messages()
+
+        from src import wire_format
+
+        return [
+            (trade['product_id'].encode(), wire_format.encode(trade, wire_format.TRADE_V1, encoding))
+            for trade in self._to_dicts()
+        ]
+
+    def to_struct_messages(self) -> List[Tuple[bytes, bytes]]:
+        """
+        Serializes the batch to (key, value) Kafka messages in the 'struct' wire format.
+
+        NumPy packs the numeric fields of all the rows in one go, so each value is
+        just the per-product prefix plus a fixed-size slice of that buffer.
+        """
+        from src.wire_format import TRADE_V1, struct_prefix
+
+        # a record array with exactly the binary layout of the schema
+        dtype = np.dtype([(field, '<' + code) for field, code in TRADE_V1.numeric_fields])
+        records = np.empty(len(self), dtype=dtype)
+        for field in TRADE_V1.field_names:
+            records[field] = getattr(self, field)
+        packed = records.tobytes()
+        size = dtype.itemsize
+
+        keys = {}
+        prefixes = {}
+
+        messages = []
+        for i, product_id in enumerate(self.product_id.tolist()):
+            if product_id not in keys:
+                keys[product_id] = product_id.encode()
+                prefixes[product_id] = struct_prefix(TRADE_V1, product_id)
+
+            messages.append(
+                (keys[product_id], prefixes[product_id] + packed[i * size:(i + 1) * size])
+            )
+
+        return messages
+
+    def _to_dicts(self) -> Iterator[dict]:
+        """
+        Yields one dict per row, without validating them again like Trade would.
+        """
+        for product_id, price, quantity, timestamp_ms in zip(
+            self.product_id.tolist(),
+            self.price.tolist(),
+            self.quantity.tolist(),
+            self.timestamp_ms.tolist(),
+        ):
+            yield {
+                'product_id': product_id,
+                'price': price,
+                'quantity': quantity,
+                'timestamp_ms': timestamp_ms,
+            }
+
+    def to_json_messages(self) -> List[Tuple[bytes, bytes]]:
+        """
+        Serializes the batch to (key, value) Kafka messages, straight from the columns.
+
+        The key is the product_id, and the value is the same JSON object we get
+        from `Trade.model_dump()`.
+        """
+        # the product ids repeat a lot, so we encode them once
+        keys = {}
+        prefixes = {}
+
+        messages = []
+        for product_id, price, quantity, timestamp_ms in zip(
+            self.product_id.tolist(),
+            self.price.tolist(),
+            self.quantity.tolist(),
+            self.timestamp_ms.tolist(),
+        ):
+            if product_id not in keys:
+                keys[product_id] = product_id.encode()
+                prefixes[product_id] = '{"product_id":%s,"price":' % json.dumps(product_id)
+
+            value = '%s%r,"quantity":%r,"timestamp_ms":%d}' % (
+                prefixes[product_id], price, quantity, timestamp_ms
+            )
+            messages.append((keys[product_id], value.encode()))
+
+        return messages
+
+
+def parse_iso_timestamps_ms(timestamps: Sequence[str]) -> np.ndarray:
+    """
+    Parses RFC 3339 timestamps in UTC, like '2024-01-01T00:36:45.456789Z', into
+    Unix milliseconds, all at once.
+
+    Args:
+        timestamps (Sequence[str]): The timestamps to parse.
+
+    Returns:
+        np.ndarray: The timestamps in Unix milliseconds (int64), truncated to the millisecond.
+    """
+    if len(timestamps) == 0:
+        return np.array([], dtype=np.int64)
+
+    # NumPy parses ISO 8601 in C, but does not accept the trailing 'Z' (UTC)
+    timestamps = np.char.rstrip(np.asarray(timestamps, dtype=str), 'Z')
+    return timestamps.astype('datetime64[ms]').astype(np.int64)
@@ -0,0 +1,176 @@
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Tuple
+
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+TRADE_COLUMNS = list(Trade.model_fields)
+
+
+def end_of_day_ms(ts: int) -> int:
+    """
+    Returns the last millisecond of the UTC day of the given timestamp
+
+    Args:
+        ts (int): A timestamp in Unix milliseconds
+
+    Returns:
+        int: The timestamp of 23:59:59.999 of that day, in Unix milliseconds
+    """
+    return ts - ts % MS_PER_DAY + MS_PER_DAY - 1
+
+
+class TradeStore:
+    """
+    Local store of historical trades, partitioned by product and day.
+
+    Layout on disk:
+
+        {cache_dir}/{product}/{YYYY-MM-DD}/{from_ms}-{to_ms}.parquet
+
+    Each part file holds *every* trade of the product with
+    `from_ms <= timestamp_ms <= to_ms` (possibly none), so the file names are also
+    the index of the time ranges we have already downloaded. A backfill can then
+    read the overlap from disk, and only ask the API for the ranges that are missing.
+
+    Part files of the same product never overlap, so several threads can write
+    to the store at the same time as long as they download disjoint ranges.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = Path(cache_dir)
+
+        if not self.cache_dir.exists():
+            # create the cache directory if it does not exist
+            self.cache_dir.mkdir(parents=True)
+
+    def covered_ranges(self, product_id: str) -> List[Tuple[int, int]]:
+        """
+        Returns the time ranges (both ends inclusive) for which we have all the trades
+        of the given product, sorted and with adjacent ranges merged.
+        """
+        ranges = sorted(from_to for from_to, _ in self._list_parts(product_id))
+
+        merged: List[Tuple[int, int]] = []
+        for from_ms, to_ms in ranges:
+            if merged and from_ms <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], to_ms))
+            else:
+                merged.append((from_ms, to_ms))
+
+        return merged
+
+    def missing_ranges(
+        self, product_id: str, from_ms: int, to_ms: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the sub-ranges of `[from_ms, to_ms]` that are not in the store yet.
+        """
+        missing = []
+        start = from_ms
+        for covered_from, covered_to in self.covered_ranges(product_id):
+            if covered_to < start:
+                continue
+            if covered_from > to_ms:
+                break
+            if covered_from > start:
+                missing.append((start, covered_from - 1))
+            start = covered_to + 1
+
+        if start <= to_ms:
+            missing.append((start, to_ms))
+
+        return missing
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Reads the trades of the given product with `from_ms <= timestamp_ms <= to_ms`,
+        sorted by timestamp. Only the part files that overlap the range
+        are opened, and the data stays in Arrow/NumPy arrays the whole way.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        parts = sorted(
+            (part_from_to, path)
+            for part_from_to, path in self._list_parts(product_id)
+            if part_from_to[0] <= to_ms and part_from_to[1] >= from_ms
+        )
+        # parts of quiet periods can be empty, we skip them
+        tables = [pq.read_table(path, columns=TRADE_COLUMNS) for _, path in parts]
+        tables = [table for table in tables if table.num_rows > 0]
+        if not tables:
+            return TradeBatch.empty()
+
+        table = pa.concat_tables(tables)
+        timestamp_ms = table.column('timestamp_ms')
+        table = table.filter(
+            pc.and_(pc.greater_equal(timestamp_ms, from_ms), pc.less_equal(timestamp_ms, to_ms))
+        )
+
+        return TradeBatch.from_arrow(table)
+
+    def write(
+        self, product_id: str, from_ms: int, to_ms: int, trades: TradeBatch
+    ) -> None:
+        """
+        Saves the trades of the given product, which must be *all* the trades with
+        `from_ms <= timestamp_ms <= to_ms`, and marks that range as covered.
+        The range is split into one part file per day.
+        """
+        import pyarrow.parquet as pq
+
+        day_from_ms = from_ms
+        while day_from_ms <= to_ms:
+            day_to_ms = min(to_ms, end_of_day_ms(day_from_ms))
+            day_trades = trades[
+                (trades.timestamp_ms >= day_from_ms) & (trades.timestamp_ms <= day_to_ms)
+            ]
+
+            path = self._get_part_path(product_id, day_from_ms, day_to_ms)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            # write to a temporary file first, so readers never see half-written parts
+            tmp_path = path.with_suffix('.tmp')
+            pq.write_table(day_trades.to_arrow(), tmp_path)
+            os.replace(tmp_path, path)
+
+            day_from_ms = day_to_ms + 1
+
+    def _list_parts(self, product_id: str) -> List[Tuple[Tuple[int, int], Path]]:
+        """
+        Returns ((from_ms, to_ms), path) for every part file of the given product.
+        """
+        product_dir = self.cache_dir / self._product_dir_name(product_id)
+        if not product_dir.exists():
+            return []
+
+        parts = []
+        for path in product_dir.glob('*/*.parquet'):
+            from_ms, to_ms = path.stem.split('-')
+            parts.append(((int(from_ms), int(to_ms)), path))
+
+        return parts
+
+    def _get_part_path(self, product_id: str, from_ms: int, to_ms: int) -> Path:
+        """
+        Returns the path of the part file for the given product and time range,
+        which must be within a single day.
+        """
+        day = datetime.fromtimestamp(from_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+        return (
+            self.cache_dir
+            / self._product_dir_name(product_id)
+            / day
+            / f'{from_ms}-{to_ms}.parquet'
+        )
+
+    @staticmethod
+    def _product_dir_name(product_id: str) -> str:
+        # product ids like BTC/USD are not valid directory names
+        return product_id.replace('/', '-')
@@ -0,0 +1,259 @@
+"""
+Wire format of the messages our services exchange through Kafka.
+
+This module is copied as-is in every service that reads or writes these topics
+(trade_producer, trade_to_ohlc, ohlc_to_indicators, topic_to_feature_store), so they
+all agree on the schemas. If you change it, change it everywhere: `make
+check-shared-modules` at the root of the repo fails while the copies differ.
+
+A message value is encoded in one of these encodings:
+
+- 'json': a plain JSON object, exactly what we have always sent. This is the default.
+- 'msgpack': a 4-byte header followed by a MessagePack map.
+- 'struct': a 4-byte header followed by a fixed binary layout given by the schema:
+  the length-prefixed UTF-8 product_id, then the numeric fields packed little-endian.
+
+The header is [magic, encoding id, schema id, schema version]. The magic byte can
+never start a JSON document, so `decode` tells the encodings apart on its own,
+and consumers can read topics with a mix of old (JSON) and new messages.
+"""
+import json
+import struct
+from typing import Any, Dict, Mapping, Tuple
+
+from quixstreams.models.serializers import (
+    Deserializer,
+    SerializationContext,
+    Serializer,
+)
+
+ENCODINGS = ('json', 'msgpack', 'struct')
+
+_MAGIC = 0xA7
+_ENCODING_IDS = {'msgpack': 1, 'struct': 2}
+_ENCODING_NAMES = {encoding_id: name for name, encoding_id in _ENCODING_IDS.items()}
+_HEADER = struct.Struct('<BBBB')
+
+
+class MessageSchema:
+    """
+    The fields of one kind of message, at one version, and its fixed binary layout.
+
+    Every message has a `product_id` string, followed by numeric fields. Adding,
+    removing or re-typing a field means adding a new version of the schema, so
+    that messages already in the topics can still be decoded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        schema_id: int,
+        version: int,
+        numeric_fields: Tuple[Tuple[str, str], ...],
+    ) -> None:
+        """
+        Args:
+            name (str): A human-readable name, e.g. 'trade'.
+            schema_id (int): The id of the kind of message, written in the header.
+            version (int): The version of the schema, written in the header.
+            numeric_fields (Tuple[Tuple[str, str], ...]): (field name, struct format code)
+                of every numeric field, in the order they are packed.
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.schema_id = schema_id
+        self.version = version
+        self.numeric_fields = numeric_fields
+        self.field_names = tuple(field for field, _ in numeric_fields)
+        self.numeric_struct = struct.Struct('<' + ''.join(code for _, code in numeric_fields))
+
+    def header(self, encoding: str) -> bytes:
+        return _HEADER.pack(_MAGIC, _ENCODING_IDS[encoding], self.schema_id, self.version)
+
+
+TRADE_V1 = MessageSchema(
+    name='trade',
+    schema_id=1,
+    version=1,
+    numeric_fields=(('price', 'd'), ('quantity', 'd'), ('timestamp_ms', 'q')),
+)
+
+CANDLE_V1 = MessageSchema(
+    name='candle',
+    schema_id=2,
+    version=1,
+    numeric_fields=(
+        ('timestamp_ms', 'q'),
+        ('open', 'd'),
+        ('high', 'd'),
+        ('low', 'd'),
+        ('close', 'd'),
+        ('volume', 'd'),
+    ),
+)
+
+# candles of a multi-resolution trade_to_ohlc, tagged with their window size
+CANDLE_V2 = MessageSchema(
+    name='candle',
+    schema_id=2,
+    version=2,
+    numeric_fields=CANDLE_V1.numeric_fields + (('window_seconds', 'q'),),
+)
+
+# candles of a trade_to_ohlc that also sends in-progress candles, flagged as not final
+CANDLE_V3 = MessageSchema(
+    name='candle',
+    schema_id=2,
+    version=3,
+    numeric_fields=CANDLE_V2.numeric_fields + (('is_final', '?'),),
+)
+
+# every candle trade_to_ohlc sends: OHLCV, the statistics of its trades, its window
+# size and whether it is closed
+CANDLE_V4 = MessageSchema(
+    name='candle',
+    schema_id=2,
+    version=4,
+    numeric_fields=CANDLE_V1.numeric_fields + (
+        ('vwap', 'd'),
+        ('n_trades', 'q'),
+        ('realized_variance', 'd'),
+        ('window_seconds', 'q'),
+        ('is_final', '?'),
+    ),
+)
+
+# the candles of ohlc_to_indicators, with the technical indicators of their series
+INDICATORS_V1 = MessageSchema(
+    name='indicators',
+    schema_id=3,
+    version=1,
+    numeric_fields=CANDLE_V4.numeric_fields + (
+        ('ema_fast', 'd'),
+        ('ema_slow', 'd'),
+        ('rsi', 'd'),
+        ('volatility', 'd'),
+        ('log_return', 'd'),
+        ('log_return_k', 'd'),
+    ),
+)
+
+# every schema we can decode, by (schema id, version)
+SCHEMAS = {
+    (schema.schema_id, schema.version): schema
+    for schema in (TRADE_V1, CANDLE_V1, CANDLE_V2, CANDLE_V3, CANDLE_V4, INDICATORS_V1)
+}
+
+
+def encode(value: Mapping[str, Any], schema: MessageSchema, encoding: str = 'json') -> bytes:
+    """
+    Encodes a message value.
+
+    Args:
+        value (Mapping[str, Any]): The message, with a `product_id` and the fields of the schema.
+        schema (MessageSchema): The schema of the message.
+        encoding (str): One of ENCODINGS.
+
+    Returns:
+        bytes: The encoded message.
+    """
+    if encoding == 'json':
+        return json.dumps(value, separators=(',', ':')).encode()
+
+    if encoding == 'msgpack':
+        return schema.header(encoding) + _msgpack().packb(value)
+
+    if encoding == 'struct':
+        return struct_prefix(schema, value['product_id']) + schema.numeric_struct.pack(
+            *(value[field] for field in schema.field_names)
+        )
+
+    raise ValueError(f'encoding must be one of {ENCODINGS}, but got {encoding}')
+
+
+def struct_prefix(schema: MessageSchema, product_id: str) -> bytes:
+    """
+    Returns the bytes that go before the numeric fields of a 'struct' message:
+    the header and the length-prefixed product_id.
+    """
+    encoded = product_id.encode()
+    if len(encoded) > 255:
+        raise ValueError(
+            f"The 'struct' encoding takes product ids of up to 255 bytes, but {product_id!r} "
+            f"has {len(encoded)}"
+        )
+    return schema.header('struct') + struct.pack('<B', len(encoded)) + encoded
+
+
+def decode(data: bytes) -> Dict[str, Any]:
+    """
+    Decodes a message value in any of our encodings.
+
+    Args:
+        data (bytes): The encoded message.
+
+    Returns:
+        Dict[str, Any]: The message.
+    """
+    if not data or data[0] != _MAGIC:
+        return json.loads(data)
+
+    _, encoding_id, schema_id, version = _HEADER.unpack_from(data)
+    encoding = _ENCODING_NAMES.get(encoding_id)
+
+    if encoding == 'msgpack':
+        return _msgpack().unpackb(data[_HEADER.size:])
+
+    if encoding == 'struct':
+        schema = SCHEMAS.get((schema_id, version))
+        if schema is None:
+            raise ValueError(f'Unknown message schema id={schema_id} version={version}')
+
+        offset = _HEADER.size
+        (product_id_length,) = struct.unpack_from('<B', data, offset)
+        offset += 1
+        product_id = data[offset:offset + product_id_length].decode()
+        offset += product_id_length
+
+        message = {'product_id': product_id}
+        message.update(zip(schema.field_names, schema.numeric_struct.unpack_from(data, offset)))
+        return message
+
+    raise ValueError(f'Unknown message encoding id={encoding_id}')
+
+
+def _msgpack():
+    # msgpack is only needed if we use that encoding
+    try:
+        import msgpack
+    except ImportError as e:
+        raise ImportError('Install msgpack to use the msgpack encoding') from e
+
+    return msgpack
+
+
+class WireSerializer(Serializer):
+    """
+    Quix Streams serializer that encodes message values with the given schema and encoding.
+    """
+
+    def __init__(self, schema: MessageSchema, encoding: str = 'json') -> None:
+        if encoding not in ENCODINGS:
+            raise ValueError(f'encoding must be one of {ENCODINGS}, but got {encoding}')
+
+        self.schema = schema
+        self.encoding = encoding
+
+    def __call__(self, value: Mapping[str, Any], ctx: SerializationContext) -> bytes:
+        return encode(value, self.schema, self.encoding)
+
+
+class WireDeserializer(Deserializer):
+    """
+    Quix Streams deserializer that decodes message values in any of our encodings.
+    """
+
+    def __call__(self, value: bytes, ctx: SerializationContext) -> Dict[str, Any]:
+        return decode(value)
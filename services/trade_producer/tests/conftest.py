@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the mock exchange lives with the benchmarks, at the root of the repo
+BENCHMARKS_DIR = Path(__file__).resolve().parents[3] / 'benchmarks'
+
+
+@pytest.fixture
+def mock_kraken():
+    """
+    Starts mock Kraken exchanges (see benchmarks/mock_kraken.py) on free ports, and
+    stops them at the end of the test.
+
+    Returns:
+        A function that takes the arguments of MockKraken and returns the exchange
+        and its port.
+    """
+    if not (BENCHMARKS_DIR / 'mock_kraken.py').exists():
+        pytest.skip('benchmarks/mock_kraken.py is not in this tree, e.g. in the Docker image')
+
+    sys.path.insert(0, str(BENCHMARKS_DIR))
+    from mock_kraken import MockKraken, start_mock_kraken
+
+    servers = []
+
+    def start(**kwargs):
+        kwargs.setdefault('symbols', ['BTC/USD', 'ETH/USD'])
+        exchange = MockKraken(**kwargs)
+        server = start_mock_kraken(exchange, port=0)
+        servers.append(server)
+        return exchange, server.server_address[1]
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    sys.path.remove(str(BENCHMARKS_DIR))
@@ -0,0 +1,88 @@
+import json
+import time
+
+import pyarrow.parquet as pq
+import pytest
+
+from src.trade_data_source.file_replay import FileReplayTradeSource
+from src.trade_data_source.trade_batch import TradeBatch
+
+T0 = 1_704_069_405_000
+
+
+def _write_files(tmp_path) -> None:
+    # out of order within each file, with ties in the same millisecond across files
+    parquet_trades = TradeBatch(
+        product_id=['BTC/USD', 'BTC/USD', 'ETH/USD'],
+        price=[3.0, 1.0, 10.0],
+        quantity=[1.0, 1.0, 1.0],
+        timestamp_ms=[T0 + 1000, T0, T0 + 500],
+    )
+    pq.write_table(parquet_trades.to_arrow(), tmp_path / 'trades.parquet')
+
+    jsonl_trades = [
+        {'product_id': 'BTC/USD', 'price': 4.0, 'quantity': 2.0, 'timestamp_ms': T0 + 1000},
+        {'product_id': 'BTC/USD', 'price': 2.0, 'quantity': 2.0, 'timestamp_ms': T0 + 500},
+    ]
+    (tmp_path / 'trades.jsonl').write_text(''.join(json.dumps(trade) + '\n' for trade in jsonl_trades))
+
+
+def _replay_all(source: FileReplayTradeSource) -> TradeBatch:
+    batches = []
+    while not source.is_done():
+        batches.append(source.get_trades())
+    return TradeBatch.concat(batches)
+
+
+def test_replays_parquet_and_jsonl_in_a_stable_timestamp_order(tmp_path):
+    _write_files(tmp_path)
+
+    trades = _replay_all(FileReplayTradeSource(str(tmp_path), speed=0, max_batch_size=2))
+
+    # trades in the same millisecond keep the order of the files: parquet, then JSONL
+    assert trades.timestamp_ms.tolist() == [T0, T0 + 500, T0 + 500, T0 + 1000, T0 + 1000]
+    assert trades.price.tolist() == [1.0, 10.0, 2.0, 3.0, 4.0]
+
+
+def test_replays_the_given_files_and_products(tmp_path):
+    _write_files(tmp_path)
+
+    source = FileReplayTradeSource([str(tmp_path / 'trades.jsonl')], speed=None, product_ids=['BTC/USD'])
+    assert _replay_all(source).price.tolist() == [2.0, 4.0]
+
+    source = FileReplayTradeSource(str(tmp_path), speed=None, product_ids=['ETH/USD'])
+    assert _replay_all(source).price.tolist() == [10.0]
+
+    (tmp_path / 'empty').mkdir()
+    with pytest.raises(ValueError, match='No parquet or JSONL files'):
+        FileReplayTradeSource(str(tmp_path / 'empty'))
+
+
+@pytest.mark.parametrize('speed', [0, None])
+def test_max_speed_does_not_wait(tmp_path, speed):
+    _write_files(tmp_path)
+    source = FileReplayTradeSource(str(tmp_path), speed=speed, max_batch_size=2)
+
+    started = time.monotonic()
+    batch_sizes = [len(source.get_trades()) for _ in range(3)]
+
+    assert batch_sizes == [2, 2, 1]
+    assert time.monotonic() - started < 0.2
+
+
+def test_paced_replay_follows_the_event_time(tmp_path):
+    _write_files(tmp_path)
+    # one second of trades, replayed in half a second
+    source = FileReplayTradeSource(str(tmp_path), speed=2)
+
+    started = time.monotonic()
+    arrivals = []
+    while not source.is_done():
+        trades = source.get_trades()
+        arrivals += [(time.monotonic() - started, ts) for ts in trades.timestamp_ms.tolist()]
+
+    # each trade comes out once it is due, and not much later
+    for elapsed_sec, timestamp_ms in arrivals:
+        due_sec = (timestamp_ms - T0) / 1000 / 2
+        assert due_sec - 0.01 <= elapsed_sec <= due_sec + 0.1
+    assert arrivals[-1][0] >= 0.49
@@ -0,0 +1,32 @@
+import time
+
+from src.trade_data_source.hybrid_trade_source import HybridTradeSource
+from src.trade_data_source.rate_limiter import RateLimiter
+from src.trade_data_source.trade_batch import TradeBatch
+from tests.test_kraken_rest_api import rest_url
+
+
+def test_buffers_a_bounded_number_of_live_batches(mock_kraken):
+    exchange, port = mock_kraken(trades_per_sec=200, rest_requests_per_sec=1000, rest_burst=1000)
+
+    source = HybridTradeSource(
+        ['BTC/USD'],
+        from_ms=int(time.time() * 1000) - 3600 * 1000,
+        rate_limiter=RateLimiter(rate_per_sec=20, burst=1),
+        ws_url=f'ws://localhost:{port}/v2',
+        rest_url=rest_url(port),
+        max_buffered_batches=5,
+    )
+
+    # the live trades keep coming while we page the history slowly
+    n_pages = 0
+    while source._products_to_backfill:
+        source.get_trades()
+        n_pages += 1
+        assert source._live_trades.qsize() <= 5
+    assert n_pages > 5
+
+    # then the buffered live trades, without the backfilled ones, and the live stream
+    trades = TradeBatch.concat([source.get_trades() for _ in range(20)])
+    assert len(trades) > 0
+    assert set(trades.product_id.tolist()) == {'BTC/USD'}
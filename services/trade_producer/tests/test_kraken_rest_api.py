@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from src.checkpointer import Checkpointer
+from src.delivery_stats import DeliveryStats
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.rate_limiter import AdaptiveRateLimiter, RateLimiter
+from src.trade_data_source.trade_batch import TradeBatch
+
+# the mock exchange has a group of 3 trades in the same millisecond every second
+_TRADES_PER_GROUP = 3
+
+
+def rest_url(port: int) -> str:
+    return f'http://localhost:{port}/0/public/Trades?pair={{product_id}}&since={{since_ns}}'
+
+
+def _backfill(api: KrakenRestAPI) -> TradeBatch:
+    batches = []
+    while not api.is_done():
+        batches.append(api.get_trades())
+    return TradeBatch.concat(batches)
+
+
+def _last_hour(exchange) -> tuple:
+    # a range of whole seconds, well before the live trades of the mock
+    to_ms = (exchange.started_ns // 1_000_000 // 1000 - 60) * 1000
+    return to_ms - 3600 * 1000, to_ms
+
+
+def _check_every_trade_once(trades: TradeBatch, from_ms: int, to_ms: int) -> None:
+    assert np.all(np.diff(trades.timestamp_ms) >= 0)
+
+    # pages of 1000 trades end in the middle of a group, which the `last` cursor
+    # must neither fetch twice nor skip
+    timestamps, counts = np.unique(trades.timestamp_ms, return_counts=True)
+    assert timestamps.tolist() == list(range(from_ms, to_ms + 1, 1000))
+    assert np.all(counts == _TRADES_PER_GROUP)
+
+
+def test_backfill_pages_every_trade_once(mock_kraken):
+    exchange, port = mock_kraken(rest_requests_per_sec=1000, rest_burst=1000)
+    from_ms, to_ms = _last_hour(exchange)
+
+    api = KrakenRestAPI(
+        'BTC/USD',
+        from_ms=from_ms,
+        to_ms=to_ms,
+        rate_limiter=RateLimiter(rate_per_sec=1000, burst=1000),
+        url=rest_url(port),
+    )
+    trades = _backfill(api)
+
+    _check_every_trade_once(trades, from_ms, to_ms)
+    assert set(trades.product_id.tolist()) == {'BTC/USD'}
+    assert exchange.n_rest_throttled == 0
+
+
+def test_backfill_slows_down_when_throttled(mock_kraken):
+    exchange, port = mock_kraken(rest_requests_per_sec=20, rest_burst=1)
+    from_ms, to_ms = _last_hour(exchange)
+
+    rate_limiter = AdaptiveRateLimiter(rate_per_sec=100, max_rate_per_sec=100)
+    api = KrakenRestAPI(
+        'ETH/USD',
+        from_ms=from_ms,
+        to_ms=to_ms,
+        rate_limiter=rate_limiter,
+        url=rest_url(port),
+    )
+    trades = _backfill(api)
+
+    # the throttled pages are fetched again, so we still get every trade once
+    _check_every_trade_once(trades, from_ms, to_ms)
+    assert exchange.n_rest_throttled > 0
+    assert rate_limiter.rate_per_sec < 100
+
+
+class _FakeProducer:
+    def flush(self) -> None:
+        pass
+
+
+def test_finished_backfill_is_not_resumed(mock_kraken, tmp_path):
+    exchange, port = mock_kraken(rest_requests_per_sec=1000, rest_burst=1000)
+    from_ms, to_ms = _last_hour(exchange)
+
+    def make_api(from_ms: int, to_ms: int) -> KrakenRestAPI:
+        return KrakenRestAPI(
+            'BTC/USD',
+            from_ms=from_ms,
+            to_ms=to_ms,
+            rate_limiter=RateLimiter(rate_per_sec=1000, burst=1000),
+            url=rest_url(port),
+            checkpoint_dir=str(tmp_path),
+        )
+
+    # stop in the middle of the job, after a checkpoint
+    api = make_api(from_ms, to_ms)
+    first_page = api.get_trades()
+    api.commit_checkpoint(api.checkpoint())
+
+    # another range cannot silently resume the unfinished job
+    with pytest.raises(ValueError):
+        make_api(from_ms - 1000, to_ms)
+
+    api = make_api(from_ms, to_ms)
+    trades = TradeBatch.concat([first_page, _backfill(api)])
+    _check_every_trade_once(trades, from_ms, to_ms)
+    Checkpointer(api, _FakeProducer(), DeliveryStats()).finish(api.checkpoint())
+
+    # the job is complete, so the next backfill fetches its whole range again
+    api = make_api(from_ms, to_ms)
+    _check_every_trade_once(_backfill(api), from_ms, to_ms)
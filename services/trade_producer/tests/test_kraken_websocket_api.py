@@ -0,0 +1,122 @@
+import time
+from collections import Counter
+
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.trade_batch import TradeBatch
+from tests.test_kraken_rest_api import rest_url
+
+
+def _read_for(api: KrakenWebsocketAPI, seconds: float) -> TradeBatch:
+    batches = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        batches.append(api.get_trades())
+    return TradeBatch.concat(batches)
+
+
+def test_streams_the_trades_of_every_symbol(mock_kraken):
+    exchange, port = mock_kraken(trades_per_sec=200)
+
+    api = KrakenWebsocketAPI(['BTC/USD', 'ETH/USD'], url=f'ws://localhost:{port}/v2', gap_fill=False)
+    started_ms = time.time() * 1000
+    trades = _read_for(api, 1.0)
+
+    assert len(trades) > 0
+    assert set(trades.product_id.tolist()) == {'BTC/USD', 'ETH/USD'}
+    # live trades are stamped with the time they happened
+    assert trades.timestamp_ms.min() >= started_ms - 1000
+    assert trades.timestamp_ms.max() <= time.time() * 1000
+
+
+def test_returns_an_empty_batch_on_heartbeats(mock_kraken):
+    exchange, port = mock_kraken(trades_per_sec=0, heartbeat_sec=0.1)
+
+    api = KrakenWebsocketAPI(['BTC/USD'], url=f'ws://localhost:{port}/v2', gap_fill=False)
+
+    # no trades, but get_trades keeps returning, one empty batch per heartbeat
+    for _ in range(3):
+        assert len(api.get_trades()) == 0
+
+
+def _check_gap_free(exchange, trades: TradeBatch, from_ms: dict) -> None:
+    """
+    Checks that, for each product, `trades` are in time order and are exactly the trades
+    the exchange published from `from_ms` (inclusive) to the last one we returned
+    (exclusive, as the trades of that millisecond may still be on their way).
+    """
+    with exchange._lock:
+        history = {symbol: list(trades) for symbol, trades in exchange._live_history.items()}
+
+    for product_id, start_ms in from_ms.items():
+        is_product = trades.product_id == product_id
+        timestamps = trades.timestamp_ms[is_product].tolist()
+        assert timestamps == sorted(timestamps)
+
+        returned = Counter(zip(timestamps, trades.price[is_product].tolist(), trades.quantity[is_product].tolist()))
+        published = Counter((trade_ns // 1_000_000, price, qty) for trade_ns, price, qty in history[product_id])
+
+        # nothing we returned twice, or that was never published
+        assert returned - published == Counter()
+
+        in_range = lambda trade: start_ms <= trade[0] < timestamps[-1]
+        assert +Counter({trade: n for trade, n in returned.items() if in_range(trade)}) == +Counter(
+            {trade: n for trade, n in published.items() if in_range(trade)}
+        )
+
+
+def test_retries_a_gap_fill_that_fails(mock_kraken, monkeypatch):
+    exchange, port = mock_kraken(
+        trades_per_sec=200, disconnect_every_sec=0.5, outage_sec=0.2, rest_requests_per_sec=1000, rest_burst=1000
+    )
+
+    # the first request of the gap fill fails, as Kraken does during an outage
+    fetch_page = KrakenRestAPI._fetch_page
+    n_calls = []
+
+    def failing_fetch_page(self, url):
+        n_calls.append(url)
+        if len(n_calls) == 1:
+            raise RuntimeError("Kraken REST API returned an error: ['EService:Unavailable']")
+        return fetch_page(self, url)
+
+    monkeypatch.setattr(KrakenRestAPI, '_fetch_page', failing_fetch_page)
+
+    api = KrakenWebsocketAPI(
+        ['BTC/USD', 'ETH/USD'],
+        url=f'ws://localhost:{port}/v2',
+        rest_url=rest_url(port),
+        initial_backoff_sec=0.01,
+    )
+    trades = _read_for(api, 2.0)
+
+    # we reconnected after the failed attempt, and the outages left no gap
+    assert exchange.n_dropped_connections >= 1
+    assert api.n_reconnects >= 1
+    assert api.n_recovered_trades > 0
+    assert len(n_calls) > 1
+    _check_gap_free(
+        exchange,
+        trades,
+        {product_id: int(trades.timestamp_ms[trades.product_id == product_id][0]) + 1 for product_id in api.product_ids},
+    )
+
+
+def test_fills_the_gap_of_a_product_we_returned_nothing_of(mock_kraken):
+    exchange, port = mock_kraken(trades_per_sec=200, rest_requests_per_sec=1000, rest_burst=1000)
+
+    api = KrakenWebsocketAPI(
+        ['BTC/USD', 'ETH/USD'],
+        url=f'ws://localhost:{port}/v2',
+        rest_url=rest_url(port),
+        initial_backoff_sec=0.01,
+    )
+
+    # the connection drops before we read anything, with the trades it had buffered
+    time.sleep(0.3)
+    api._ws.shutdown()
+    trades = _read_for(api, 0.5)
+
+    # the gap fill starts at the subscription of each product
+    assert api.n_reconnects == 1
+    _check_gap_free(exchange, trades, dict(api._subscribed_ms))
@@ -0,0 +1,50 @@
+from src.trade_data_source.sharded_kraken_rest_api import ShardedKrakenRestAPI
+from src.trade_data_source.trade_batch import TradeBatch
+from tests.test_kraken_rest_api import _backfill, _check_every_trade_once, _last_hour, rest_url
+
+
+def _sharded(port: int, from_ms: int, to_ms: int, **kwargs) -> ShardedKrakenRestAPI:
+    return ShardedKrakenRestAPI(
+        'BTC/USD',
+        last_n_days=None,
+        n_shards=4,
+        rate_per_sec=100,
+        max_rate_per_sec=1000,
+        max_buffered_pages=2,
+        url=rest_url(port),
+        from_ms=from_ms,
+        to_ms=to_ms,
+        **kwargs,
+    )
+
+
+def test_shards_return_every_trade_once_in_order(mock_kraken):
+    exchange, port = mock_kraken(rest_requests_per_sec=1000, rest_burst=1000)
+    from_ms, to_ms = _last_hour(exchange)
+
+    api = _sharded(port, from_ms, to_ms)
+    trades = _backfill(api)
+
+    # the pages of the shards come out in shard order, so in timestamp order
+    _check_every_trade_once(trades, from_ms, to_ms)
+    assert len(api._shards) == 4
+
+
+def test_shards_resume_from_their_checkpoint(mock_kraken, tmp_path):
+    exchange, port = mock_kraken(rest_requests_per_sec=1000, rest_burst=1000)
+    from_ms, to_ms = _last_hour(exchange)
+
+    # stop in the middle of the 2nd shard. The shards after it fetched ahead, but the
+    # checkpoint only has the pages we returned
+    api = _sharded(port, from_ms, to_ms, checkpoint_dir=str(tmp_path))
+    first_pages = []
+    while api._current_shard < 1 or len(first_pages) < 8:
+        first_pages.append(api.get_trades())
+    api.commit_checkpoint(api.checkpoint())
+    api.close()
+
+    # the restart takes the boundaries and the shards of the checkpoint
+    api = _sharded(port, from_ms, to_ms, checkpoint_dir=str(tmp_path))
+    trades = TradeBatch.concat(first_pages + [_backfill(api)])
+
+    _check_every_trade_once(trades, from_ms, to_ms)
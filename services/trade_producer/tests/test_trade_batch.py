@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch, parse_iso_timestamps_ms
+from src.wire_format import decode
+
+
+def _batch() -> TradeBatch:
+    return TradeBatch(
+        product_id=['BTC/USD', 'ETH/USD', 'BTC/USD'],
+        price=[64000.5, 2500.25, 64001.0],
+        quantity=[0.1, 2.0, 0.0],
+        timestamp_ms=[1_704_069_405_456, 1_704_069_405_457, 1_704_069_406_000],
+    )
+
+
+def test_parses_iso_timestamps_with_fractions_and_z():
+    timestamps = parse_iso_timestamps_ms(
+        ['2024-01-01T00:36:45.456789Z', '2024-01-01T00:36:45Z', '2024-01-01T00:36:45.4Z', '1970-01-01T00:00:00.001Z']
+    )
+
+    # truncated to the millisecond, in UTC
+    assert timestamps.dtype == np.int64
+    assert timestamps.tolist() == [1_704_069_405_456, 1_704_069_405_000, 1_704_069_405_400, 1]
+    assert parse_iso_timestamps_ms([]).tolist() == []
+
+
+@pytest.mark.parametrize(
+    'columns, error',
+    [
+        ({'price': [1.0, 2.0]}, 'same length'),
+        ({'price': [0.0]}, 'prices'),
+        ({'price': [float('nan')]}, 'prices'),
+        ({'quantity': [-1.0]}, 'quantities'),
+        ({'quantity': [float('inf')]}, 'quantities'),
+        ({'timestamp_ms': [0]}, 'timestamps'),
+    ],
+)
+def test_rejects_invalid_columns(columns, error):
+    valid = {'product_id': ['BTC/USD'], 'price': [1.0], 'quantity': [1.0], 'timestamp_ms': [1]}
+
+    with pytest.raises(ValueError, match=error):
+        TradeBatch(**{**valid, **columns})
+
+
+def test_concat_keeps_the_order_of_the_batches():
+    batch = _batch()
+
+    trades = TradeBatch.concat([batch[:1], TradeBatch.empty(), batch[1:]])
+    assert trades.product_id.tolist() == batch.product_id.tolist()
+    assert trades.timestamp_ms.tolist() == batch.timestamp_ms.tolist()
+
+    assert len(TradeBatch.concat([])) == 0
+    assert list(TradeBatch.concat([batch])) == list(batch)
+
+
+@pytest.mark.parametrize('encoding', ['json', 'msgpack', 'struct'])
+def test_messages_decode_to_the_trades(encoding):
+    batch = _batch()
+
+    messages = batch.to_messages(encoding)
+
+    # keyed by product, one message per trade, in the order of the batch
+    assert [key for key, _ in messages] == [b'BTC/USD', b'ETH/USD', b'BTC/USD']
+    assert [Trade(**decode(value)) for _, value in messages] == list(batch)
+
+
+def test_json_messages_are_the_trade_model_dump():
+    batch = _batch()
+
+    for (_, value), trade in zip(batch.to_messages('json'), batch):
+        assert json.loads(value) == trade.model_dump()
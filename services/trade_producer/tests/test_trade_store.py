@@ -0,0 +1,76 @@
+import numpy as np
+
+from src.trade_data_source.trade_batch import TradeBatch
+from src.trade_data_source.trade_store import MS_PER_DAY, TradeStore
+
+# midnight UTC of 2024-10-01
+DAY_MS = 1_727_740_800_000
+
+
+def _trades(product_id: str, timestamp_ms: list) -> TradeBatch:
+    return TradeBatch(
+        product_id=[product_id] * len(timestamp_ms),
+        price=np.arange(1, len(timestamp_ms) + 1, dtype=np.float64),
+        quantity=np.ones(len(timestamp_ms)),
+        timestamp_ms=timestamp_ms,
+    )
+
+
+def test_missing_ranges_of_an_empty_store(tmp_path):
+    store = TradeStore(str(tmp_path))
+
+    assert store.covered_ranges('BTC/USD') == []
+    assert store.missing_ranges('BTC/USD', DAY_MS, DAY_MS + 999) == [(DAY_MS, DAY_MS + 999)]
+
+
+def test_missing_ranges_around_partial_days(tmp_path):
+    store = TradeStore(str(tmp_path))
+
+    # two hours in the middle of the day, and the end of the day
+    store.write('BTC/USD', DAY_MS + 3_600_000, DAY_MS + 3 * 3_600_000 - 1, _trades('BTC/USD', []))
+    store.write('BTC/USD', DAY_MS + 20 * 3_600_000, DAY_MS + MS_PER_DAY - 1, _trades('BTC/USD', []))
+
+    assert store.missing_ranges('BTC/USD', DAY_MS, DAY_MS + MS_PER_DAY + 999) == [
+        (DAY_MS, DAY_MS + 3_600_000 - 1),
+        (DAY_MS + 3 * 3_600_000, DAY_MS + 20 * 3_600_000 - 1),
+        (DAY_MS + MS_PER_DAY, DAY_MS + MS_PER_DAY + 999),
+    ]
+    # within a covered range nothing is missing
+    assert store.missing_ranges('BTC/USD', DAY_MS + 3_600_000, DAY_MS + 2 * 3_600_000) == []
+    # other products have their own ranges
+    assert store.missing_ranges('ETH/USD', DAY_MS, DAY_MS + 999) == [(DAY_MS, DAY_MS + 999)]
+
+
+def test_adjacent_files_are_one_covered_range(tmp_path):
+    store = TradeStore(str(tmp_path))
+
+    store.write('BTC/USD', DAY_MS, DAY_MS + 999, _trades('BTC/USD', [DAY_MS + 10]))
+    store.write('BTC/USD', DAY_MS + 1000, DAY_MS + 1999, _trades('BTC/USD', [DAY_MS + 1500]))
+
+    assert store.covered_ranges('BTC/USD') == [(DAY_MS, DAY_MS + 1999)]
+    assert store.missing_ranges('BTC/USD', DAY_MS, DAY_MS + 2999) == [(DAY_MS + 2000, DAY_MS + 2999)]
+
+
+def test_reads_ranges_across_days(tmp_path):
+    store = TradeStore(str(tmp_path))
+
+    # from the evening of one day to the morning of the next, with trades around midnight
+    from_ms, to_ms = DAY_MS + MS_PER_DAY - 3_600_000, DAY_MS + MS_PER_DAY + 3_600_000 - 1
+    timestamps = [from_ms, DAY_MS + MS_PER_DAY - 1, DAY_MS + MS_PER_DAY, DAY_MS + MS_PER_DAY + 5, to_ms]
+    store.write('BTC/USD', from_ms, to_ms, _trades('BTC/USD', timestamps))
+
+    # one part file per day, and no temporary file left behind
+    parts = sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob('*') if path.is_file())
+    assert parts == [
+        f'BTC-USD/2024-10-01/{from_ms}-{DAY_MS + MS_PER_DAY - 1}.parquet',
+        f'BTC-USD/2024-10-02/{DAY_MS + MS_PER_DAY}-{to_ms}.parquet',
+    ]
+    assert store.covered_ranges('BTC/USD') == [(from_ms, to_ms)]
+
+    # a range across midnight reads both files, both ends inclusive
+    trades = store.read('BTC/USD', DAY_MS + MS_PER_DAY - 1, DAY_MS + MS_PER_DAY + 5)
+    assert trades.timestamp_ms.tolist() == timestamps[1:4]
+    assert trades.price.tolist() == [2.0, 3.0, 4.0]
+    assert set(trades.product_id.tolist()) == {'BTC/USD'}
+
+    assert len(store.read('BTC/USD', DAY_MS, from_ms - 1)) == 0
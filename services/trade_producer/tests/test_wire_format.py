@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from src.wire_format import SCHEMAS, decode, encode
+
+# a value of each struct format code, which packs and unpacks exactly
+_VALUES = {'d': 1234.5678, 'q': 1_704_069_405_456, '?': True}
+
+
+def _message(schema, product_id: str = 'BTC/USD') -> dict:
+    return {
+        'product_id': product_id,
+        **{field: _VALUES[code] for field, code in schema.numeric_fields},
+    }
+
+
+@pytest.mark.parametrize('encoding', ['json', 'msgpack', 'struct'])
+@pytest.mark.parametrize('schema', list(SCHEMAS.values()), ids=lambda schema: f'{schema.name}_v{schema.version}')
+def test_messages_round_trip(schema, encoding):
+    message = _message(schema)
+
+    assert decode(encode(message, schema, encoding)) == message
+
+
+def test_struct_round_trips_non_ascii_product_ids():
+    schema = SCHEMAS[(1, 1)]
+    message = _message(schema, product_id='€/Ξ')
+
+    assert decode(encode(message, schema, 'struct')) == message
+
+
+def test_decodes_old_plain_json_messages():
+    # what trade_producer and trade_to_ohlc sent before the wire format had a header
+    trade = {'product_id': 'BTC/USD', 'price': 64000.5, 'quantity': 0.1, 'timestamp_ms': 1_704_069_405_456}
+    candle = {
+        'product_id': 'BTC/USD', 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': 1.5,
+        'volume': 10.0, 'timestamp_ms': 1_704_069_420_000,
+    }
+
+    assert decode(json.dumps(trade).encode()) == trade
+    assert decode(json.dumps(candle, indent=2).encode()) == candle
+
+
+def test_struct_rejects_product_ids_over_255_bytes():
+    schema = SCHEMAS[(1, 1)]
+
+    with pytest.raises(ValueError, match='255 bytes'):
+        encode(_message(schema, product_id='X' * 256), schema, 'struct')
+
+    # 255 bytes still fit in the length prefix
+    message = _message(schema, product_id='X' * 255)
+    assert decode(encode(message, schema, 'struct')) == message
@@ -0,0 +1,541 @@
+import json
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.gap_fill import CandleGapFiller
+from src.wire_format import CANDLE_V4, decode, encode
+
+# the product index and the window index of a trade, packed in one int64 so that a
+# single running max tracks the latest window of every product
+_PRODUCT_SHIFT = 42
+
+
+class BatchCandleAggregator:
+    """
+    Builds OHLCV candles from chunks of trades with NumPy, instead of one trade at a time.
+
+    It gives the same candles as the streaming path (the tumbling windows of Quix
+    Streams, or CandleRollup with several window sizes):
+    - the trades of each product are taken in the order they come in
+    - windows are aligned on multiples of their size, and a candle is stamped with the
+      end of its window (`timestamp_ms`)
+    - a candle is only returned once a trade of a later window comes in. Until then it
+      is carried over to the next chunk
+    - trades of a window that is already closed (at the finest window size) are dropped
+    - the VWAP, the no. of trades and the realized variance are running sums too, so
+      the candles carried over merge exactly
+
+    With gap filling, the windows of a product can also be closed by the event time of
+    its partition (see `close`), like in CandleRollup.
+    """
+
+    def __init__(self, window_seconds: List[int]) -> None:
+        """
+        Args:
+            window_seconds (List[int]): The window sizes, in seconds.
+
+        Returns:
+            None
+        """
+        self.window_seconds = sorted(window_seconds)
+
+        # the open candle of each product, for each window size
+        self._open_candles: Dict[int, Dict[str, dict]] = {w: {} for w in self.window_seconds}
+
+        # the offset each product resumes from after a restart: its trades before it are
+        # already in candles we sent
+        self._resume_offsets: Dict[str, int] = {}
+
+    def add(
+        self,
+        product_id: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        timestamp_ms: np.ndarray,
+        offset: Optional[np.ndarray] = None,
+        until_ms: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Adds a chunk of trades, in the order they came in.
+
+        Args:
+            product_id (np.ndarray): The product of each trade.
+            price (np.ndarray): The price of each trade.
+            quantity (np.ndarray): The quantity of each trade.
+            timestamp_ms (np.ndarray): The timestamp of each trade, in milliseconds.
+            offset (Optional[np.ndarray]): The Kafka offset of each trade, to know which
+                trades the open candles still need (see `first_offsets`), and which
+                trades we read again after a restart (see `resume_from`).
+            until_ms (Optional[np.ndarray]): With gap filling, the time up to which the
+                windows of the partition of each trade are closed, when it came in (see
+                `close`). The trades of those windows are dropped.
+
+        Returns:
+            List[dict]: The candles the chunk closed, the finest ones first.
+        """
+        if len(product_id) == 0:
+            return []
+
+        products, product_index = np.unique(np.asarray(product_id), return_inverse=True)
+        if offset is None:
+            offset = np.full(len(product_id), -1, dtype=np.int64)
+        if until_ms is None:
+            until_ms = np.zeros(len(product_id), dtype=np.int64)
+
+        # group the trades by product, keeping their order within each product
+        order = np.argsort(product_index, kind='stable')
+        product_index = product_index[order].astype(np.int64)
+        price = np.asarray(price, dtype=np.float64)[order]
+        quantity = np.asarray(quantity, dtype=np.float64)[order]
+        timestamp_ms = np.asarray(timestamp_ms, dtype=np.int64)[order]
+        offset = np.asarray(offset, dtype=np.int64)[order]
+        until_ms = np.asarray(until_ms, dtype=np.int64)[order]
+
+        # drop the trades we read again after a restart, that are already in sent candles
+        resume_offset = np.array(
+            [self._resume_offsets.get(p, -1) for p in products], dtype=np.int64
+        )
+        is_new = offset >= resume_offset[product_index]
+        if not is_new.all():
+            logger.debug(f'Dropping {(~is_new).sum()} trades already in sent candles')
+            product_index, price, quantity, timestamp_ms, offset, until_ms = (
+                a[is_new]
+                for a in (product_index, price, quantity, timestamp_ms, offset, until_ms)
+            )
+
+        # drop the late trades: those before the latest window of their product so far,
+        # including the window of the candle carried over from the previous chunk, and
+        # those of the windows closed by the event time of their partition
+        finest_ms = self.window_seconds[0] * 1000
+        open_finest = self._open_candles[self.window_seconds[0]]
+        carried_window = np.array(
+            [open_finest[p]['start'] // finest_ms if p in open_finest else 0 for p in products],
+            dtype=np.int64,
+        )
+        window = (product_index << _PRODUCT_SHIFT) + timestamp_ms // finest_ms
+        latest = np.maximum(
+            np.maximum.accumulate(window),
+            (product_index << _PRODUCT_SHIFT) + carried_window[product_index],
+        )
+        on_time = (window >= latest) & (timestamp_ms // finest_ms >= until_ms // finest_ms)
+        if not on_time.all():
+            logger.debug(f'Dropping {(~on_time).sum()} late trades')
+            product_index, price, quantity, timestamp_ms, offset = (
+                a[on_time] for a in (product_index, price, quantity, timestamp_ms, offset)
+            )
+
+        closed = []
+        for window_seconds in self.window_seconds:
+            closed += self._add_window_size(
+                window_seconds, products, product_index, price, quantity, timestamp_ms, offset
+            )
+
+        return closed
+
+    def _add_window_size(
+        self,
+        window_seconds: int,
+        products: np.ndarray,
+        product_index: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        timestamp_ms: np.ndarray,
+        offset: np.ndarray,
+    ) -> List[dict]:
+        """
+        Builds the candles of one window size from the trades of the chunk, grouped by
+        product, and merges them with the candles carried over.
+        """
+        if len(price) == 0:
+            return []
+
+        window_ms = window_seconds * 1000
+        start = timestamp_ms - timestamp_ms % window_ms
+
+        # one run of consecutive trades per (product, window)
+        is_first = np.ones(len(price), dtype=bool)
+        is_first[1:] = (product_index[1:] != product_index[:-1]) | (start[1:] != start[:-1])
+        first = np.flatnonzero(is_first)
+        last = np.r_[first[1:], len(price)] - 1
+
+        # the squared log returns from trade to trade, without those across two runs
+        squared_returns = np.zeros(len(price))
+        squared_returns[1:] = np.diff(np.log(price)) ** 2
+        squared_returns[first] = 0.0
+
+        runs = {
+            'product': product_index[first],
+            'start': start[first],
+            'open': price[first],
+            'high': np.maximum.reduceat(price, first),
+            'low': np.minimum.reduceat(price, first),
+            'close': price[last],
+            'volume': np.add.reduceat(quantity, first),
+            'pv': np.add.reduceat(price * quantity, first),
+            'n_trades': last - first + 1,
+            'realized_variance': np.add.reduceat(squared_returns, first),
+            'first_offset': offset[first],
+        }
+        # plain Python values, for the messages and the carried candles
+        runs = {name: values.tolist() for name, values in runs.items()}
+
+        products = products.tolist()
+        open_candles = self._open_candles[window_seconds]
+        closed = []
+        for i in range(len(first)):
+            product_id = products[runs['product'][i]]
+            candle = {name: runs[name][i] for name in runs if name != 'product'}
+
+            carried = open_candles.pop(product_id, None)
+            if carried is not None:
+                if carried['start'] == candle['start']:
+                    candle = _merge(carried, candle)
+                else:
+                    closed.append(self._to_message(carried, window_seconds, product_id))
+
+            is_last_of_product = i == len(first) - 1 or runs['product'][i + 1] != runs['product'][i]
+            if is_last_of_product:
+                open_candles[product_id] = candle
+            else:
+                closed.append(self._to_message(candle, window_seconds, product_id))
+
+        return closed
+
+    def close(self, until_ms: Dict[str, int]) -> List[dict]:
+        """
+        Closes the open candles of each product whose window ends by its `until_ms`, e.g.
+        the event time of its partition, also when the product has no later trade. Its
+        later trades of those windows are dropped when `add` gets the same `until_ms`.
+
+        Args:
+            until_ms (Dict[str, int]): The time up to which the windows of each product
+                are closed.
+
+        Returns:
+            List[dict]: The candles closed, the finest ones first.
+        """
+        closed = []
+        for window_seconds in self.window_seconds:
+            window_ms = window_seconds * 1000
+            open_candles = self._open_candles[window_seconds]
+            for product_id, candle in list(open_candles.items()):
+                if candle['start'] + window_ms <= until_ms.get(product_id, candle['start']):
+                    closed.append(self._to_message(candle, window_seconds, product_id))
+                    del open_candles[product_id]
+        return closed
+
+    def first_offsets(self) -> Dict[str, int]:
+        """
+        Returns, for each product, the offset of the first trade of its open candles.
+        The trades from there on are needed to rebuild the open candles after a restart.
+        """
+        first_offsets: Dict[str, int] = {}
+        for open_candles in self._open_candles.values():
+            for product_id, candle in open_candles.items():
+                first_offsets[product_id] = min(
+                    first_offsets.get(product_id, candle['first_offset']), candle['first_offset']
+                )
+        return first_offsets
+
+    def resume_from(self, resume_offsets: Dict[str, int]) -> None:
+        """
+        Sets, for each product, the offset of the first trade its open candles needed
+        when we stopped (the `first_offsets` we committed). The trades of the product
+        before it are dropped: the candles they belong to are already sent.
+        """
+        self._resume_offsets.update(resume_offsets)
+
+    def drop(self, product_ids: List[str]) -> None:
+        """
+        Forgets the open candles of the products, e.g. when another consumer takes over
+        their partition.
+        """
+        for open_candles in self._open_candles.values():
+            for product_id in product_ids:
+                open_candles.pop(product_id, None)
+        for product_id in product_ids:
+            self._resume_offsets.pop(product_id, None)
+
+    def watermarks(self) -> Dict[str, int]:
+        """
+        Returns, for each product, the start of its open window. Every window of the
+        product that ends by then is closed.
+        """
+        return {
+            product_id: candle['start']
+            for product_id, candle in self._open_candles[self.window_seconds[0]].items()
+        }
+
+    def _to_message(self, candle: dict, window_seconds: int, product_id: str) -> dict:
+        return {
+            'product_id': product_id,
+            'timestamp_ms': candle['start'] + window_seconds * 1000,
+            'open': candle['open'],
+            'high': candle['high'],
+            'low': candle['low'],
+            'close': candle['close'],
+            'volume': candle['volume'],
+            'vwap': candle['pv'] / candle['volume'] if candle['volume'] > 0 else candle['close'],
+            'n_trades': candle['n_trades'],
+            'realized_variance': candle['realized_variance'],
+            'window_seconds': window_seconds,
+            'is_final': True,
+        }
+
+
+def _merge(carried: dict, candle: dict) -> dict:
+    """
+    Merges the candle of a window with the candle of the same window carried over.
+    """
+    return {
+        'start': carried['start'],
+        'open': carried['open'],
+        'high': max(carried['high'], candle['high']),
+        'low': min(carried['low'], candle['low']),
+        'close': candle['close'],
+        'volume': carried['volume'] + candle['volume'],
+        'pv': carried['pv'] + candle['pv'],
+        'n_trades': carried['n_trades'] + candle['n_trades'],
+        # the log return between the two parts of the window counts too
+        'realized_variance': (
+            carried['realized_variance']
+            + math.log(candle['open'] / carried['close']) ** 2
+            + candle['realized_variance']
+        ),
+        'first_offset': carried['first_offset'],
+    }
+
+
+def transform_trade_to_ohlcv_batch(
+    app,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    window_seconds: List[int],
+    kafka_output_topic_encoding: str = 'json',
+    batch_max_messages: int = 100_000,
+    batch_timeout_sec: float = 1.0,
+    gap_fill: bool = False,
+    gap_fill_grace_ms: int = 0,
+) -> None:
+    """
+    Batch mode of trade_to_ohlc, for topics with a lot of trades to catch up on, like
+    the historical trades of a backfill. Reads the trades in chunks of up to
+    `batch_max_messages`, builds their candles with BatchCandleAggregator and sends
+    them to the output topic.
+
+    After each chunk we flush the candles and commit, for each partition, the offset of
+    the first trade the open candles still need. The products share the partitions, so
+    a restart reads again trades of other products whose candles are already sent. The
+    commit carries, in its metadata, the first offset each product of the partition
+    still needs, and the trades of the product before it are dropped. What a restart
+    may send twice, with the same values, are the finer candles of a product that
+    closed while one of its coarser candles was still open. With `gap_fill`, the last
+    candle of each product is only kept in memory, so the empty windows right before a
+    restart are not filled.
+
+    With `gap_fill`, the windows of every product also close on the event time of its
+    partition, the latest trade of any of its products minus `gap_fill_grace_ms`, so a
+    quiet product keeps getting candles while the others trade (as in streaming mode).
+
+    Several consumers in the same group can share the partitions (see src/workers.py).
+    When a partition is revoked, we forget its trades and its open candles: the consumer
+    that takes over reads them again from the committed offsets.
+
+    Args:
+        app (Application): The Quix Streams application, with the consumer group.
+        kafka_input_topic (str): The topic of the trades.
+        kafka_output_topic (str): The topic of the candles.
+        window_seconds (List[int]): The window sizes, in seconds.
+        kafka_output_topic_encoding (str): Wire format of the candles.
+        batch_max_messages (int): Max no. of trades in a chunk.
+        batch_timeout_sec (float): Max no. of seconds we wait to fill a chunk.
+        gap_fill (bool): Also send the candles of the empty windows (see src/gap_fill.py).
+        gap_fill_grace_ms (int): With `gap_fill`, how far behind the latest trade of its
+            partition a trade can be and still count.
+
+    Returns:
+        None
+    """
+    from confluent_kafka import TopicPartition
+
+    aggregator = BatchCandleAggregator(window_seconds)
+    gap_filler = CandleGapFiller(window_seconds) if gap_fill else None
+
+    # the last candle of each product, for each window size, to fill the gaps from
+    last_candles: Dict[str, Dict[str, dict]] = {}
+
+    # the partition of each product, to commit the offsets of its open candles
+    product_partition: Dict[str, int] = {}
+
+    # with gap filling, the time up to which the windows of each partition are closed
+    partition_until_ms: Dict[int, int] = {}
+
+    # the chunk of trades we are polling
+    messages: list = []
+
+    def on_assign(consumer, partitions: list) -> None:
+        """
+        Loads the first offset each product of the partitions still needs, from the
+        metadata of their last commit
+        """
+        for tp in consumer.committed(partitions):
+            if not tp.metadata:
+                continue
+            resume_offsets = json.loads(tp.metadata)
+            aggregator.resume_from(resume_offsets)
+            for product_id in resume_offsets:
+                product_partition[product_id] = tp.partition
+
+    def on_revoke(consumer, partitions: list) -> None:
+        """
+        Forgets the trades and the open candles of the partitions we lost
+        """
+        revoked = {tp.partition for tp in partitions}
+        logger.info(f'Partitions {sorted(revoked)} of {kafka_input_topic} revoked')
+
+        messages[:] = [msg for msg in messages if msg.partition() not in revoked]
+        products = [p for p, partition in product_partition.items() if partition in revoked]
+        aggregator.drop(products)
+        for product_id in products:
+            del product_partition[product_id]
+            last_candles.pop(product_id, None)
+        for partition in revoked:
+            partition_until_ms.pop(partition, None)
+
+    with app.get_consumer(auto_commit_enable=False) as consumer, app.get_producer() as producer:
+        consumer.subscribe(
+            topics=[kafka_input_topic],
+            on_assign=on_assign,
+            on_revoke=on_revoke,
+            on_lost=on_revoke,
+        )
+
+        while True:
+            messages.clear()
+            _poll_chunk(consumer, messages, batch_max_messages, batch_timeout_sec)
+            if not messages:
+                continue
+
+            trades = [decode(msg.value()) for msg in messages]
+            for msg, trade in zip(messages, trades):
+                product_partition[trade['product_id']] = msg.partition()
+
+            until_ms = None
+            if gap_filler is not None:
+                # the event time of the partition of each trade, when it came in
+                until_ms = np.array([
+                    _advance(
+                        partition_until_ms, msg.partition(), trade['timestamp_ms'] - gap_fill_grace_ms
+                    )
+                    for msg, trade in zip(messages, trades)
+                ])
+
+            candles = aggregator.add(
+                product_id=np.array([trade['product_id'] for trade in trades]),
+                price=np.array([trade['price'] for trade in trades]),
+                quantity=np.array([trade['quantity'] for trade in trades]),
+                timestamp_ms=np.array([trade['timestamp_ms'] for trade in trades]),
+                offset=np.array([msg.offset() for msg in messages]),
+                until_ms=until_ms,
+            )
+            if gap_filler is not None:
+                product_until_ms = {
+                    product_id: partition_until_ms[partition]
+                    for product_id, partition in product_partition.items()
+                    if partition in partition_until_ms
+                }
+                candles += aggregator.close(product_until_ms)
+                watermarks = aggregator.watermarks()
+                for product_id, product_until in product_until_ms.items():
+                    watermarks[product_id] = max(watermarks.get(product_id, 0), product_until)
+                candles = _fill_gaps(gap_filler, last_candles, candles, watermarks)
+
+            for candle in candles:
+                producer.produce(
+                    topic=kafka_output_topic,
+                    key=candle['product_id'],
+                    value=encode(candle, CANDLE_V4, kafka_output_topic_encoding),
+                )
+            producer.flush()
+
+            # resume from the next trade, or from the first trade of an open candle
+            next_offsets: Dict[int, int] = {}
+            for msg in messages:
+                next_offsets[msg.partition()] = msg.offset() + 1
+            # a product without open candles needs none of the trades read so far
+            first_offsets: Dict[int, Dict[str, int]] = defaultdict(dict)
+            for product_id, partition in product_partition.items():
+                if partition in next_offsets:
+                    first_offsets[partition][product_id] = next_offsets[partition]
+            for product_id, first_offset in aggregator.first_offsets().items():
+                partition = product_partition[product_id]
+                if partition in next_offsets:
+                    next_offsets[partition] = min(next_offsets[partition], first_offset)
+                    first_offsets[partition][product_id] = first_offset
+
+            consumer.commit(
+                offsets=[
+                    TopicPartition(
+                        kafka_input_topic,
+                        partition,
+                        offset,
+                        metadata=json.dumps(first_offsets[partition]),
+                    )
+                    for partition, offset in next_offsets.items()
+                ],
+                asynchronous=False,
+            )
+            logger.debug(f'{len(messages)} trades -> {len(candles)} candles')
+
+
+def _fill_gaps(
+    gap_filler: CandleGapFiller,
+    last_candles: Dict[str, Dict[str, dict]],
+    candles: List[dict],
+    watermarks: Dict[str, int],
+) -> List[dict]:
+    """
+    Fills the empty windows of every product, up to its watermark.
+    """
+    candles_by_product = defaultdict(list)
+    for candle in candles:
+        candles_by_product[candle['product_id']].append(candle)
+
+    filled = []
+    for product_id, watermark_ms in watermarks.items():
+        filled += gap_filler.fill(
+            last_candles.setdefault(product_id, {}),
+            candles_by_product.get(product_id, []),
+            product_id,
+            watermark_ms,
+        )
+    return filled
+
+
+def _advance(until_ms: Dict[int, int], partition: int, timestamp_ms: int) -> int:
+    """
+    Moves the event time of the partition up to `timestamp_ms`, and returns it.
+    """
+    until_ms[partition] = max(until_ms.get(partition, 0), timestamp_ms)
+    return until_ms[partition]
+
+
+def _poll_chunk(consumer, messages: list, max_messages: int, timeout_sec: float) -> None:
+    """
+    Polls up to `max_messages` messages into `messages`, for at most `timeout_sec` seconds.
+    """
+    import time
+
+    deadline = time.monotonic() + timeout_sec
+    while len(messages) < max_messages and time.monotonic() < deadline:
+        msg = consumer.poll(0.1)
+        if msg is None:
+            continue
+        if msg.error():
+            logger.error(msg.error())
+            continue
+        messages.append(msg)
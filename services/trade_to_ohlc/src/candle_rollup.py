@@ -0,0 +1,230 @@
+import math
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+
+class CandleRollup:
+    """
+    Builds OHLCV candles of several window sizes, e.g. 1s, 1m, 5m and 1h, in one pass
+    over the trades of a product.
+
+    Only the finest candles are built from the trades. Each coarser candle is rolled up
+    from the closed candles of the next finer size, so a trade is only looked at once
+    whatever the number of window sizes.
+
+    Besides OHLCV, each candle keeps running sums, so every statistic is O(1) per trade
+    and rolls up exactly: the no. of trades, the VWAP (from the sum of price * quantity)
+    and the realized variance, the sum of the squared log returns from trade to trade.
+
+    The candles follow the same rules as the tumbling windows of Quix Streams:
+    - windows are aligned on multiples of their size, and a candle is stamped with the
+      end of its window (`timestamp_ms`)
+    - a candle is closed, and returned, when a trade of a later window arrives
+    - trades of a window that is already closed are dropped
+
+    With gap filling, the windows of a product can also be closed by the event time of
+    the other products (see `close`).
+    """
+
+    def __init__(self, window_seconds: List[int]) -> None:
+        """
+        Args:
+            window_seconds (List[int]): The window sizes, in seconds. Each of them must be
+                a multiple of the previous one, e.g. [1, 60, 300, 3600].
+
+        Returns:
+            None
+        """
+        window_seconds = sorted(window_seconds)
+        for finer, coarser in zip(window_seconds[:-1], window_seconds[1:]):
+            if coarser % finer != 0:
+                raise ValueError(
+                    f'Each window size must be a multiple of the previous one, but {coarser}s '
+                    f'is not a multiple of {finer}s'
+                )
+
+        self.window_seconds = window_seconds
+
+    def update(self, candles: Dict[str, Optional[dict]], trade: dict) -> List[dict]:
+        """
+        Adds the trade to the open candles of its product.
+
+        Args:
+            candles (Dict[str, Optional[dict]]): The open candle of each window size of the
+                product, by window size. Updated in place.
+            trade (dict): The trade, with price, quantity, timestamp_ms and product_id.
+
+        Returns:
+            List[dict]: The candles the trade closed, the finest ones first.
+        """
+        closed = []
+
+        # the candle closed at the finer window size, which goes into the coarser one
+        finer_candle = None
+
+        for i, window_seconds in enumerate(self.window_seconds):
+            window_ms = window_seconds * 1000
+            candle = candles.get(str(window_seconds))
+
+            if finer_candle is not None:
+                candle = _merge(candle, finer_candle, window_ms)
+
+            # the trade is in a later window: this candle is complete
+            finer_candle = None
+            trade_start = trade['timestamp_ms'] - trade['timestamp_ms'] % window_ms
+            if candle is not None and candle['start'] < trade_start:
+                closed.append(_to_message(candle, window_seconds, trade['product_id'], is_final=True))
+                finer_candle = candle
+                candle = None
+
+            if i == 0:
+                is_late = (candle is not None and trade_start < candle['start']) or (
+                    trade_start < candles.get('closed_until_ms', trade_start)
+                )
+                if is_late:
+                    logger.debug(f'Dropping a late trade of {trade["product_id"]}: {trade}')
+                    return closed
+
+                candle = _add_trade(candle, trade, trade_start)
+
+            candles[str(window_seconds)] = candle
+
+        return closed
+
+    def close(self, candles: Dict[str, Optional[dict]], product_id: str, until_ms: int) -> List[dict]:
+        """
+        Closes the open candles of a product whose window ends by `until_ms`, e.g. the
+        event time of its partition, also when the product has no later trade. Its
+        trades of those windows that come in after are dropped.
+
+        Args:
+            candles (Dict[str, Optional[dict]]): The open candle of each window size of the
+                product, by window size. Updated in place.
+            product_id (str): The product.
+            until_ms (int): The time up to which the windows are closed.
+
+        Returns:
+            List[dict]: The candles closed, the finest ones first.
+        """
+        closed = []
+
+        finer_candle = None
+        for window_seconds in self.window_seconds:
+            window_ms = window_seconds * 1000
+            candle = candles.get(str(window_seconds))
+
+            if finer_candle is not None:
+                candle = _merge(candle, finer_candle, window_ms)
+
+            finer_candle = None
+            if candle is not None and candle['start'] + window_ms <= until_ms:
+                closed.append(_to_message(candle, window_seconds, product_id, is_final=True))
+                finer_candle = candle
+                candle = None
+
+            candles[str(window_seconds)] = candle
+
+        finest_ms = self.window_seconds[0] * 1000
+        candles['closed_until_ms'] = max(
+            candles.get('closed_until_ms', 0), until_ms - until_ms % finest_ms
+        )
+        return closed
+
+    def in_progress(self, candles: Dict[str, Optional[dict]], product_id: str) -> List[dict]:
+        """
+        Returns the candles of the windows that are still open, as they are so far.
+
+        A coarser open candle only holds the closed candles of the next finer size, so
+        we merge it with the open candles of every finer size, which come after it.
+
+        Args:
+            candles (Dict[str, Optional[dict]]): The open candle of each window size of the
+                product, by window size.
+            product_id (str): The product.
+
+        Returns:
+            List[dict]: The in-progress candles, the finest ones first.
+        """
+        in_progress = []
+
+        # the finer open candles, merged, in time order
+        finer_candle = None
+
+        for window_seconds in self.window_seconds:
+            candle = candles.get(str(window_seconds))
+            if finer_candle is not None:
+                # on a copy, the open candle itself only takes closed candles
+                candle = _merge(
+                    dict(candle) if candle is not None else None, finer_candle, window_seconds * 1000
+                )
+
+            if candle is not None:
+                in_progress.append(_to_message(candle, window_seconds, product_id, is_final=False))
+            finer_candle = candle
+
+        return in_progress
+
+
+def _add_trade(candle: Optional[dict], trade: dict, start: int) -> dict:
+    if candle is None:
+        return {
+            'start': start,
+            'open': trade['price'],
+            'high': trade['price'],
+            'low': trade['price'],
+            'close': trade['price'],
+            'volume': trade['quantity'],
+            'pv': trade['price'] * trade['quantity'],
+            'n_trades': 1,
+            'realized_variance': 0.0,
+        }
+
+    candle['realized_variance'] += math.log(trade['price'] / candle['close']) ** 2
+    candle['high'] = max(candle['high'], trade['price'])
+    candle['low'] = min(candle['low'], trade['price'])
+    candle['close'] = trade['price']
+    candle['volume'] += trade['quantity']
+    candle['pv'] += trade['price'] * trade['quantity']
+    candle['n_trades'] += 1
+    return candle
+
+
+def _merge(candle: Optional[dict], finer_candle: dict, window_ms: int) -> dict:
+    """
+    Rolls a closed finer candle up into the candle of the coarser window it belongs to.
+    """
+    if candle is None:
+        return {
+            **finer_candle,
+            'start': finer_candle['start'] - finer_candle['start'] % window_ms,
+        }
+
+    # the log return between the two candles counts too
+    candle['realized_variance'] += (
+        math.log(finer_candle['open'] / candle['close']) ** 2 + finer_candle['realized_variance']
+    )
+    candle['high'] = max(candle['high'], finer_candle['high'])
+    candle['low'] = min(candle['low'], finer_candle['low'])
+    candle['close'] = finer_candle['close']
+    candle['volume'] += finer_candle['volume']
+    candle['pv'] += finer_candle['pv']
+    candle['n_trades'] += finer_candle['n_trades']
+    return candle
+
+
+def _to_message(candle: dict, window_seconds: int, product_id: str, is_final: bool) -> dict:
+    return {
+        'product_id': product_id,
+        'timestamp_ms': candle['start'] + window_seconds * 1000,
+        'open': candle['open'],
+        'high': candle['high'],
+        'low': candle['low'],
+        'close': candle['close'],
+        'volume': candle['volume'],
+        'vwap': candle['pv'] / candle['volume'] if candle['volume'] > 0 else candle['close'],
+        'n_trades': candle['n_trades'],
+        'realized_variance': candle['realized_variance'],
+        'window_seconds': window_seconds,
+        'is_final': is_final,
+    }
@@ -1,5 +1,6 @@
-from typing import Optional
+from typing import List, Optional, Union
 
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
@@ -8,7 +9,41 @@ class AppConfig(BaseSettings):
     kafka_input_topic: str
     kafka_output_topic: str
     kafka_consumer_group: str
-    ohlcv_window_seconds: int
+    # one window size, e.g. OHLCV_WINDOW_SECONDS=60, or a JSON list of them, e.g.
+    # OHLCV_WINDOW_SECONDS='[1, 60, 300, 3600]', each a multiple of the previous one.
+    # Several sizes go to the same output topic, tagged with their window_seconds
+    ohlcv_window_seconds: Union[int, List[int]]
+    # wire format of the candles we produce: 'json' (the default), 'msgpack' or 'struct'
+    kafka_output_topic_encoding: Optional[str] = 'json'
+    # 'streaming' (one trade at a time) or 'batch' (chunks of up to batch_max_messages
+    # trades aggregated with NumPy, for the historical trades). Same candles either way
+    processing_mode: Optional[str] = 'streaming'
+    batch_max_messages: Optional[int] = 100_000
+    batch_timeout_sec: Optional[float] = 1.0
+    # also send the in-progress candles (is_final=False), at most every
+    # provisional_interval_ms per product, and/or every provisional_every_n_trades trades.
+    # The closed candles are sent as before, with is_final=True
+    provisional_interval_ms: Optional[int] = None
+    provisional_every_n_trades: Optional[int] = None
+    # also send a forward-filled, zero-volume candle (n_trades=0) for every window of a
+    # product without trades, so each product has a dense series of candles
+    gap_fill: Optional[bool] = False
+    # with gap_fill, the windows of a product also close on the event time of its
+    # partition (the latest trade of any product). A trade up to gap_fill_grace_ms behind
+    # it still counts, the later ones are dropped
+    gap_fill_grace_ms: Optional[int] = 0
+
+    # no. of worker processes, in the same consumer group. Each one gets a share of the
+    # partitions of the input topic, so there should be at least as many partitions
+    num_workers: Optional[int] = 1
+    # no. of times a worker is restarted before we give up
+    max_worker_restarts: Optional[int] = 5
+    # no. of partitions of the input and output topics, when we create them
+    kafka_topic_partitions: Optional[int] = None
+    # where a new consumer group starts reading the trades: 'latest' or 'earliest'
+    auto_offset_reset: Optional[str] = 'latest'
+    # where the workers keep their state (the open candles), one directory each
+    state_dir: Optional[str] = 'state'
    
     # this is the first time I use this construct to load the environment variables from
     # an .env file
@@ -18,6 +53,13 @@ class AppConfig(BaseSettings):
     # ```
     # model_config = {'env_file': '.env'}
     # ```
+    @field_validator('ohlcv_window_seconds')
+    @classmethod
+    def _window_seconds_as_list(cls, value: Union[int, List[int]]) -> List[int]:
+        if isinstance(value, int):
+            return [value]
+        return value
+
     class Config:
         env_file = ".env"
 
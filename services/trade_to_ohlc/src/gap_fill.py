@@ -0,0 +1,211 @@
+from typing import Any, Callable, Dict, List
+
+from src.candle_rollup import CandleRollup
+
+
+class CandleGapFiller:
+    """
+    Makes the candle series of each product dense: one candle for every closed window,
+    also for the windows without trades.
+
+    The candle of an empty window is forward-filled from the last candle of the product:
+    open, high, low, close and vwap are its close, and volume, n_trades and
+    realized_variance are 0. `n_trades == 0` tells them apart from the real candles.
+
+    The windows of a product close when a trade of a later window comes in, or when the
+    event time of its partition, the latest trade of any of its products, is past them
+    (see PartitionGapFiller). Its watermark is the later of the two. For each product
+    and window size we only keep the last candle we sent (its `timestamp_ms` and
+    `close`), so the memory stays the same whatever the no. of candles.
+    """
+
+    def __init__(self, window_seconds: List[int]) -> None:
+        """
+        Args:
+            window_seconds (List[int]): The window sizes of the candles, in seconds.
+
+        Returns:
+            None
+        """
+        self.window_seconds = sorted(window_seconds)
+
+    def fill(
+        self,
+        last_candles: Dict[str, dict],
+        closed: List[dict],
+        product_id: str,
+        watermark_ms: int,
+    ) -> List[dict]:
+        """
+        Adds the candles of the empty windows of a product before its closed candles,
+        and after them up to its watermark.
+
+        Args:
+            last_candles (Dict[str, dict]): The last candle we sent of each window size of
+                the product, by window size. Updated in place.
+            closed (List[dict]): The final candles of the product, in time order for each
+                window size.
+            product_id (str): The product.
+            watermark_ms (int): The start of the open window of the product, or the event
+                time of its partition if later. Every window that ends by then is closed.
+
+        Returns:
+            List[dict]: The closed candles, with the empty windows filled.
+        """
+        filled = []
+
+        for candle in closed:
+            # the windows between the last candle and this one
+            window_ms = candle['window_seconds'] * 1000
+            filled += self._empty_candles(
+                last_candles, candle['window_seconds'], product_id, until_ms=candle['timestamp_ms'] - window_ms
+            )
+            filled.append(candle)
+            last_candles[str(candle['window_seconds'])] = {
+                'timestamp_ms': candle['timestamp_ms'],
+                'close': candle['close'],
+            }
+
+        # the windows that closed since, without a trade
+        for window_seconds in self.window_seconds:
+            window_ms = window_seconds * 1000
+            filled += self._empty_candles(
+                last_candles, window_seconds, product_id, until_ms=watermark_ms - watermark_ms % window_ms
+            )
+
+        return filled
+
+    def _empty_candles(
+        self, last_candles: Dict[str, dict], window_seconds: int, product_id: str, until_ms: int
+    ) -> List[dict]:
+        """
+        Returns the candles of the windows after the last candle of this window size,
+        that end by `until_ms`, and moves the last candle to the last of them.
+        """
+        last = last_candles.get(str(window_seconds))
+        if last is None:
+            # nothing to fill from before the first candle of the product
+            return []
+
+        window_ms = window_seconds * 1000
+        close = last['close']
+        empty = [
+            {
+                'product_id': product_id,
+                'timestamp_ms': timestamp_ms,
+                'open': close,
+                'high': close,
+                'low': close,
+                'close': close,
+                'volume': 0.0,
+                'vwap': close,
+                'n_trades': 0,
+                'realized_variance': 0.0,
+                'window_seconds': window_seconds,
+                'is_final': True,
+            }
+            for timestamp_ms in range(last['timestamp_ms'] + window_ms, until_ms + 1, window_ms)
+        ]
+
+        if empty:
+            last['timestamp_ms'] = empty[-1]['timestamp_ms']
+        return empty
+
+
+class PartitionGapFiller:
+    """
+    Gap filling in streaming mode, where the open candles of each product are in the
+    state of its key.
+
+    The event time of a partition is the latest trade of any of its products, minus a
+    grace period. Each time it reaches a new window, we close the open candles of every
+    product of the partition that end by then and fill its empty windows up to it, so a
+    quiet product keeps getting candles while the others trade. The trades of a closed
+    window that come in after are dropped, like late trades.
+
+    Gives the same candles as the batch mode with `gap_fill` (see src/batch_ohlc.py).
+    """
+
+    def __init__(self, rollup: CandleRollup, grace_ms: int = 0) -> None:
+        """
+        Args:
+            rollup (CandleRollup): Builds the candles of the products.
+            grace_ms (int): How far behind the latest trade of its partition a trade can
+                be and still count.
+
+        Returns:
+            None
+        """
+        self.rollup = rollup
+        self.gap_filler = CandleGapFiller(rollup.window_seconds)
+        self.grace_ms = grace_ms
+
+    def update(
+        self,
+        trade: dict,
+        state: Any,
+        partition_state: Any,
+        state_of: Callable[[str], Any],
+    ) -> List[dict]:
+        """
+        Adds the trade to the open candles of its product, and closes and fills the
+        windows of the products of the partition up to its event time.
+
+        Args:
+            trade (dict): The trade.
+            state (State): The state of the product of the trade: its open candles
+                ('candles') and the last candle we sent of each window size ('last_candles').
+            partition_state (State): The state of the partition: its event time
+                ('until_ms') and its products ('products').
+            state_of (Callable[[str], State]): The state of another product of the partition.
+
+        Returns:
+            List[dict]: The candles closed, with the empty windows filled.
+        """
+        product_id = trade['product_id']
+        finest_ms = self.rollup.window_seconds[0] * 1000
+
+        # the trades of the windows the event time closed are late, for a new product too
+        last_until_ms = partition_state.get('until_ms', 0)
+        candles = state.get('candles', {})
+        candles['closed_until_ms'] = max(
+            candles.get('closed_until_ms', 0), last_until_ms - last_until_ms % finest_ms
+        )
+        closed = self.rollup.update(candles, trade)
+
+        until_ms = max(last_until_ms, trade['timestamp_ms'] - self.grace_ms)
+        partition_state.set('until_ms', until_ms)
+        products = partition_state.get('products', [])
+        if product_id not in products:
+            partition_state.set('products', products + [product_id])
+
+        filled = self._close_and_fill(state, candles, closed, product_id, until_ms)
+
+        # the other products, once the event time is in a new window
+        if until_ms // finest_ms > last_until_ms // finest_ms:
+            for other in products:
+                if other != product_id:
+                    other_state = state_of(other)
+                    filled += self._close_and_fill(
+                        other_state, other_state.get('candles', {}), [], other, until_ms
+                    )
+
+        return filled
+
+    def _close_and_fill(
+        self, state: Any, candles: Dict[str, dict], closed: List[dict], product_id: str, until_ms: int
+    ) -> List[dict]:
+        """
+        Closes the candles of the product that end by `until_ms`, and fills its empty
+        windows up to its watermark.
+        """
+        closed = closed + self.rollup.close(candles, product_id, until_ms)
+        state.set('candles', candles)
+
+        open_finest = candles.get(str(self.rollup.window_seconds[0]))
+        watermark_ms = max(open_finest['start'] if open_finest is not None else 0, until_ms)
+
+        last_candles = state.get('last_candles', {})
+        filled = self.gap_filler.fill(last_candles, closed, product_id, watermark_ms)
+        state.set('last_candles', last_candles)
+        return filled
@@ -1,26 +1,75 @@
+import math
+import time
 from datetime import timedelta
 from loguru import logger
 from quixstreams import Application
+from quixstreams.models.topics import TopicConfig
 
-from typing import Any, Optional, List, Tuple
+from src.candle_rollup import CandleRollup
+from src.gap_fill import PartitionGapFiller
+from src.wire_format import CANDLE_V4, WireDeserializer, WireSerializer
+
+from typing import Any, Optional, List, Tuple, Union
 
 def transform_trade_to_ohlcv(
     kafka_broker_address: str,
     kafka_input_topic: str,
     kafka_output_topic: str,
-    ohlcv_window_seconds: int,
-    kafka_consumer_group: str
+    ohlcv_window_seconds: Union[int, List[int]],
+    kafka_consumer_group: str,
+    kafka_output_topic_encoding: str = 'json',
+    processing_mode: str = 'streaming',
+    batch_max_messages: int = 100_000,
+    batch_timeout_sec: float = 1.0,
+    provisional_interval_ms: Optional[int] = None,
+    provisional_every_n_trades: Optional[int] = None,
+    gap_fill: bool = False,
+    gap_fill_grace_ms: int = 0,
+    kafka_topic_partitions: Optional[int] = None,
+    auto_offset_reset: str = 'latest',
+    state_dir: str = 'state',
 ) -> None:
     """
     Reads trades from redpanda topic
     Aggregates them into OHLC candles using the window size in 'ohlc_window_seconds'
     Sends aggregated candles to output redpanda topic
 
+    Each candle also has the VWAP, the no. of trades and the realized variance (the sum
+    of the squared log returns from trade to trade) of its window, its `window_seconds`
+    and whether it is final.
+
+    With several window sizes, e.g. [1, 60, 300, 3600], the candles of every size are
+    built in one pass over the trades (see src/candle_rollup.py) and sent to the same
+    output topic, each one tagged with its `window_seconds`.
+
     Args:
         kafka_broker_address(str): address of kafka broker
         kafak_input_topic(str): kafka topic to read trade data from
         kafak_output_topic(str): kafka topic to write aggregated candles to
-        ohlc_window_seconds(int): window size in seconds for OHLC aggregation
+        ohlc_window_seconds(Union[int, List[int]]): window size in seconds for OHLC aggregation,
+            or a list of them
+        kafka_output_topic_encoding(str): wire format of the candles, 'json', 'msgpack' or 'struct'.
+            Trades are read in whatever encoding they were produced with (see src/wire_format.py)
+        processing_mode(str): 'streaming' aggregates one trade at a time, 'batch' reads the
+            trades in chunks and aggregates them with NumPy (see src/batch_ohlc.py), e.g.
+            to catch up on the historical trades of a backfill. Both give the same candles
+        batch_max_messages(int): max no. of trades in a chunk, in batch mode
+        batch_timeout_sec(float): max no. of seconds we wait to fill a chunk, in batch mode
+        provisional_interval_ms(Optional[int]): also send the in-progress candles of a product,
+            at most once every `provisional_interval_ms` of wall-clock time
+        provisional_every_n_trades(Optional[int]): also send the in-progress candles of a
+            product every N trades. With both set, whichever comes first.
+            In-progress candles have `is_final` False, the closed ones `is_final` True
+        gap_fill(bool): also send a candle for every window of a product without trades,
+            forward-filled from its last candle, with no volume (see src/gap_fill.py), so
+            the series of every product is dense. The windows of a product also close on
+            the event time of its partition, the latest trade of any of its products
+        gap_fill_grace_ms(int): with gap_fill, how far behind the latest trade of its partition
+            a trade can be and still count
+        kafka_topic_partitions(Optional[int]): no. of partitions of the input and output topics,
+            if we create them. Up to that many workers can share the trades (see src/workers.py)
+        auto_offset_reset(str): where a new consumer group starts, 'latest' or 'earliest'
+        state_dir(str): where the state (the open candles) is kept
 
     Returns:
         None
@@ -29,6 +78,8 @@ def transform_trade_to_ohlcv(
     app = Application(
         broker_address=kafka_broker_address,
         consumer_group=kafka_consumer_group,
+        auto_offset_reset=auto_offset_reset,
+        state_dir=state_dir,
         #   auto_offset_reset="earliest", # process all msgs from the input topic when this service started
         #   auto_create_reset='latest' # forget about past msgs, process only one which come from this moment
     )
@@ -40,12 +91,101 @@ def transform_trade_to_ohlcv(
         return value['timestamp_ms']
 
 
-    input_topic = app.topic(name=kafka_input_topic, value_serializer='json', timestamp_extractor=custom_ts_extractor)
-    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+    if isinstance(ohlcv_window_seconds, int):
+        ohlcv_window_seconds = [ohlcv_window_seconds]
+    multi_resolution = len(ohlcv_window_seconds) > 1
+    provisional = provisional_interval_ms is not None or provisional_every_n_trades is not None
+
+    # new topics get `kafka_topic_partitions` partitions (on our single redpanda broker)
+    topic_config = (
+        TopicConfig(num_partitions=kafka_topic_partitions, replication_factor=1)
+        if kafka_topic_partitions
+        else None
+    )
+    input_topic = app.topic(name=kafka_input_topic, value_deserializer=WireDeserializer(), timestamp_extractor=custom_ts_extractor, config=topic_config)
+    output_topic = app.topic(name=kafka_output_topic, value_serializer=WireSerializer(CANDLE_V4, kafka_output_topic_encoding), config=topic_config)
+
+    if processing_mode == 'batch':
+        from src.batch_ohlc import transform_trade_to_ohlcv_batch
+
+        transform_trade_to_ohlcv_batch(
+            app,
+            kafka_input_topic=input_topic.name,
+            kafka_output_topic=output_topic.name,
+            window_seconds=ohlcv_window_seconds,
+            kafka_output_topic_encoding=kafka_output_topic_encoding,
+            batch_max_messages=batch_max_messages,
+            batch_timeout_sec=batch_timeout_sec,
+            gap_fill=gap_fill,
+            gap_fill_grace_ms=gap_fill_grace_ms,
+        )
+        return
+
+    if processing_mode != 'streaming':
+        raise ValueError(f"processing_mode must be 'streaming' or 'batch', but got {processing_mode}")
 
     ## create a streaming dataframe as per quixstream's docs
     sdf = app.dataframe(input_topic)
 
+    # the tumbling window of Quix Streams does not tell us when a product's windows
+    # close without a trade, so gap filling goes through CandleRollup too (same candles)
+    if multi_resolution or provisional or gap_fill:
+        rollup = CandleRollup(window_seconds=ohlcv_window_seconds)
+        gap_filler = PartitionGapFiller(rollup, grace_ms=gap_fill_grace_ms) if gap_fill else None
+        logger.info(f"Building candles of {rollup.window_seconds} seconds in one pass")
+
+        def update_candles(trade: dict, state) -> List[dict]:
+            """
+            Updates the open candles of the trade's product, kept in the state of its
+            key, and returns the candles the trade closed, and the in-progress candles
+            if they are due
+            """
+            if gap_filler is not None:
+                # the states of the other products of the partition, keyed by product id
+                # like the trades, are in the same store transaction. The partition's own
+                # state is under the empty prefix
+                transaction = state._transaction
+                closed = gap_filler.update(
+                    trade,
+                    state,
+                    partition_state=transaction.as_state(prefix=b''),
+                    state_of=lambda product_id: transaction.as_state(prefix=product_id.encode()),
+                )
+                candles = state.get('candles')
+            else:
+                candles = state.get('candles', {})
+                closed = rollup.update(candles, trade)
+                state.set('candles', candles)
+
+            if not provisional:
+                return closed
+
+            # throttle the in-progress candles of each product, by time and no. of trades
+            now_ms = int(time.time() * 1000)
+            n_trades = state.get('n_trades_since_update', 0) + 1
+            last_update_ms = state.get('last_update_ms', 0)
+            due = (
+                provisional_interval_ms is not None and now_ms - last_update_ms >= provisional_interval_ms
+            ) or (
+                provisional_every_n_trades is not None and n_trades >= provisional_every_n_trades
+            )
+
+            if not due:
+                state.set('n_trades_since_update', n_trades)
+                return closed
+
+            state.set('n_trades_since_update', 0)
+            state.set('last_update_ms', now_ms)
+
+            return closed + rollup.in_progress(candles, trade['product_id'])
+
+        sdf = sdf.apply(update_candles, stateful=True, expand=True)
+        sdf.update(logger.debug)
+        # with gap filling, a trade also closes the candles of other products
+        sdf = sdf.to_topic(output_topic, key=lambda candle: candle['product_id'])
+        app.run(sdf)
+        return
+
     def init_ohlc_candle(trade: dict) -> dict:
         """
         Initializes OHLC candle
@@ -56,14 +196,21 @@ def transform_trade_to_ohlcv(
             'low': trade['price'],
             'close': trade['price'],
             'volume': trade['quantity'],
+            # running sums of the statistics, see to_candle()
+            'pv': trade['price'] * trade['quantity'],
+            'n_trades': 1,
+            'realized_variance': 0.0,
             'product_id': trade['product_id'],
             # 'timestamp': trade['timestamp'],
         }
 
     def update_ohlcv_candle(candle: dict, trade: dict) -> dict:
         """
-        Updates OHLC candle
+        Updates OHLC candle, and the statistics of its trades, in O(1)
         """
+        candle['realized_variance'] += math.log(trade['price'] / candle['close']) ** 2
+        candle['pv'] += trade['price'] * trade['quantity']
+        candle['n_trades'] += 1
         candle['high'] = max(candle['high'], trade['price'])
         candle['low'] = min(candle['low'], trade['price'])
         candle['close'] = trade['price']
@@ -72,22 +219,33 @@ def transform_trade_to_ohlcv(
 
         return candle
 
-    sdf = sdf.tumbling_window(duration_ms=timedelta(seconds=ohlcv_window_seconds))
+    sdf = sdf.tumbling_window(duration_ms=timedelta(seconds=ohlcv_window_seconds[0]))
     sdf = sdf.reduce(reducer=update_ohlcv_candle, initializer=init_ohlc_candle
     ).final()  # current()
     
     ## apply transformations -- end
 
-    sdf['open'] = sdf['value']['open']
-    sdf['high'] = sdf['value']['high']
-    sdf['low'] = sdf['value']['low']
-    sdf['close'] = sdf['value']['close']
-    sdf['volume'] = sdf['value']['volume']
-    sdf['product_id'] = sdf['value']['product_id']
-    sdf['timestamp_ms'] = sdf['end']
+    def to_candle(window: dict) -> dict:
+        """
+        Flattens a closed window into the candle we send, in one step
+        """
+        candle = window['value']
+        return {
+            'product_id': candle['product_id'],
+            'timestamp_ms': window['end'],
+            'open': candle['open'],
+            'high': candle['high'],
+            'low': candle['low'],
+            'close': candle['close'],
+            'volume': candle['volume'],
+            'vwap': candle['pv'] / candle['volume'] if candle['volume'] > 0 else candle['close'],
+            'n_trades': candle['n_trades'],
+            'realized_variance': candle['realized_variance'],
+            'window_seconds': ohlcv_window_seconds[0],
+            'is_final': True,
+        }
 
-    # keep only the columns we're interested in
-    sdf = sdf[['product_id','timestamp_ms', 'open', 'high', 'low', 'close', 'volume']]
+    sdf = sdf.apply(to_candle)
 
     # print the output to the console
     sdf.update(logger.debug)
@@ -101,15 +259,39 @@ def transform_trade_to_ohlcv(
 
 if __name__ == '__main__':
     from src.config import config
-    
-    transform_trade_to_ohlcv(
+
+    # the arguments of every worker
+    kwargs = dict(
         kafka_broker_address=config.kafka_broker_address,
         kafka_input_topic=config.kafka_input_topic,
         kafka_output_topic=config.kafka_output_topic,
         ohlcv_window_seconds=config.ohlcv_window_seconds,
-        kafka_consumer_group=config.kafka_consumer_group
+        kafka_consumer_group=config.kafka_consumer_group,
+        kafka_output_topic_encoding=config.kafka_output_topic_encoding,
+        processing_mode=config.processing_mode,
+        batch_max_messages=config.batch_max_messages,
+        batch_timeout_sec=config.batch_timeout_sec,
+        provisional_interval_ms=config.provisional_interval_ms,
+        provisional_every_n_trades=config.provisional_every_n_trades,
+        gap_fill=config.gap_fill,
+        gap_fill_grace_ms=config.gap_fill_grace_ms,
+        kafka_topic_partitions=config.kafka_topic_partitions,
+        auto_offset_reset=config.auto_offset_reset,
     )
 
+    if config.num_workers > 1:
+        from src.workers import run_workers
+
+        # one process per worker, in the same consumer group
+        run_workers(
+            num_workers=config.num_workers,
+            max_restarts=config.max_worker_restarts,
+            state_dir=config.state_dir,
+            **kwargs,
+        )
+    else:
+        transform_trade_to_ohlcv(state_dir=config.state_dir, **kwargs)
+
 
     
     
@@ -0,0 +1,105 @@
+import multiprocessing
+import signal
+import time
+from pathlib import Path
+
+from loguru import logger
+
+# seconds between two checks of the workers
+_SUPERVISOR_INTERVAL_SEC = 1.0
+
+# seconds a worker has to stop (commit, close its state) before we kill it
+_STOP_TIMEOUT_SEC = 30.0
+
+
+def run_workers(num_workers: int, max_restarts: int = 5, state_dir: str = 'state', **kwargs) -> None:
+    """
+    Runs `num_workers` trade_to_ohlc processes in the same consumer group, and restarts
+    the ones that stop.
+
+    Kafka gives each worker a share of the partitions of the input topic. The trades
+    are keyed by product_id, so all the trades of a product are in one partition and
+    one worker builds all its candles. With as many partitions as workers (or more),
+    every worker has work, and they use one core each.
+
+    Each worker keeps its state (the open candles) in its own directory under
+    `state_dir`. When a partition moves to another worker, e.g. after a restart, the
+    state of its products is restored from the changelog topic (in streaming mode), or
+    rebuilt from the trades after the committed offsets (in batch mode).
+
+    Args:
+        num_workers (int): The no. of worker processes.
+        max_restarts (int): The no. of times a worker can be restarted. After that we
+            stop them all and raise, so the container is restarted instead.
+        state_dir (str): The directory with the state of the workers.
+        kwargs: The arguments of each worker, see `transform_trade_to_ohlcv`.
+
+    Returns:
+        None
+    """
+    # fresh processes, without a copy of our Kafka clients or locks as `fork` would give
+    context = multiprocessing.get_context('spawn')
+
+    workers = {i: _start_worker(context, i, state_dir, kwargs) for i in range(num_workers)}
+    n_restarts = {i: 0 for i in range(num_workers)}
+
+    stopping = False
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        logger.info(f'Stopping the {num_workers} workers')
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        while not stopping:
+            for i, worker in workers.items():
+                if worker.is_alive():
+                    continue
+
+                # the workers run until we stop them, so this one crashed
+                if n_restarts[i] >= max_restarts:
+                    raise RuntimeError(
+                        f'Worker {i} stopped (exit code {worker.exitcode}) more than {max_restarts} times'
+                    )
+                n_restarts[i] += 1
+                logger.warning(
+                    f'Worker {i} stopped (exit code {worker.exitcode}), restarting it '
+                    f'({n_restarts[i]}/{max_restarts})'
+                )
+                workers[i] = _start_worker(context, i, state_dir, kwargs)
+
+            time.sleep(_SUPERVISOR_INTERVAL_SEC)
+    finally:
+        # SIGTERM lets each Quix Streams application commit and close its state
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers.values():
+            worker.join(timeout=_STOP_TIMEOUT_SEC)
+            if worker.is_alive():
+                logger.warning(f'Worker {worker.name} did not stop in {_STOP_TIMEOUT_SEC}s, killing it')
+                worker.kill()
+                worker.join()
+
+
+def _start_worker(context, i: int, state_dir: str, kwargs: dict) -> multiprocessing.Process:
+    worker = context.Process(
+        target=_run_worker,
+        kwargs={**kwargs, 'state_dir': str(Path(state_dir) / f'worker_{i}')},
+        name=f'trade_to_ohlc_worker_{i}',
+    )
+    worker.start()
+    logger.info(f'Started worker {i} (pid {worker.pid})')
+    return worker
+
+
+def _run_worker(**kwargs) -> None:
+    """
+    The entry point of a worker process.
+    """
+    from src.main import transform_trade_to_ohlcv
+
+    transform_trade_to_ohlcv(**kwargs)
@@ -0,0 +1,226 @@
+import json
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from confluent_kafka import TopicPartition
+
+from src.batch_ohlc import BatchCandleAggregator, transform_trade_to_ohlcv_batch
+from src.candle_rollup import CandleRollup
+from src.wire_format import TRADE_V1, encode
+
+WINDOW_SECONDS = [1, 60, 300]
+
+
+def _random_trades(rng: np.random.Generator, n_trades: int) -> List[dict]:
+    """
+    Trades of two products over about half an hour, with a random walk of the price,
+    several trades in the same millisecond, and about 5% of them arriving late, up to
+    3 seconds after the trades that follow them.
+    """
+    timestamp_ms = 1_700_000_000_000 + np.cumsum(rng.integers(0, 400, n_trades))
+    late = rng.random(n_trades) < 0.05
+    timestamp_ms[late] -= rng.integers(0, 3000, late.sum())
+
+    product_id = rng.choice(['BTC/USD', 'ETH/USD'], n_trades)
+    price = 100.0 * np.exp(np.cumsum(rng.normal(0, 1e-3, n_trades)))
+    quantity = rng.exponential(1.0, n_trades)
+
+    return [
+        {
+            'product_id': str(product_id[i]),
+            'price': float(price[i]),
+            'quantity': float(quantity[i]),
+            'timestamp_ms': int(timestamp_ms[i]),
+        }
+        for i in range(n_trades)
+    ]
+
+
+def _streaming_candles(trades: List[dict]) -> List[dict]:
+    rollup = CandleRollup(WINDOW_SECONDS)
+    open_candles: Dict[str, dict] = {}
+
+    candles = []
+    for trade in trades:
+        candles += rollup.update(open_candles.setdefault(trade['product_id'], {}), trade)
+    return candles
+
+
+def _batch_candles(trades: List[dict], rng: np.random.Generator) -> List[dict]:
+    aggregator = BatchCandleAggregator(WINDOW_SECONDS)
+
+    candles = []
+    start = 0
+    while start < len(trades):
+        chunk = trades[start:start + int(rng.integers(1, 500))]
+        candles += aggregator.add(
+            product_id=np.array([trade['product_id'] for trade in chunk]),
+            price=np.array([trade['price'] for trade in chunk]),
+            quantity=np.array([trade['quantity'] for trade in chunk]),
+            timestamp_ms=np.array([trade['timestamp_ms'] for trade in chunk]),
+        )
+        start += len(chunk)
+    return candles
+
+
+def _key(candle: dict) -> tuple:
+    return (candle['product_id'], candle['window_seconds'], candle['timestamp_ms'])
+
+
+def _by_window(candles: List[dict]) -> Dict[tuple, dict]:
+    return {_key(candle): candle for candle in candles}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_candles_match_the_streaming_ones(seed):
+    rng = np.random.default_rng(seed)
+    trades = _random_trades(rng, 10_000)
+
+    streaming = _by_window(_streaming_candles(trades))
+    batch = _by_window(_batch_candles(trades, rng))
+
+    # the same closed windows, each with the same candle
+    assert len(streaming) > 100
+    assert batch.keys() == streaming.keys()
+    for key, candle in streaming.items():
+        assert batch[key]['n_trades'] == candle['n_trades']
+        for name in ['open', 'high', 'low', 'close', 'volume', 'vwap', 'realized_variance']:
+            assert batch[key][name] == pytest.approx(candle[name], rel=1e-9, abs=1e-15), (key, name)
+
+
+class _Stop(Exception):
+    """
+    Stops the consumer loop of transform_trade_to_ohlcv_batch
+    """
+
+
+class _Message:
+    def __init__(self, value: bytes, offset: int) -> None:
+        self._value = value
+        self._offset = offset
+
+    def value(self) -> bytes:
+        return self._value
+
+    def offset(self) -> int:
+        return self._offset
+
+    def partition(self) -> int:
+        return 0
+
+    def error(self):
+        return None
+
+
+class _App:
+    """
+    One partition of trades, with its commits, and the candles sent, in place of the
+    Quix Streams application and its Kafka consumer and producer.
+    """
+
+    def __init__(self, trades: List[dict]) -> None:
+        self.messages = [_Message(encode(trade, TRADE_V1), i) for i, trade in enumerate(trades)]
+        self.committed_offset = None
+        self.candles: List[dict] = []
+
+    def run(self, stop_after: int = None, **kwargs) -> None:
+        """
+        Reads the trades from the committed offset. With `stop_after`, it crashes once it
+        has read that many trades, without committing the chunk it was reading.
+        """
+        self._queue = self.messages[self.committed_offset.offset if self.committed_offset else 0:]
+        self._stop_after = stop_after
+        self._drained = False
+        with pytest.raises(_Stop):
+            transform_trade_to_ohlcv_batch(
+                self, 'trades', 'candles', batch_timeout_sec=0.01, **kwargs
+            )
+
+    def get_consumer(self, auto_commit_enable: bool):
+        return self
+
+    def get_producer(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def subscribe(self, topics: List[str], on_assign, on_revoke, on_lost) -> None:
+        on_assign(self, [TopicPartition(topics[0], 0)])
+
+    def committed(self, partitions: list) -> list:
+        return [self.committed_offset] if self.committed_offset else []
+
+    def commit(self, offsets: list, asynchronous: bool) -> None:
+        (self.committed_offset,) = offsets
+        self._drained = not self._queue
+
+    def poll(self, timeout: float):
+        if self._stop_after == 0 or self._drained:
+            raise _Stop
+        if not self._queue:
+            return None
+        if self._stop_after is not None:
+            self._stop_after -= 1
+        return self._queue.pop(0)
+
+    def produce(self, topic: str, key: str, value: bytes) -> None:
+        self.candles.append(json.loads(value))
+
+    def flush(self) -> None:
+        pass
+
+
+def test_a_restart_does_not_send_the_candles_of_other_products_again():
+    # B@100, A@500, B@600, B@1100, with 1-second windows: B's first candle is sent, and
+    # the commit points back to A@500, the first trade of A's open candle
+    trades = [
+        {'product_id': product_id, 'price': price, 'quantity': 1.0, 'timestamp_ms': timestamp_ms}
+        for product_id, price, timestamp_ms in [
+            ('B', 10.0, 100), ('A', 20.0, 500), ('B', 11.0, 600), ('B', 12.0, 1100),
+            ('A', 21.0, 1200), ('B', 13.0, 2100),
+        ]
+    ]
+    app = _App(trades)
+
+    app.run(stop_after=4, window_seconds=[1], batch_max_messages=4)
+    assert app.committed_offset.offset == 1
+    assert [(c['product_id'], c['timestamp_ms'], c['n_trades']) for c in app.candles] == [
+        ('B', 1000, 2)
+    ]
+
+    app.candles.clear()
+    app.run(window_seconds=[1], batch_max_messages=4)
+    assert [(c['product_id'], c['timestamp_ms'], c['n_trades']) for c in app.candles] == [
+        ('A', 1000, 1), ('B', 2000, 1),
+    ]
+
+
+@pytest.mark.parametrize('window_seconds', [[1], WINDOW_SECONDS])
+@pytest.mark.parametrize('seed', range(3))
+def test_restarts_send_the_candles_of_a_single_run(seed, window_seconds):
+    rng = np.random.default_rng(seed)
+    trades = _random_trades(rng, 2_000)
+    for trade in trades:
+        trade['product_id'] = str(rng.choice(['BTC/USD', 'ETH/USD', 'SOL/USD']))
+
+    single_run = _App(trades)
+    single_run.run(window_seconds=window_seconds, batch_max_messages=100)
+    expected = _by_window(single_run.candles)
+    assert len(expected) > 100
+    assert len(expected) == len(single_run.candles)
+
+    # crash at random points, every trade on the same partition
+    app = _App(trades)
+    for stop_after in rng.integers(50, 500, 8):
+        app.run(stop_after=int(stop_after), window_seconds=window_seconds, batch_max_messages=37)
+    app.run(window_seconds=window_seconds, batch_max_messages=37)
+
+    # the same candles, some of them sent twice but with the same values
+    assert _by_window(app.candles).keys() == expected.keys()
+    for candle in app.candles:
+        assert candle == pytest.approx(expected[_key(candle)], rel=1e-9, abs=1e-15)
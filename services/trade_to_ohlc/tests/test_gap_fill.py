@@ -0,0 +1,112 @@
+import json
+from collections import defaultdict
+from typing import Any, List
+
+import numpy as np
+import pytest
+
+from src.candle_rollup import CandleRollup
+from src.gap_fill import PartitionGapFiller
+from tests.test_batch_ohlc import WINDOW_SECONDS, _App, _by_window, _key, _random_trades
+
+
+class _State:
+    """
+    The state of a key, serialized to JSON like the state store of Quix Streams does
+    """
+
+    def __init__(self) -> None:
+        self._values = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return json.loads(self._values[key]) if key in self._values else default
+
+    def set(self, key: str, value: Any) -> None:
+        self._values[key] = json.dumps(value)
+
+
+def _streaming_candles(trades: List[dict], window_seconds: List[int], grace_ms: int = 0) -> List[dict]:
+    gap_filler = PartitionGapFiller(CandleRollup(window_seconds), grace_ms=grace_ms)
+    states = defaultdict(_State)
+    partition_state = _State()
+
+    candles = []
+    for trade in trades:
+        candles += gap_filler.update(
+            trade, states[trade['product_id']], partition_state, state_of=states.__getitem__
+        )
+    return candles
+
+
+def _batch_candles(trades: List[dict], window_seconds: List[int], grace_ms: int = 0) -> List[dict]:
+    app = _App(trades)
+    app.run(
+        window_seconds=window_seconds,
+        batch_max_messages=37,
+        gap_fill=True,
+        gap_fill_grace_ms=grace_ms,
+    )
+    return app.candles
+
+
+@pytest.mark.parametrize('candles_of', [_streaming_candles, _batch_candles])
+def test_a_quiet_product_gets_candles_while_another_trades(candles_of):
+    # A trades once, B every half second up to 5.2 seconds
+    trades = [{'product_id': 'A', 'price': 10.0, 'quantity': 1.0, 'timestamp_ms': 100}] + [
+        {'product_id': 'B', 'price': 20.0, 'quantity': 1.0, 'timestamp_ms': timestamp_ms}
+        for timestamp_ms in range(200, 5201, 500)
+    ]
+
+    candles = candles_of(trades, [1])
+
+    # A's candle, and then one empty candle for every window that ended since
+    assert [
+        (c['timestamp_ms'], c['n_trades'], c['close'])
+        for c in candles if c['product_id'] == 'A'
+    ] == [(1000, 1, 10.0), (2000, 0, 10.0), (3000, 0, 10.0), (4000, 0, 10.0), (5000, 0, 10.0)]
+    assert [c['timestamp_ms'] for c in candles if c['product_id'] == 'B'] == [
+        1000, 2000, 3000, 4000, 5000
+    ]
+
+
+@pytest.mark.parametrize('candles_of', [_streaming_candles, _batch_candles])
+def test_the_trades_of_a_window_closed_by_the_partition_are_dropped(candles_of):
+    trades = [
+        {'product_id': product_id, 'price': price, 'quantity': 1.0, 'timestamp_ms': timestamp_ms}
+        for product_id, price, timestamp_ms in [
+            ('A', 10.0, 100), ('B', 20.0, 1500), ('A', 11.0, 900), ('A', 12.0, 1600),
+            ('B', 21.0, 2100),
+        ]
+    ]
+
+    # A@900 is 600 ms behind B@1500: dropped without a grace period, in time with one
+    for grace_ms, n_trades in [(0, 1), (1000, 2)]:
+        (candle,) = [
+            c for c in candles_of(trades, [1], grace_ms)
+            if c['product_id'] == 'A' and c['timestamp_ms'] == 1000
+        ]
+        assert candle['n_trades'] == n_trades
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_streaming_and_batch_fill_the_same_candles(seed):
+    rng = np.random.default_rng(seed)
+    trades = _random_trades(rng, 3_000)
+    # SOL/USD goes quiet for the second half
+    for trade in trades[:1_500]:
+        if rng.random() < 0.2:
+            trade['product_id'] = 'SOL/USD'
+
+    streaming = _streaming_candles(trades, WINDOW_SECONDS, grace_ms=1000)
+    batch = _batch_candles(trades, WINDOW_SECONDS, grace_ms=1000)
+
+    # every window once, the quiet product up to the end
+    assert len(_by_window(streaming)) == len(streaming)
+    assert len(_by_window(batch)) == len(batch)
+    assert _by_window(batch).keys() == _by_window(streaming).keys()
+    last_ms = max(trade['timestamp_ms'] for trade in trades) - 1000
+    assert max(c['timestamp_ms'] for c in streaming if c['product_id'] == 'SOL/USD') == (
+        last_ms - last_ms % 1000
+    )
+    for candle in batch:
+        assert candle == pytest.approx(_by_window(streaming)[_key(candle)], rel=1e-9, abs=1e-15)